@@ -1,24 +1,34 @@
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
-from aiogram.filters import StateFilter
+from aiogram.filters import Command, CommandObject, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from datetime import datetime
 import html
+import logging
 import math
 
-from database import Database
+from database import FeedbackSummary, summarize
+from dedup import DuplicateDetector
+from storage import FeedbackStorage, MaintenanceStorage
 from keyboards import *
 from config import FEEDBACK_CATEGORIES, FEEDBACK_TYPES, FEEDBACK_STATUSES, ADMIN_IDS
+from outbox import outbox_message
+from search import search_terms, snippet
+from export import (
+    XLSX_MAX_ROWS, ExportError, is_export_running, parse_export_args, start_export_job
+)
 
-router = Router()
+router = Router(name="admin")
+logger = logging.getLogger(__name__)
 
 # Состояния для админки
 class AdminStates(StatesGroup):
     waiting_for_response = State()
+    waiting_for_search = State()
 
 @router.message(F.text == "👨‍💼 Админ-панель")
-async def admin_panel(message: Message, db: Database):
+async def admin_panel(message: Message, db: FeedbackStorage):
     """Главная админ-панель"""
     user_id = message.from_user.id
     
@@ -48,7 +58,7 @@ async def admin_panel(message: Message, db: Database):
     )
 
 @router.callback_query(F.data == "admin_panel")
-async def admin_panel_callback(callback: CallbackQuery, db: Database):
+async def admin_panel_callback(callback: CallbackQuery, state: FSMContext, db: FeedbackStorage):
     """Возврат в админ-панель"""
     user_id = callback.from_user.id
     
@@ -56,6 +66,10 @@ async def admin_panel_callback(callback: CallbackQuery, db: Database):
         await callback.answer("❌ У вас нет доступа к админ-панели.")
         return
     
+    # Выход из ввода поискового запроса
+    if await state.get_state() == AdminStates.waiting_for_search.state:
+        await state.set_state(None)
+    
     # Получаем статистику
     stats = await db.get_stats()
     
@@ -78,7 +92,7 @@ async def admin_panel_callback(callback: CallbackQuery, db: Database):
     )
 
 @router.callback_query(F.data.startswith("admin_"))
-async def admin_actions(callback: CallbackQuery, db: Database):
+async def admin_actions(callback: CallbackQuery, state: FSMContext, db: FeedbackStorage):
     """Обработка админских действий"""
     user_id = callback.from_user.id
     
@@ -88,26 +102,59 @@ async def admin_actions(callback: CallbackQuery, db: Database):
     
     action = callback.data.split("_")[1]
     
-    if action == "new":
-        await show_feedback_list(callback, db, "new", "🆕 Новые заявки")
-    elif action == "progress":
-        await show_feedback_list(callback, db, "in_progress", "⏳ Заявки в работе")
-    elif action == "closed":
-        await show_feedback_list(callback, db, "closed", "✅ Закрытые заявки")
+    if action in LIST_VIEWS:
+        await show_feedback_list(callback, db, action)
     elif action == "stats":
         await show_detailed_stats(callback, db)
     elif action == "search":
-        await show_category_search(callback, db)
+        await show_search(callback, state)
+
+# Списки заявок: ключ -> (статус, заголовок)
+LIST_VIEWS = {
+    "new": ("new", "🆕 Новые заявки"),
+    "progress": ("in_progress", "⏳ Заявки в работе"),
+    "closed": ("closed", "✅ Закрытые заявки")
+}
+
+def resolve_list_view(view: str):
+    """Фильтры и заголовок списка по ключу: статус или 'cat_<категория>'"""
+    if view.startswith("cat_"):
+        category_name = FEEDBACK_CATEGORIES[view[4:]]
+        return None, category_name, f"🔍 Поиск: {category_name}"
+    
+    status, title = LIST_VIEWS[view]
+    return status, None, title
+
+def format_feedback_item(feedback: FeedbackSummary, admin_id: int, preview: str = None) -> str:
+    """Заявка в списке; preview — текст для показа (HTML), по умолчанию начало текста заявки"""
+    feedback_type = FEEDBACK_TYPES.get(feedback.feedback_type, feedback.feedback_type)
+    
+    sender = f"{feedback.first_name or ''} {feedback.last_name or ''}".strip()
+    if feedback.username:
+        sender += f" (@{feedback.username})"
+    
+    text = f"<b>#{feedback.id}</b> - {feedback_type}\n"
+    if feedback.duplicate_of:
+        text += f"🔁 Дубликат #{feedback.duplicate_of}\n"
+    text += f"📂 {feedback.category}\n"
+    text += f"👤 {sender}\n"
+    text += f"📅 {feedback.created_at[:16]}\n"
+    text += f"💬 {feedback.preview if preview is None else preview}\n"
+    text += f"<a href='tg://user?id={admin_id}'>Подробнее #{feedback.id}</a>\n\n"
+    return text
 
-async def show_feedback_list(callback: CallbackQuery, db: Database, status: str, title: str, page: int = 1):
+async def show_feedback_list(callback: CallbackQuery, db: FeedbackStorage, view: str,
+                             page: int = 1, cursor: str = None, direction: str = 'next'):
     """Показать список заявок"""
     per_page = 5
-    offset = (page - 1) * per_page
+    status, category, title = resolve_list_view(view)
     
-    # Получаем заявки
-    all_feedback = await db.get_feedback_list(status=status, limit=100)
-    total_count = len(all_feedback)
-    feedback_list = all_feedback[offset:offset + per_page]
+    # Получаем одну страницу заявок
+    result = await db.get_feedback_page(
+        status=status, category=category, cursor=cursor,
+        direction=direction, limit=per_page
+    )
+    feedback_list = result['items']
     
     if not feedback_list:
         await callback.message.edit_text(
@@ -119,23 +166,18 @@ async def show_feedback_list(callback: CallbackQuery, db: Database, status: str,
     text = f"<b>{title}</b>\n\n"
     
     for feedback in feedback_list:
-        feedback_type = FEEDBACK_TYPES.get(feedback['feedback_type'], feedback['feedback_type'])
-        
-        sender = f"{feedback['first_name'] or ''} {feedback['last_name'] or ''}".strip()
-        if feedback['username']:
-            sender += f" (@{feedback['username']})"
-        
-        text += f"<b>#{feedback['id']}</b> - {feedback_type}\n"
-        text += f"📂 {feedback['category']}\n"
-        text += f"👤 {sender}\n"
-        text += f"📅 {feedback['created_at'][:16]}\n"
-        text += f"💬 {feedback['message'][:100]}{'...' if len(feedback['message']) > 100 else ''}\n"
-        text += f"<a href='tg://user?id={callback.from_user.id}'>Подробнее #{feedback['id']}</a>\n\n"
+        text += format_feedback_item(feedback, callback.from_user.id)
     
     # Пагинация
-    total_pages = math.ceil(total_count / per_page)
-    if total_pages > 1:
-        keyboard = get_pagination_keyboard(page, total_pages, f"admin_{status}")
+    if result['prev_cursor'] or result['next_cursor']:
+        total_count = await db.count_feedback(status=status, category=category,
+                                              include_archive=True)
+        total_pages = max(page, math.ceil(total_count / per_page))
+        keyboard = get_pagination_keyboard(
+            page, total_pages, f"alist:{view}",
+            prev_cursor=result['prev_cursor'],
+            next_cursor=result['next_cursor']
+        )
     else:
         keyboard = get_back_keyboard()
     
@@ -145,8 +187,8 @@ async def show_feedback_list(callback: CallbackQuery, db: Database, status: str,
         parse_mode="HTML"
     )
 
-@router.callback_query(F.data.startswith("admin_") & F.data.contains("_page_"))
-async def admin_pagination(callback: CallbackQuery, db: Database):
+@router.callback_query(F.data.startswith("alist:"))
+async def admin_pagination(callback: CallbackQuery, db: FeedbackStorage):
     """Обработка пагинации в админке"""
     user_id = callback.from_user.id
     
@@ -154,58 +196,37 @@ async def admin_pagination(callback: CallbackQuery, db: Database):
         await callback.answer("❌ У вас нет доступа к админ-панели.")
         return
     
-    parts = callback.data.split("_")
-    status = parts[1]
-    page = int(parts[3])
-    
-    title_map = {
-        "new": "🆕 Новые заявки",
-        "progress": "⏳ Заявки в работе", 
-        "closed": "✅ Закрытые заявки"
-    }
+    _, view, page, direction, cursor = callback.data.split(":", 4)
     
-    await show_feedback_list(callback, db, status, title_map[status], page)
+    await show_feedback_list(
+        callback, db, view, int(page), cursor=cursor,
+        direction='prev' if direction == 'p' else 'next'
+    )
+    await callback.answer()
 
-async def show_detailed_stats(callback: CallbackQuery, db: Database):
+async def show_detailed_stats(callback: CallbackQuery, db: FeedbackStorage):
     """Показать детальную статистику"""
-    stats = await db.get_stats()
-    
-    # Получаем статистику по категориям
-    all_feedback = await db.get_feedback_list(limit=1000)
-    
-    category_stats = {}
-    type_stats = {"complaint": 0, "suggestion": 0}
-    
-    for feedback in all_feedback:
-        # Статистика по категориям
-        category = feedback['category']
-        if category not in category_stats:
-            category_stats[category] = {"total": 0, "new": 0, "in_progress": 0, "closed": 0}
-        
-        category_stats[category]["total"] += 1
-        category_stats[category][feedback['status']] += 1
-        
-        # Статистика по типам
-        if feedback['feedback_type'] in type_stats:
-            type_stats[feedback['feedback_type']] += 1
+    breakdown = await db.get_breakdown()
+    by_status = breakdown['by_status']
+    by_type = breakdown['by_type']
     
     text = f"""
 <b>📊 Детальная статистика</b>
 
 <b>Общая статистика:</b>
-• Всего заявок: {stats['total']}
-• Новые: {stats['new']}
-• В работе: {stats['in_progress']}
-• Закрытые: {stats['closed']}
+• Всего заявок: {breakdown['total']}
+• Новые: {by_status['new']}
+• В работе: {by_status['in_progress']}
+• Закрытые: {by_status['closed']}
 
 <b>По типам:</b>
-• Жалобы: {type_stats['complaint']}
-• Предложения: {type_stats['suggestion']}
+• Жалобы: {by_type.get('complaint', 0)}
+• Предложения: {by_type.get('suggestion', 0)}
 
 <b>По категориям:</b>
 """
     
-    for category, cat_stats in category_stats.items():
+    for category, cat_stats in breakdown['by_category'].items():
         text += f"\n<b>{category}:</b>\n"
         text += f"  • Всего: {cat_stats['total']}\n"
         text += f"  • Новые: {cat_stats['new']}\n"
@@ -218,9 +239,119 @@ async def show_detailed_stats(callback: CallbackQuery, db: Database):
         parse_mode="HTML"
     )
 
-async def show_category_search(callback: CallbackQuery, db: Database):
-    """Показать поиск по категориям"""
-    text = "<b>🔍 Поиск по категориям</b>\n\nВыберите категорию:"
+@router.message(Command("rebuild_stats"))
+async def rebuild_stats(message: Message, db: FeedbackStorage):
+    """Пересчет счетчиков статистики по таблице заявок"""
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("❌ У вас нет доступа к админ-панели.")
+        return
+    
+    result = await db.rebuild_counters()
+    
+    await message.answer(
+        f"✅ Счетчики статистики пересчитаны.\n"
+        f"Строк: {result['rows']}, исправлено расхождений: {result['fixed']}."
+    )
+
+@router.message(Command("export"))
+async def export_feedback(message: Message, command: CommandObject, db: FeedbackStorage):
+    """Выгрузка заявок в файл: /export [csv|jsonl|xlsx] [status=] [category=] [type=] [from=] [to=]"""
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("❌ У вас нет доступа к админ-панели.")
+        return
+
+    try:
+        fmt, filters = parse_export_args(command.args)
+    except ExportError as e:
+        await message.answer(
+            f"❌ {html.escape(str(e))}\n\n"
+            "Использование: <code>/export [csv|jsonl|xlsx] [status=new] [category=hr] "
+            "[type=complaint] [from=2024-01-01] [to=2024-12-31]</code>",
+            parse_mode="HTML"
+        )
+        return
+
+    if is_export_running(message.chat.id):
+        await message.answer("⏳ Предыдущая выгрузка еще выполняется.")
+        return
+
+    total = await db.count_feedback(**filters, include_archive=True)
+    if total == 0:
+        await message.answer("📭 Нет заявок по заданным фильтрам.")
+        return
+    if fmt == "xlsx" and total > XLSX_MAX_ROWS:
+        await message.answer(
+            f"❌ {total} заявок не помещаются на лист Excel, выберите CSV или сузьте фильтры."
+        )
+        return
+
+    progress = await message.answer(f"⏳ Выгрузка {fmt.upper()}: 0 из {total}")
+    start_export_job(message.bot, db, message.chat.id, progress.message_id, fmt, filters, total)
+
+@router.message(Command("vacuum"))
+async def vacuum_database(message: Message, db: FeedbackStorage):
+    """Однократный VACUUM: сжатие файла БД и включение incremental_vacuum"""
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("❌ У вас нет доступа к админ-панели.")
+        return
+    
+    if not isinstance(db, MaintenanceStorage):
+        await message.answer("ℹ️ Хранилище в памяти не требует VACUUM.")
+        return
+    
+    before = await db.get_archive_stats()
+    await message.answer("⏳ Выполняется VACUUM, запись в базу приостановлена...")
+    await db.vacuum()
+    after = await db.get_archive_stats()
+    
+    await message.answer(
+        f"✅ VACUUM выполнен, режим: {await db.get_vacuum_mode()}.\n"
+        f"Страниц: {before['page_count']} → {after['page_count']}.\n"
+        f"Заявок в работе: {after['hot']}, в архиве: {after['archived']}."
+    )
+
+@router.message(Command("slow_queries"))
+async def slow_queries(message: Message, db: FeedbackStorage):
+    """Самые затратные запросы к БД по данным профилировщика"""
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("❌ У вас нет доступа к админ-панели.")
+        return
+
+    if db.profiler is None:
+        await message.answer("ℹ️ Профилирование запросов выключено (DB_PROFILE_QUERIES).")
+        return
+
+    stats = db.get_query_stats(limit=10)
+    if not stats:
+        await message.answer("📭 Запросов пока не было.")
+        return
+
+    text = "<b>🐢 Самые затратные запросы</b>\n\n"
+    for row in stats:
+        shape = row['shape'] if len(row['shape']) <= 200 else row['shape'][:200] + "…"
+        text += (
+            f"<code>{html.escape(shape)}</code>\n"
+            f"Вызовов: {row['calls']}, всего {row['total_time'] * 1000:.0f} мс, "
+            f"среднее {row['avg_time'] * 1000:.1f} мс, макс. {row['max_time'] * 1000:.1f} мс"
+        )
+        if row['slow']:
+            text += f", медленных: {row['slow']}"
+        if row['scanned_tables']:
+            text += f"\n⚠️ Полный проход: {', '.join(row['scanned_tables'])}"
+        text += "\n\n"
+
+    await message.answer(text, parse_mode="HTML")
+
+async def show_search(callback: CallbackQuery, state: FSMContext):
+    """Ввод поискового запроса или выбор категории"""
+    text = (
+        "<b>🔍 Поиск</b>\n\n"
+        "Отправьте слова для поиска по тексту заявок и ответов, например: "
+        "<code>конвейер шум</code>\n"
+        "Фильтры, как у /export: <code>status=new category=tpa "
+        "type=complaint from=2024-05-01 to=2024-05-31</code>\n\n"
+        "Или выберите категорию:"
+    )
     
     keyboard_buttons = []
     for key, value in FEEDBACK_CATEGORIES.items():
@@ -230,10 +361,95 @@ async def show_category_search(callback: CallbackQuery, db: Database):
     
     keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
     
+    await state.set_state(AdminStates.waiting_for_search)
     await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
 
+def parse_search_query(text: str):
+    """Основы слов и фильтры запроса; ошибка фильтра — ExportError"""
+    words, filter_tokens = [], []
+    for token in text.split():
+        (filter_tokens if "=" in token else words).append(token)
+    _, filters = parse_export_args(" ".join(filter_tokens))
+    return search_terms(" ".join(words)), filters
+
+async def render_search_page(db: FeedbackStorage, search: dict, admin_id: int,
+                             page: int = 1, cursor: str = None, direction: str = 'next'):
+    """Текст и клавиатура страницы результатов поиска"""
+    per_page = 5
+    result = await db.search_feedback(
+        search['terms'], **search['filters'],
+        cursor=cursor, direction=direction, limit=per_page
+    )
+    
+    text = f"<b>🔍 {html.escape(search['query'])}</b>\nНайдено: {search['total']}\n\n"
+    for feedback in result['items']:
+        # Результаты поиска — полные строки: фрагмент вокруг совпадения берется из всего текста
+        text += format_feedback_item(summarize(feedback), admin_id,
+                                     snippet(feedback['message'], search['terms']))
+    
+    if result['prev_cursor'] or result['next_cursor']:
+        total_pages = max(page, math.ceil(search['total'] / per_page))
+        keyboard = get_pagination_keyboard(
+            page, total_pages, "asearch",
+            prev_cursor=result['prev_cursor'],
+            next_cursor=result['next_cursor']
+        )
+    else:
+        keyboard = get_back_keyboard()
+    return text, keyboard
+
+@router.message(AdminStates.waiting_for_search, F.text)
+async def process_search(message: Message, state: FSMContext, db: FeedbackStorage):
+    """Полнотекстовый поиск заявок по запросу администратора"""
+    if message.from_user.id not in ADMIN_IDS:
+        await state.clear()
+        return
+    
+    try:
+        terms, filters = parse_search_query(message.text)
+    except ExportError as e:
+        await message.answer(f"❌ {html.escape(str(e))}")
+        return
+    
+    if not terms:
+        await message.answer("❌ Введите хотя бы одно слово для поиска.")
+        return
+    
+    total = await db.count_search(terms, **filters)
+    if total == 0:
+        await message.answer("📭 Ничего не найдено. Измените запрос.")
+        return
+    
+    # Запрос нужен для листания страниц; ввод поиска завершен
+    search = {'query': message.text, 'terms': terms, 'filters': filters, 'total': total}
+    await state.set_state(None)
+    await state.update_data(search=search)
+    
+    text, keyboard = await render_search_page(db, search, message.from_user.id)
+    await message.answer(text, reply_markup=keyboard, parse_mode="HTML")
+
+@router.callback_query(F.data.startswith("asearch:"))
+async def search_pagination(callback: CallbackQuery, state: FSMContext, db: FeedbackStorage):
+    """Листание результатов поиска"""
+    if callback.from_user.id not in ADMIN_IDS:
+        await callback.answer("❌ У вас нет доступа к админ-панели.")
+        return
+    
+    search = (await state.get_data()).get('search')
+    if search is None:
+        await callback.answer("Результаты поиска устарели, повторите поиск.")
+        return
+    
+    _, page, direction, cursor = callback.data.split(":", 3)
+    text, keyboard = await render_search_page(
+        db, search, callback.from_user.id, int(page), cursor=cursor,
+        direction='prev' if direction == 'p' else 'next'
+    )
+    await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
+    await callback.answer()
+
 @router.callback_query(F.data.startswith("search_cat_"))
-async def search_by_category(callback: CallbackQuery, db: Database):
+async def search_by_category(callback: CallbackQuery, state: FSMContext, db: FeedbackStorage):
     """Поиск заявок по категории"""
     user_id = callback.from_user.id
     
@@ -241,13 +457,13 @@ async def search_by_category(callback: CallbackQuery, db: Database):
         await callback.answer("❌ У вас нет доступа к админ-панели.")
         return
     
-    category_key = callback.data.split("_")[2]
-    category_name = FEEDBACK_CATEGORIES[category_key]
+    category_key = callback.data[len("search_cat_"):]
     
-    await show_feedback_list(callback, db, None, f"🔍 Поиск: {category_name}", category=category_name)
+    await state.set_state(None)
+    await show_feedback_list(callback, db, f"cat_{category_key}")
 
 @router.callback_query(F.data.startswith("reply_"))
-async def reply_to_feedback(callback: CallbackQuery, state: FSMContext, db: Database):
+async def reply_to_feedback(callback: CallbackQuery, state: FSMContext, db: FeedbackStorage):
     """Ответ на заявку"""
     user_id = callback.from_user.id
     
@@ -274,7 +490,8 @@ async def reply_to_feedback(callback: CallbackQuery, state: FSMContext, db: Data
     await state.set_state(AdminStates.waiting_for_response)
 
 @router.message(AdminStates.waiting_for_response)
-async def process_admin_response(message: Message, state: FSMContext, db: Database):
+async def process_admin_response(message: Message, state: FSMContext, db: FeedbackStorage,
+                                 dedup: DuplicateDetector = None):
     """Обработка ответа админа"""
     data = await state.get_data()
     feedback_id = data['feedback_id']
@@ -287,18 +504,13 @@ async def process_admin_response(message: Message, state: FSMContext, db: Databa
         await state.clear()
         return
     
-    # Обновляем заявку
-    await db.update_feedback_status(
-        feedback_id=feedback_id,
-        status="closed",
-        admin_id=message.from_user.id,
-        admin_response=admin_response
-    )
-    
-    # Отправляем ответ пользователю (если не анонимно)
-    if not feedback['is_anonymous'] and feedback['user_id']:
-        try:
-            user_message = f"""
+    # Ответ пользователю (если не анонимно) уходит через outbox
+    # в той же транзакции, что и закрытие заявки
+    def user_notifications(feedback_id: int):
+        if feedback['is_anonymous'] or not feedback['user_id']:
+            return []
+        
+        user_message = f"""
 ✅ <b>Получен ответ на вашу заявку #{feedback_id}</b>
 
 <b>Ваше сообщение:</b>
@@ -309,14 +521,20 @@ async def process_admin_response(message: Message, state: FSMContext, db: Databa
 
 <b>Дата ответа:</b> {datetime.now().strftime('%d.%m.%Y %H:%M')}
 """
-            
-            await message.bot.send_message(
-                feedback['user_id'],
-                user_message,
-                parse_mode="HTML"
-            )
-        except Exception as e:
-            print(f"Ошибка отправки ответа пользователю {feedback['user_id']}: {e}")
+        return [outbox_message(feedback['user_id'], user_message)]
+    
+    # Обновляем заявку
+    updated = await db.update_feedback_status(
+        feedback_id=feedback_id,
+        status="closed",
+        admin_id=message.from_user.id,
+        admin_response=admin_response,
+        notifications=user_notifications
+    )
+    
+    # Закрытая заявка больше не оригинал для дубликатов
+    if updated and dedup is not None:
+        dedup.discard(feedback_id)
     
     await message.answer(
         f"✅ Ответ на заявку #{feedback_id} отправлен и заявка закрыта.",
@@ -326,7 +544,7 @@ async def process_admin_response(message: Message, state: FSMContext, db: Databa
     await state.clear()
 
 @router.callback_query(F.data.startswith("progress_"))
-async def set_in_progress(callback: CallbackQuery, db: Database):
+async def set_in_progress(callback: CallbackQuery, db: FeedbackStorage):
     """Перевести заявку в статус 'в работе'"""
     user_id = callback.from_user.id
     
@@ -336,7 +554,8 @@ async def set_in_progress(callback: CallbackQuery, db: Database):
     
     feedback_id = int(callback.data.split("_")[1])
     
-    await db.update_feedback_status(
+    # Обновленная заявка возвращается тем же запросом
+    feedback = await db.update_feedback_status(
         feedback_id=feedback_id,
         status="in_progress",
         admin_id=user_id
@@ -345,14 +564,14 @@ async def set_in_progress(callback: CallbackQuery, db: Database):
     await callback.answer("✅ Заявка переведена в работу.")
     
     # Обновляем сообщение
-    feedback = await db.get_feedback_by_id(feedback_id)
     if feedback:
         await callback.message.edit_reply_markup(
             reply_markup=get_feedback_action_keyboard(feedback_id)
         )
 
 @router.callback_query(F.data.startswith("close_"))
-async def close_feedback(callback: CallbackQuery, db: Database):
+async def close_feedback(callback: CallbackQuery, db: FeedbackStorage,
+                         dedup: DuplicateDetector = None):
     """Закрыть заявку без ответа"""
     user_id = callback.from_user.id
     
@@ -362,16 +581,18 @@ async def close_feedback(callback: CallbackQuery, db: Database):
     
     feedback_id = int(callback.data.split("_")[1])
     
-    await db.update_feedback_status(
+    # Обновленная заявка возвращается тем же запросом
+    feedback = await db.update_feedback_status(
         feedback_id=feedback_id,
         status="closed",
         admin_id=user_id
     )
+    if feedback and dedup is not None:
+        dedup.discard(feedback_id)
     
     await callback.answer("✅ Заявка закрыта.")
     
     # Обновляем сообщение
-    feedback = await db.get_feedback_by_id(feedback_id)
     if feedback:
         await callback.message.edit_reply_markup(
             reply_markup=get_feedback_action_keyboard(feedback_id)
@@ -0,0 +1,102 @@
+"""
+Архивирование старых закрытых заявок.
+
+Archiver периодически переносит закрытые заявки, которые не менялись
+дольше заданного срока, из рабочей таблицы feedback в feedback_archive
+(текст сообщения и ответа при этом сжимается). Рабочая таблица и ее
+индексы остаются небольшими и помещаются в страничный кэш, а статистика
+не меняется: счетчики учитывают обе таблицы. Перенос идет пачками,
+освободившиеся страницы возвращаются ОС через PRAGMA incremental_vacuum
+небольшими шагами с паузами, чтобы не задерживать другие записи.
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+from storage import MaintenanceStorage
+
+logger = logging.getLogger(__name__)
+
+
+class Archiver:
+    """Фоновый перенос закрытых заявок в архив"""
+
+    def __init__(self, db: MaintenanceStorage, older_than_days: float = 90,
+                 interval: float = 6 * 3600, batch_size: int = 500,
+                 compress: bool = True, vacuum_pages: int = 256,
+                 pause: float = 0.05):
+        self.db = db
+        self.older_than_days = older_than_days
+        self.interval = interval
+        self.batch_size = batch_size
+        self.compress = compress
+        self.vacuum_pages = vacuum_pages
+        self.pause = pause
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {'runs': 0, 'archived': 0, 'vacuumed_pages': 0}
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="archiver")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        if await self.db.get_vacuum_mode() != 'incremental':
+            logger.warning(
+                "База не в режиме auto_vacuum=incremental: место после архивирования "
+                "не возвращается ОС. Выполните однократно /vacuum."
+            )
+
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Ошибка архивирования заявок")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self) -> Dict:
+        """Один проход: перенос всех подходящих заявок и освобождение страниц"""
+        # updated_at хранится в UTC (CURRENT_TIMESTAMP)
+        cutoff = datetime.now(timezone.utc) - timedelta(days=self.older_than_days)
+        cutoff = cutoff.strftime('%Y-%m-%d %H:%M:%S')
+
+        archived = 0
+        while True:
+            moved = await self.db.archive_closed(cutoff, self.batch_size, self.compress)
+            archived += moved
+            if moved < self.batch_size:
+                break
+            # Пауза между пачками пропускает вперед обычные записи
+            await asyncio.sleep(self.pause)
+
+        vacuumed = 0
+        while True:
+            freed = await self.db.incremental_vacuum(self.vacuum_pages)
+            vacuumed += freed
+            if freed == 0:
+                break
+            await asyncio.sleep(self.pause)
+
+        self._stats['runs'] += 1
+        self._stats['archived'] += archived
+        self._stats['vacuumed_pages'] += vacuumed
+        if archived or vacuumed:
+            logger.info("В архив перенесено заявок: %s, освобождено страниц: %s", archived, vacuumed)
+
+        return {'archived': archived, 'vacuumed_pages': vacuumed}
+
+    def stats(self) -> Dict:
+        """Счетчики архивирования"""
+        return dict(self._stats)
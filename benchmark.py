@@ -0,0 +1,563 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный бенчмарк бота.
+
+Прогоняет сценарии через настоящий Dispatcher с handlers.router и
+admin_handlers.router. Обновления генерируются локально, а вместо
+Telegram используется RecordingSession, которая только записывает
+вызовы API. Базы с заданным числом заявок создаются заранее и
+переиспользуются между запусками (каталог bench_data/).
+
+Для каждого сценария выводятся пропускная способность и задержки
+p50/p95/p99 по хендлерам и методам хранилища, а также время чтения и
+память страницы "Мои заявки" полными строками (SELECT *, dict) и
+записями FeedbackSummary. Результаты сохраняются в JSON, чтобы сравнивать
+коммиты:
+
+    python benchmark.py --sizes 10000,100000 --iterations 300
+    python benchmark.py --engine memory --sizes 100000
+    python benchmark.py --sizes 1000000 --output bench_results/big.json
+    python benchmark.py --compare bench_results/old.json
+"""
+
+import argparse
+import asyncio
+import inspect
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+# Переменные окружения для запуска без настоящего бота, ПЕРЕД импортом
+os.environ['TESTING'] = '1'
+os.environ.setdefault('BOT_TOKEN', '123456:benchmark')
+os.environ.setdefault('ADMIN_IDS', '1')
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import (
+    CopyMessage, ForwardMessage, SendDocument, SendMessage, SendPhoto
+)
+from aiogram.types import Chat, Message, Update
+
+from config import ADMIN_IDS, FEEDBACK_CATEGORIES, FEEDBACK_TYPES
+from database import SUMMARY_SELECT, Database, summary_row
+from storage import MemoryStorage
+from outbox import OutboxWorker
+import handlers
+import admin_handlers
+
+SCENARIOS = ("funnel", "my_feedback", "admin_paging", "stats")
+DATA_DIR = "bench_data"
+RESULTS_DIR = "bench_results"
+
+ADMIN_ID = ADMIN_IDS[0]
+SEED_USERS = 5000
+# Страниц в замере чтения строк списка
+ROW_PAGES = 500
+
+_ids = itertools.count(1)
+
+
+class RecordingSession(BaseSession):
+    """Сессия бота, которая записывает вызовы API вместо отправки в Telegram"""
+
+    SENDING_METHODS = (SendMessage, SendDocument, SendPhoto, CopyMessage, ForwardMessage)
+
+    def __init__(self):
+        super().__init__()
+        self.calls = Counter()
+        self.last_markup = {}
+        self._message_ids = itertools.count(1)
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls[type(method).__name__] += 1
+
+        chat_id = getattr(method, 'chat_id', None)
+        if chat_id is not None and hasattr(method, 'reply_markup'):
+            self.last_markup[chat_id] = method.reply_markup
+
+        if isinstance(method, self.SENDING_METHODS):
+            return Message(
+                message_id=next(self._message_ids),
+                date=datetime.now(),
+                chat=Chat(id=chat_id, type="private"),
+                text=getattr(method, 'text', None)
+            )
+        return True
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, url, headers=None, timeout=30,
+                             chunk_size=65536, raise_for_status=True):
+        yield b""
+
+
+class LatencyRecorder:
+    """Накопитель замеров времени по ключам"""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    def add(self, key: str, seconds: float):
+        self.samples[key].append(seconds)
+
+    def summary(self) -> dict:
+        result = {}
+        for key, values in sorted(self.samples.items()):
+            values = sorted(values)
+            result[key] = {
+                'count': len(values),
+                'mean_ms': round(sum(values) / len(values) * 1000, 3),
+                'p50_ms': round(percentile(values, 50) * 1000, 3),
+                'p95_ms': round(percentile(values, 95) * 1000, 3),
+                'p99_ms': round(percentile(values, 99) * 1000, 3),
+                'max_ms': round(values[-1] * 1000, 3),
+            }
+        return result
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+# --- Генерация обновлений -------------------------------------------------
+
+def _user(user_id: int) -> dict:
+    return {'id': user_id, 'is_bot': False, 'first_name': f"Сотрудник {user_id}",
+            'username': f"worker{user_id}"}
+
+
+def message_update(user_id: int, text: str) -> Update:
+    return Update(update_id=next(_ids), message={
+        'message_id': next(_ids),
+        'date': datetime.now(),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': _user(user_id),
+        'text': text,
+    })
+
+
+def callback_update(user_id: int, data: str) -> Update:
+    return Update(update_id=next(_ids), callback_query={
+        'id': str(next(_ids)),
+        'from': _user(user_id),
+        'chat_instance': str(user_id),
+        'data': data,
+        'message': {
+            'message_id': next(_ids),
+            'date': datetime.now(),
+            'chat': {'id': user_id, 'type': 'private'},
+            'text': '...',
+        },
+    })
+
+
+def next_page_callback(session: RecordingSession, chat_id: int):
+    """callback_data кнопки '➡️' из последней клавиатуры чата"""
+    markup = session.last_markup.get(chat_id)
+    if not markup or not getattr(markup, 'inline_keyboard', None):
+        return None
+    for button in markup.inline_keyboard[0]:
+        if button.text == "➡️":
+            return button.callback_data
+    return None
+
+
+# --- Сценарии ---------------------------------------------------------------
+
+async def scenario_funnel(dp, bot, session, user_id):
+    """Отправка заявки: тип → категория → сообщение → подтверждение"""
+    category_key = random.choice(list(FEEDBACK_CATEGORIES))
+    feedback_type = random.choice(list(FEEDBACK_TYPES))
+    for update in (
+        message_update(user_id, "/start"),
+        message_update(user_id, "📝 Оставить обратную связь"),
+        callback_update(user_id, f"type_{feedback_type}"),
+        callback_update(user_id, f"cat_{category_key}"),
+        message_update(user_id, random_message()),
+        callback_update(user_id, "confirm_send"),
+    ):
+        await dp.feed_update(bot, update)
+
+
+async def scenario_my_feedback(dp, bot, session, user_id):
+    """'Мои заявки' и переход на следующую страницу"""
+    await dp.feed_update(bot, message_update(user_id, "📊 Мои заявки"))
+    data = next_page_callback(session, user_id)
+    if data:
+        await dp.feed_update(bot, callback_update(user_id, data))
+
+
+async def scenario_admin_paging(dp, bot, session, user_id):
+    """Список заявок в админ-панели и три страницы вперед"""
+    status = random.choice(("new", "progress", "closed"))
+    await dp.feed_update(bot, callback_update(ADMIN_ID, f"admin_{status}"))
+    for _ in range(3):
+        data = next_page_callback(session, ADMIN_ID)
+        if not data:
+            break
+        await dp.feed_update(bot, callback_update(ADMIN_ID, data))
+
+
+async def scenario_stats(dp, bot, session, user_id):
+    """Админ-панель и детальная статистика"""
+    await dp.feed_update(bot, message_update(ADMIN_ID, "👨‍💼 Админ-панель"))
+    await dp.feed_update(bot, callback_update(ADMIN_ID, "admin_stats"))
+
+
+SCENARIO_FUNCS = {
+    "funnel": scenario_funnel,
+    "my_feedback": scenario_my_feedback,
+    "admin_paging": scenario_admin_paging,
+    "stats": scenario_stats,
+}
+
+
+# --- Подготовка данных ------------------------------------------------------
+
+WORDS = ("станок", "конвейер", "смена", "перерыв", "вентиляция", "пресс-форма",
+         "температура", "склад", "погрузчик", "график", "зарплата", "упаковка",
+         "брак", "сырье", "освещение", "инструмент", "мастер", "столовая")
+
+
+def random_message(rng=random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 60))).capitalize()
+
+
+def seed_path(size: int) -> str:
+    return os.path.join(DATA_DIR, f"seed_{size}.db")
+
+
+async def create_seed(size: int) -> str:
+    """База с size заявками (создается один раз и переиспользуется)"""
+    path = seed_path(size)
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(DATA_DIR, exist_ok=True)
+    tmp_path = path + ".tmp"
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(tmp_path + suffix):
+            os.remove(tmp_path + suffix)
+
+    # Схема создается миграциями, данные вставляются напрямую пачками
+    db = Database(tmp_path)
+    await db.init_db()
+    await db.close()
+
+    rng = random.Random(size)
+    categories = list(FEEDBACK_CATEGORIES.values())
+    types = list(FEEDBACK_TYPES)
+    started = datetime.now() - timedelta(days=730)
+    step = timedelta(days=730) / size
+
+    conn = sqlite3.connect(tmp_path)
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.executemany(
+        "INSERT OR IGNORE INTO users (user_id, username, first_name) VALUES (?, ?, ?)",
+        [(1_000_000 + i, f"worker{i}", f"Сотрудник {i}") for i in range(SEED_USERS)]
+    )
+
+    def rows():
+        for i in range(size):
+            status = rng.choices(("new", "in_progress", "closed"), (2, 1, 7))[0]
+            user_id = 1_000_000 + rng.randrange(SEED_USERS)
+            yield (
+                user_id, f"worker{user_id}", "Сотрудник", None,
+                rng.choice(categories), rng.choice(types), random_message(rng),
+                status, (started + step * i).strftime('%Y-%m-%d %H:%M:%S')
+            )
+
+    conn.executemany("""
+        INSERT INTO feedback
+        (user_id, username, first_name, last_name, category, feedback_type,
+         message, status, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, rows())
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+
+    os.replace(tmp_path, path)
+    return path
+
+
+def _read_pages(conn, query: str, users: list, limit: int, convert) -> list:
+    pages = []
+    for user_id in users:
+        rows = conn.execute(query, (user_id, limit)).fetchall()
+        pages.append([convert(row) for row in rows] if convert else rows)
+    return pages
+
+
+def measure_rows(path: str, pages: int = ROW_PAGES, limit: int = 10) -> dict:
+    """Страницы "Мои заявки" полными строками и FeedbackSummary: время и память страницы"""
+    rng = random.Random(pages)
+    users = [1_000_000 + rng.randrange(SEED_USERS) for _ in range(pages)]
+    variants = {
+        'full': ("*", sqlite3.Row, dict),
+        'summary': (SUMMARY_SELECT, summary_row, None),
+    }
+    conn = sqlite3.connect(path)
+    result = {}
+    try:
+        for name, (columns, factory, convert) in variants.items():
+            conn.row_factory = factory
+            query = (f"SELECT {columns} FROM feedback WHERE user_id = ? "
+                     f"ORDER BY created_at DESC, id DESC LIMIT ?")
+            # Прогрев кэша страниц SQLite, чтобы варианты читали одинаково
+            _read_pages(conn, query, users, limit, convert)
+            started = time.perf_counter()
+            _read_pages(conn, query, users, limit, convert)
+            elapsed = time.perf_counter() - started
+            # Память — отдельным проходом: tracemalloc замедляет выделения
+            tracemalloc.start()
+            kept = _read_pages(conn, query, users, limit, convert)
+            memory, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            result[name] = {
+                'rows': sum(len(page) for page in kept),
+                'page_ms': round(elapsed / pages * 1000, 4),
+                'page_kb': round(memory / pages / 1024, 2),
+            }
+    finally:
+        conn.close()
+    return result
+
+
+# --- Запуск -----------------------------------------------------------------
+
+def instrument_database(db, recorder: LatencyRecorder):
+    """Замер времени всех публичных async-методов хранилища"""
+    for name, func in inspect.getmembers(type(db), inspect.iscoroutinefunction):
+        if name.startswith('_') or name in ('init_db', 'close'):
+            continue
+
+        def wrap(method, key):
+            async def timed(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await method(*args, **kwargs)
+                finally:
+                    recorder.add(key, time.perf_counter() - started)
+            return timed
+
+        setattr(db, name, wrap(getattr(db, name), name))
+
+
+async def run_size(size: int, args) -> dict:
+    seed = await create_seed(size)
+    work_path = os.path.join(DATA_DIR, f"run_{size}.db")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(work_path + suffix):
+            os.remove(work_path + suffix)
+    shutil.copyfile(seed, work_path)
+
+    session = RecordingSession()
+    bot = Bot(token=os.environ['BOT_TOKEN'], session=session)
+    dp = Dispatcher()
+    db = Database(work_path, pool_size=args.pool_size, slow_query_ms=args.slow_query_ms)
+    await db.init_db()
+    if args.engine == 'memory':
+        # Снимок уже мигрированной копии загружается в память целиком
+        await db.close()
+        db = MemoryStorage()
+        db.load_sqlite(work_path)
+
+    handler_times = LatencyRecorder()
+    db_times = LatencyRecorder()
+    instrument_database(db, db_times)
+
+    # Роутеры — модульные синглтоны, поэтому отвязываем их от прошлого запуска
+    for router in (handlers.router, admin_handlers.router):
+        router._parent_router = None
+    dp.include_router(handlers.router)
+    dp.include_router(admin_handlers.router)
+
+    @dp.message.middleware()
+    @dp.callback_query.middleware()
+    async def db_middleware(handler, event, data):
+        data['db'] = db
+        return await handler(event, data)
+
+    @dp.message.middleware()
+    @dp.callback_query.middleware()
+    async def timing_middleware(handler, event, data):
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            handler_times.add(data['handler'].callback.__name__, time.perf_counter() - started)
+
+    outbox_worker = OutboxWorker(db, bot)
+    outbox_worker.start()
+
+    # Админ регистрируется один раз, как после /start
+    await dp.feed_update(bot, message_update(ADMIN_ID, "/start"))
+
+    scenarios = {}
+    semaphore = asyncio.Semaphore(args.concurrency)
+    try:
+        for name in args.scenarios:
+            func = SCENARIO_FUNCS[name]
+
+            async def one(i):
+                async with semaphore:
+                    user_id = 1_000_000 + random.randrange(SEED_USERS)
+                    await func(dp, bot, session, user_id)
+
+            started = time.perf_counter()
+            await asyncio.gather(*(one(i) for i in range(args.iterations)))
+            elapsed = time.perf_counter() - started
+            scenarios[name] = {
+                'iterations': args.iterations,
+                'elapsed_s': round(elapsed, 3),
+                'throughput_per_s': round(args.iterations / elapsed, 1),
+            }
+            print(f"  {name:<14} {args.iterations} итераций за {elapsed:.2f} с "
+                  f"({args.iterations / elapsed:.1f}/с)")
+    finally:
+        await outbox_worker.stop()
+        pool_stats = db.get_pool_stats() if isinstance(db, Database) else {}
+        statements = db.get_query_stats(limit=20) if isinstance(db, Database) else []
+        await db.close()
+
+    return {
+        'size': size,
+        'rows': measure_rows(work_path),
+        'scenarios': scenarios,
+        'handlers': handler_times.summary(),
+        'db': db_times.summary(),
+        'statements': statements,
+        'api_calls': dict(session.calls),
+        'pool': {key: round(value, 6) if isinstance(value, float) else value
+                 for key, value in pool_stats.items()},
+    }
+
+
+def print_table(title: str, summary: dict):
+    print(f"\n  {title}")
+    print(f"  {'':<28}{'count':>8}{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}")
+    for key, stats in summary.items():
+        print(f"  {key:<28}{stats['count']:>8}{stats['p50_ms']:>10.2f}"
+              f"{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}")
+
+
+def print_rows(rows: dict):
+    print(f"\n  Чтение страницы списка ({ROW_PAGES} страниц)")
+    print(f"  {'':<28}{'строк':>8}{'мс':>10}{'КБ':>10}")
+    for name, stats in rows.items():
+        print(f"  {name:<28}{stats['rows']:>8}{stats['page_ms']:>10.3f}{stats['page_kb']:>10.2f}")
+    full, summary = rows['full'], rows['summary']
+    print(f"  {'summary / full':<28}{'':>8}{summary['page_ms'] / full['page_ms']:>10.2f}"
+          f"{summary['page_kb'] / full['page_kb']:>10.2f}")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return "unknown"
+
+
+def compare(old_path: str, new_path: str):
+    """Сравнение p95 по хендлерам и методам БД между двумя запусками"""
+    with open(old_path, encoding='utf-8') as f:
+        old = json.load(f)
+    with open(new_path, encoding='utf-8') as f:
+        new = json.load(f)
+
+    old_runs = {run['size']: run for run in old['runs']}
+    print(f"\nСравнение p95: {old.get('commit')} → {new.get('commit')}")
+    for run in new['runs']:
+        base = old_runs.get(run['size'])
+        if not base:
+            continue
+        print(f"\n  {run['size']} заявок")
+        for section in ('handlers', 'db'):
+            for key, stats in run[section].items():
+                if key not in base[section]:
+                    continue
+                before = base[section][key]['p95_ms']
+                after = stats['p95_ms']
+                change = (after - before) / before * 100 if before else 0.0
+                name = f"{section}:{key}"
+                print(f"  {name:<36}{before:>10.2f}{after:>10.2f}{change:>+9.1f}%")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный бенчмарк бота обратной связи")
+    parser.add_argument("--sizes", default="10000,100000",
+                        help="Размеры баз в заявках через запятую (например 10000,100000,1000000)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"Сценарии через запятую: {', '.join(SCENARIOS)}")
+    parser.add_argument("--iterations", type=int, default=200, help="Итераций на сценарий")
+    parser.add_argument("--concurrency", type=int, default=20, help="Одновременных пользователей")
+    parser.add_argument("--engine", choices=("sqlite", "memory"), default="sqlite",
+                        help="Хранилище: файл SQLite или MemoryStorage")
+    parser.add_argument("--pool-size", type=int, default=4, help="Читателей в пуле БД")
+    parser.add_argument("--slow-query-ms", type=float,
+                        help="Включить профилирование запросов с указанным порогом журнала")
+    parser.add_argument("--output", help="Файл результатов (по умолчанию bench_results/<commit>.json)")
+    parser.add_argument("--compare", help="Сравнить с ранее сохраненными результатами")
+    args = parser.parse_args()
+
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Неизвестные сценарии: {', '.join(sorted(unknown))}")
+
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    random.seed(42)
+
+    results = {
+        'commit': git_commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'params': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'runs': [],
+    }
+
+    for size in sizes:
+        print(f"\n🚀 {size} заявок")
+        run = await run_size(size, args)
+        results['runs'].append(run)
+        print_table("Хендлеры", run['handlers'])
+        print_table("Методы хранилища", run['db'])
+        print_rows(run['rows'])
+        for row in run['statements']:
+            if row['scanned_tables']:
+                print(f"  ⚠️ Полный проход ({', '.join(row['scanned_tables'])}): {row['shape'][:100]}")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{results['commit']}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"\n💾 Результаты сохранены в {output}")
+
+    if args.compare:
+        compare(args.compare, output)
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("\n⏹️ Бенчмарк прерван")
+        sys.exit(1)
@@ -0,0 +1,86 @@
+"""
+Ограниченный кэш записей в памяти: LRU с временем жизни.
+
+Используется Database для заявок, читаемых по номеру: одно действие
+администратора обращается к одной заявке несколько раз подряд. Пути записи
+обновляют (put) или сбрасывают (invalidate) запись сами; TTL ограничивает
+устаревание, если строку изменил другой процесс.
+
+Чтение из БД и запись в кэш разделены ожиданием, поэтому чтение могло
+начаться до изменения строки и вернуть старую версию. Такие результаты
+не сохраняются: fill() принимает метку, полученную до запроса (token()),
+и отбрасывает значение, если после нее была запись.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+
+class TTLCache:
+    """LRU-кэш на max_size записей, каждая живет не дольше ttl секунд"""
+
+    def __init__(self, max_size: int = 1000, ttl: float = 30):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        # Счетчик записей для отбрасывания устаревших результатов чтения
+        self._writes = 0
+        self._stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evicted': 0, 'stale_fills': 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0 and self.ttl > 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        item = self._items.get(key)
+        if item is None:
+            self._stats['misses'] += 1
+            return None
+        expires, value = item
+        if expires <= time.monotonic():
+            del self._items[key]
+            self._stats['expired'] += 1
+            self._stats['misses'] += 1
+            return None
+        self._items.move_to_end(key)
+        self._stats['hits'] += 1
+        return value
+
+    def token(self) -> int:
+        """Метка для fill(): берется до чтения из БД"""
+        return self._writes
+
+    def fill(self, key: Hashable, value: Any, token: int):
+        """Сохранение прочитанного значения, если с метки token не было записей"""
+        if token != self._writes:
+            self._stats['stale_fills'] += 1
+            return
+        self._store(key, value)
+
+    def put(self, key: Hashable, value: Any):
+        """Новое значение от пути записи"""
+        self._writes += 1
+        self._store(key, value)
+
+    def invalidate(self, *keys: Hashable):
+        self._writes += 1
+        for key in keys:
+            self._items.pop(key, None)
+
+    def clear(self):
+        self._writes += 1
+        self._items.clear()
+
+    def _store(self, key: Hashable, value: Any):
+        if not self.enabled:
+            return
+        self._items[key] = (time.monotonic() + self.ttl, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+            self._stats['evicted'] += 1
+
+    def stats(self) -> Dict:
+        """Попадания, промахи и текущий размер"""
+        return {'size': len(self._items), **self._stats}
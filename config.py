@@ -12,6 +12,93 @@ ADMIN_IDS = [int(x.strip()) for x in os.getenv('ADMIN_IDS', '').split(',') if x.
 # Database path
 DATABASE_PATH = os.getenv('DATABASE_PATH', 'feedback.db')
 
+# Движок хранилища: sqlite (один файл), sharded (несколько файлов) или memory
+STORAGE_ENGINE = os.getenv('STORAGE_ENGINE', 'sqlite').lower()
+# Шардирование: число файлов и ключ распределения заявок (category или year)
+DB_SHARDS = int(os.getenv('DB_SHARDS', '4'))
+DB_SHARD_KEY = os.getenv('DB_SHARD_KEY', 'category').lower()
+
+# Количество соединений для чтения в пуле БД
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '4'))
+
+# Групповая запись: максимум операций в транзакции и окно ожидания (мс)
+DB_WRITE_BATCH = int(os.getenv('DB_WRITE_BATCH', '100'))
+DB_WRITE_WINDOW_MS = float(os.getenv('DB_WRITE_WINDOW_MS', '2'))
+
+# Кэш заявок, читаемых по номеру: максимум записей и время жизни (с); 0 отключает
+DB_CACHE_SIZE = int(os.getenv('DB_CACHE_SIZE', '1000'))
+DB_CACHE_TTL = float(os.getenv('DB_CACHE_TTL', '30'))
+
+# Состояния FSM (незаконченные заявки и ответы): sqlite переживает перезапуск, memory — нет
+FSM_STORAGE = os.getenv('FSM_STORAGE', 'memory' if STORAGE_ENGINE == 'memory' else 'sqlite').lower()
+FSM_DATABASE_PATH = os.getenv('FSM_DATABASE_PATH') or os.path.join(os.path.dirname(DATABASE_PATH), 'fsm.db')
+# Кэш состояний в памяти (ключей), забывание брошенных сценариев (ч) и период записи (мс)
+FSM_CACHE_SIZE = int(os.getenv('FSM_CACHE_SIZE', '10000'))
+FSM_TTL_HOURS = float(os.getenv('FSM_TTL_HOURS', '24'))
+FSM_FLUSH_INTERVAL_MS = float(os.getenv('FSM_FLUSH_INTERVAL_MS', '1000'))
+
+# Профилирование запросов к БД: журнал медленных запросов с планом выполнения
+DB_PROFILE_QUERIES = os.getenv('DB_PROFILE_QUERIES', '').lower() in ('1', 'true', 'yes')
+DB_SLOW_QUERY_MS = float(os.getenv('DB_SLOW_QUERY_MS', '100'))
+
+# Лимиты исходящих сообщений Telegram
+OUTBOUND_GLOBAL_RATE = float(os.getenv('OUTBOUND_GLOBAL_RATE', '30'))      # сообщений в секунду
+OUTBOUND_CHAT_RATE = float(os.getenv('OUTBOUND_CHAT_RATE', '1'))           # в секунду на личный чат
+OUTBOUND_GROUP_RATE = float(os.getenv('OUTBOUND_GROUP_RATE', '20')) / 60   # 20 в минуту на группу
+OUTBOUND_MAX_RETRIES = int(os.getenv('OUTBOUND_MAX_RETRIES', '3'))
+
+# Получение апдейтов: polling (long polling) или webhook (HTTP-сервер aiohttp)
+BOT_MODE = os.getenv('BOT_MODE', 'polling').lower()
+# Публичный адрес вебхука для setWebhook, например https://bot.example.com
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '').rstrip('/')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+# Секрет заголовка X-Telegram-Bot-Api-Secret-Token; пустой — случайный при каждом запуске
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+# Одновременно обрабатываемых апдейтов и емкость очереди (сверх нее — ответ 503)
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '16'))
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000'))
+
+# Рабочие процессы: 1 — все в одном процессе, N > 1 — супервизор принимает
+# апдейты и распределяет их по N процессам по хэшу чата
+BOT_WORKERS = int(os.getenv('BOT_WORKERS', '1'))
+# Одновременно обрабатываемых апдейтов в каждом рабочем процессе
+WORKER_CONCURRENCY = int(os.getenv('WORKER_CONCURRENCY', '16'))
+
+# Порт HTTP-сервера метрик Prometheus (/metrics), 0 — отключить
+METRICS_PORT = int(os.getenv('METRICS_PORT', '8000'))
+
+# Контроль задержки событийного цикла: порог отчета о блокировке (мс)
+LOOP_LAG_THRESHOLD_MS = float(os.getenv('LOOP_LAG_THRESHOLD_MS', '250'))
+# Отладочный режим asyncio: предупреждения о медленных колбэках с именами хендлеров
+ASYNCIO_DEBUG = os.getenv('ASYNCIO_DEBUG', '').lower() in ('1', 'true', 'yes')
+
+# Архивирование закрытых заявок старше указанного срока (0 — отключить)
+ARCHIVE_AFTER_DAYS = float(os.getenv('ARCHIVE_AFTER_DAYS', '90'))
+ARCHIVE_INTERVAL_HOURS = float(os.getenv('ARCHIVE_INTERVAL_HOURS', '6'))
+ARCHIVE_COMPRESS = os.getenv('ARCHIVE_COMPRESS', 'true').lower() in ('1', 'true', 'yes')
+
+# Ограничение частоты запросов пользователя по классам хендлеров:
+# класс -> (запросов в секунду, допустимый всплеск). Переопределяется строкой
+# вида "default=1/5,list=0.5/3"
+THROTTLE_LIMITS = {
+    "default": (1.0, 5),
+    "start": (0.1, 2),
+    "list": (0.5, 3),
+    "submit": (0.05, 3),
+}
+for _item in filter(None, os.getenv('THROTTLE_LIMITS', '').split(',')):
+    _name, _limit = _item.split('=')
+    _rate, _burst = _limit.split('/')
+    THROTTLE_LIMITS[_name.strip()] = (float(_rate), float(_burst))
+# Множитель лимитов для администраторов, 0 — без ограничений
+THROTTLE_ADMIN_MULTIPLIER = float(os.getenv('THROTTLE_ADMIN_MULTIPLIER', '0'))
+
+# Поиск почти одинаковых заявок: порог сходства (0 — отключить) и окно в днях
+DEDUP_THRESHOLD = float(os.getenv('DEDUP_THRESHOLD', '0.6'))
+DEDUP_WINDOW_DAYS = float(os.getenv('DEDUP_WINDOW_DAYS', '7'))
+
 # Категории обратной связи
 FEEDBACK_CATEGORIES = {
     "tpa": "Цех термопластавтоматов (ТПА)",
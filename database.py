@@ -1,209 +1,1225 @@
 import aiosqlite
 import asyncio
+import functools
+import time
+import zlib
+from collections import namedtuple
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import Awaitable, Callable, List, Dict, Optional, Sequence, Tuple
+
+from cache import TTLCache
+from metrics import (
+    DB_CONNECTION_WAIT, DB_QUERY_ERRORS, DB_QUERY_LATENCY, DB_ROWS, count_rows
+)
+from migrations import COUNTERS_REBUILD_WITH_ARCHIVE, migrate
+from query_profiler import QueryProfiler
+from search import BM25_WEIGHTS, decode_search_cursor, fts_query, search_page
+
+# Статусы заявок, которые всегда присутствуют в статистике
+FEEDBACK_STATUS_KEYS = ('new', 'in_progress', 'closed')
+
+# Колонки заявки, общие для feedback и feedback_archive
+FEEDBACK_COLUMNS = (
+    'id', 'user_id', 'username', 'first_name', 'last_name', 'category',
+    'subcategory', 'feedback_type', 'message', 'is_anonymous', 'status',
+    'admin_response', 'admin_id', 'created_at', 'updated_at', 'duplicate_of',
+)
+# Текстовые колонки, которые в архиве могут храниться сжатыми
+ARCHIVE_PACKED_COLUMNS = ('message', 'admin_response')
+
+# Заявка в списках (админ-панель, "Мои заявки"): только показываемые поля.
+# preview — начало текста (PREVIEW_LENGTH символов, с многоточием, если текст
+# длиннее), has_response — есть ли ответ администратора; полные тексты в
+# память не читаются
+FeedbackSummary = namedtuple('FeedbackSummary', [
+    'id', 'username', 'first_name', 'last_name', 'category', 'feedback_type',
+    'status', 'duplicate_of', 'created_at', 'preview', 'has_response',
+])
+PREVIEW_LENGTH = 100
+
+
+
+def _summary_select(message: str = "message") -> str:
+    """Проекция FeedbackSummary: текст обрезается в SQL, символ после
+    PREVIEW_LENGTH проверяется без подсчета длины всего текста"""
+    return ", ".join(FeedbackSummary._fields[:-2]) + f""",
+    substr({message}, 1, {PREVIEW_LENGTH})
+        || CASE WHEN substr({message}, {PREVIEW_LENGTH + 1}, 1) <> '' THEN '...' ELSE '' END,
+    COALESCE(admin_response, '') <> ''"""
+
+
+SUMMARY_SELECT = _summary_select()
+# Текст в архиве может быть сжат; ответ проверяется только на пустоту
+ARCHIVE_SUMMARY_SELECT = _summary_select("unpack_text(message)")
+
+
+def _archive_may_match(status: Optional[str]) -> bool:
+    """В архиве только закрытые заявки: для других статусов его не читаем"""
+    return not status or status == 'closed'
+
+
+def summary_row(cursor, row) -> FeedbackSummary:
+    """row_factory запросов SUMMARY_SELECT: кортеж без промежуточного Row и dict"""
+    return FeedbackSummary._make(row)
+
+
+def summarize(row: Dict) -> FeedbackSummary:
+    """FeedbackSummary из полной строки заявки (хранилище в памяти, поиск)"""
+    message = row['message'] or ''
+    preview = message[:PREVIEW_LENGTH] + ('...' if len(message) > PREVIEW_LENGTH else '')
+    return FeedbackSummary(
+        row['id'], row['username'], row['first_name'], row['last_name'], row['category'],
+        row['feedback_type'], row['status'], row.get('duplicate_of'), row['created_at'],
+        preview, bool(row.get('admin_response'))
+    )
+
+
+def _archive_select(pack: bool = False) -> str:
+    """Список колонок для чтения из архива (pack=False) или записи в него (pack=True)"""
+    function = "pack_text" if pack else "unpack_text"
+    return ", ".join(
+        f"{function}({column})" + ("" if pack else f" AS {column}")
+        if column in ARCHIVE_PACKED_COLUMNS else column
+        for column in FEEDBACK_COLUMNS
+    )
+
+
+def encode_cursor(created_at: str, feedback_id: int) -> str:
+    """Компактный курсор позиции в списке: 'YYYYMMDDHHMMSS.id'"""
+    digits = ''.join(ch for ch in str(created_at) if ch.isdigit())[:14]
+    return f"{digits}.{feedback_id}"
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    """Обратное преобразование курсора в (created_at, id)"""
+    digits, feedback_id = cursor.split('.', 1)
+    created_at = (f"{digits[0:4]}-{digits[4:6]}-{digits[6:8]} "
+                  f"{digits[8:10]}:{digits[10:12]}:{digits[12:14]}")
+    return created_at, int(feedback_id)
+
+
+def pack_text(value):
+    """SQL-функция pack_text: сжатие длинного текста для архива (zlib, BLOB)"""
+    if not isinstance(value, str) or len(value) < 128:
+        return value
+    packed = zlib.compress(value.encode('utf-8'), 6)
+    return packed if len(packed) < len(value.encode('utf-8')) else value
+
+
+def unpack_text(value):
+    """SQL-функция unpack_text: обратное преобразование pack_text"""
+    if isinstance(value, bytes):
+        return zlib.decompress(value).decode('utf-8')
+    return value
+
+
+def build_breakdown(rows) -> Dict:
+    """Сводная статистика по строкам счетчиков (status, category, feedback_type, count)"""
+    breakdown = {
+        'total': 0,
+        'by_status': {status: 0 for status in FEEDBACK_STATUS_KEYS},
+        'by_type': {},
+        'by_category': {}
+    }
+    
+    for status, category, feedback_type, count in rows:
+        breakdown['total'] += count
+        breakdown['by_status'][status] = breakdown['by_status'].get(status, 0) + count
+        breakdown['by_type'][feedback_type] = breakdown['by_type'].get(feedback_type, 0) + count
+        
+        if category not in breakdown['by_category']:
+            breakdown['by_category'][category] = {'total': 0}
+            breakdown['by_category'][category].update(
+                {key: 0 for key in FEEDBACK_STATUS_KEYS}
+            )
+        category_stats = breakdown['by_category'][category]
+        category_stats['total'] += count
+        category_stats[status] = category_stats.get(status, 0) + count
+    
+    return breakdown
+
+
+def instrumented(method):
+    """Метрики метода Database: время выполнения, число строк и ошибки"""
+    name = method.__name__
+
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            result = await method(*args, **kwargs)
+        except Exception:
+            DB_QUERY_ERRORS.inc(method=name)
+            raise
+        finally:
+            DB_QUERY_LATENCY.observe(time.perf_counter() - started, method=name)
+        DB_ROWS.inc(count_rows(result), method=name)
+        return result
+
+    return wrapper
+
+
+class ConnectionPool:
+    """Пул долгоживущих соединений: несколько читателей и один писатель.
+
+    SQLite допускает только одного писателя, поэтому все изменения
+    выполняет отдельная задача-писатель: операции записи ставятся в очередь
+    и объединяются в одну транзакцию (group commit) — до max_batch операций
+    или за batch_window секунд. Каждая операция выполняется в своей точке
+    сохранения, так что ошибка одной не откатывает остальные. Чтения
+    распределяются по фиксированному набору соединений; в режиме WAL
+    читатели не блокируют писателя и друг друга.
+    """
+
+    # Применяются один раз при открытии каждого соединения
+    PRAGMAS = (
+        "PRAGMA synchronous = NORMAL",
+        "PRAGMA busy_timeout = 5000",
+        "PRAGMA cache_size = -16000",     # ~16 МБ страничного кэша
+        "PRAGMA mmap_size = 268435456",   # 256 МБ
+        "PRAGMA temp_store = MEMORY",
+    )
+
+    def __init__(self, db_path: str, readers: int = 4,
+                 max_batch: int = 100, batch_window: float = 0.002):
+        self.db_path = db_path
+        self.readers_count = max(1, readers)
+        self.max_batch = max(1, max_batch)
+        self.batch_window = batch_window
+        self._readers: Optional[asyncio.Queue] = None
+        self._all_readers: List[aiosqlite.Connection] = []
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._write_queue: Optional[asyncio.Queue] = None
+        self._writer_task: Optional[asyncio.Task] = None
+        # Профилировщик запросов (None — профилирование выключено)
+        self.profiler: Optional[QueryProfiler] = None
+        self._stats = {
+            'reader_acquires': 0,
+            'reader_waits': 0,
+            'reader_wait_time': 0.0,
+            'reader_max_wait': 0.0,
+            'writes': 0,
+            'write_wait_time': 0.0,
+            'write_max_wait': 0.0,
+            'transactions': 0,
+            'rollbacks': 0,
+            'batch_max': 0,
+            'commit_time': 0.0,
+            'commit_max': 0.0,
+        }
+
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None
+
+    async def _connect(self) -> aiosqlite.Connection:
+        # isolation_level=None: транзакциями управляем явно (BEGIN/COMMIT)
+        conn = await aiosqlite.connect(self.db_path, isolation_level=None)
+        conn.row_factory = aiosqlite.Row
+        for pragma in self.PRAGMAS:
+            await self._pragma(conn, pragma)
+        await conn.create_function("pack_text", 1, pack_text, deterministic=True)
+        await conn.create_function("unpack_text", 1, unpack_text, deterministic=True)
+        return conn
+
+    @staticmethod
+    async def _pragma(conn: aiosqlite.Connection, pragma: str):
+        # Курсор закрываем сразу: незавершённый оператор держит транзакцию чтения
+        async with conn.execute(pragma) as cursor:
+            await cursor.fetchall()
+
+    async def open(self):
+        """Открытие соединений, применение PRAGMA и запуск писателя"""
+        if self.is_open:
+            return
+
+        self._writer = await self._connect()
+        # Для новой базы включает освобождение страниц по частям (incremental_vacuum);
+        # существующая переходит в этот режим только после VACUUM
+        await self._pragma(self._writer, "PRAGMA auto_vacuum = INCREMENTAL")
+        # WAL сохраняется в файле БД, достаточно установить один раз
+        await self._pragma(self._writer, "PRAGMA journal_mode = WAL")
+
+        self._readers = asyncio.Queue()
+        for _ in range(self.readers_count):
+            conn = await self._connect()
+            await self._pragma(conn, "PRAGMA query_only = ON")
+            self._all_readers.append(conn)
+            self._readers.put_nowait(conn)
+
+        self._write_queue = asyncio.Queue()
+        self._writer_task = asyncio.create_task(self._writer_loop(), name="db-writer")
+
+    async def close(self):
+        """Завершение очереди записи и закрытие всех соединений пула"""
+        if self._writer_task is not None:
+            # Писатель дописывает уже поставленные операции и завершается
+            self._write_queue.put_nowait(None)
+            await self._writer_task
+            self._writer_task = None
+
+        for conn in self._all_readers:
+            await conn.close()
+        self._all_readers = []
+        self._readers = None
+
+        if self._writer is not None:
+            # Сбрасываем WAL в основной файл перед остановкой
+            try:
+                await self._pragma(self._writer, "PRAGMA wal_checkpoint(TRUNCATE)")
+            finally:
+                await self._writer.close()
+                self._writer = None
+
+    def _check_open(self):
+        if not self.is_open:
+            raise RuntimeError("База данных не инициализирована: вызовите init_db()")
+
+    @asynccontextmanager
+    async def reader(self):
+        """Соединение для чтения из пула"""
+        self._check_open()
+        started = time.perf_counter()
+        conn = await self._readers.get()
+        waited = time.perf_counter() - started
+        self._stats['reader_acquires'] += 1
+        if waited > 0.001:
+            self._stats['reader_waits'] += 1
+        self._stats['reader_wait_time'] += waited
+        self._stats['reader_max_wait'] = max(self._stats['reader_max_wait'], waited)
+        DB_CONNECTION_WAIT.observe(waited, kind="read")
+        try:
+            yield self.profiler.wrap(conn) if self.profiler else conn
+        finally:
+            self._readers.put_nowait(conn)
+
+    async def write(self, operation: Callable[[aiosqlite.Connection], Awaitable],
+                    transaction: bool = True):
+        """Выполнение операции записи в очередной групповой транзакции.
+
+        operation — async-функция, получающая соединение писателя. Результат
+        возвращается вызывающему только после COMMIT. transaction=False —
+        операция выполняется писателем отдельно, вне транзакции (VACUUM и
+        другие команды, недопустимые внутри BEGIN).
+        """
+        self._check_open()
+        future = asyncio.get_running_loop().create_future()
+        self._write_queue.put_nowait((operation, future, time.perf_counter(), transaction))
+        return await future
+
+    async def _run_standalone(self, item):
+        operation, future, _, _ = item
+        if future.cancelled():
+            return
+        try:
+            result = await operation(self.profiler.wrap(self._writer) if self.profiler else self._writer)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        else:
+            if not future.done():
+                future.set_result(result)
+
+    async def _writer_loop(self):
+        pending = None
+        while True:
+            if pending is not None:
+                item, pending = pending, None
+            else:
+                item = await self._write_queue.get()
+            if item is None:
+                return
+            if not item[3]:
+                await self._run_standalone(item)
+                continue
+
+            batch = [item]
+            stop = False
+            deadline = time.perf_counter() + self.batch_window
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._write_queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._write_queue.get(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                if item is None:
+                    stop = True
+                    break
+                if not item[3]:
+                    # Операция вне транзакции выполняется после текущей пачки
+                    pending = item
+                    break
+                batch.append(item)
+
+            await self._commit_batch(batch)
+            if stop:
+                return
+
+    async def _commit_batch(self, batch: list):
+        conn = self._writer
+        # Операции получают обертку с профилированием, служебные команды — нет
+        op_conn = self.profiler.wrap(conn) if self.profiler else conn
+        completed = []
+        started = time.perf_counter()
+
+        try:
+            await conn.execute("BEGIN IMMEDIATE")
+            for operation, future, enqueued, _ in batch:
+                if future.cancelled():
+                    continue
+
+                waited = started - enqueued
+                self._stats['write_wait_time'] += waited
+                self._stats['write_max_wait'] = max(self._stats['write_max_wait'], waited)
+                DB_CONNECTION_WAIT.observe(waited, kind="write")
+
+                await conn.execute("SAVEPOINT write_op")
+                try:
+                    result = await operation(op_conn)
+                except Exception as e:
+                    await conn.execute("ROLLBACK TO write_op")
+                    await conn.execute("RELEASE write_op")
+                    self._stats['rollbacks'] += 1
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    await conn.execute("RELEASE write_op")
+                    completed.append((future, result))
+
+            await conn.execute("COMMIT")
+        except Exception as e:
+            # Сбой самой транзакции: ни одна операция пачки не сохранена
+            if conn.in_transaction:
+                try:
+                    await conn.execute("ROLLBACK")
+                except Exception:
+                    pass
+            self._stats['rollbacks'] += len(completed)
+            for future, _ in completed:
+                if not future.done():
+                    future.set_exception(e)
+            for _, future, _, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        elapsed = time.perf_counter() - started
+        self._stats['transactions'] += 1
+        self._stats['writes'] += len(batch)
+        self._stats['batch_max'] = max(self._stats['batch_max'], len(batch))
+        self._stats['commit_time'] += elapsed
+        self._stats['commit_max'] = max(self._stats['commit_max'], elapsed)
+
+        for future, result in completed:
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self) -> Dict:
+        """Статистика использования пула и групповой записи"""
+        stats = dict(self._stats)
+        stats['readers'] = self.readers_count
+        stats['readers_idle'] = self._readers.qsize() if self._readers else 0
+        stats['readers_in_use'] = stats['readers'] - stats['readers_idle'] if self.is_open else 0
+        stats['write_queue'] = self._write_queue.qsize() if self._write_queue else 0
+        transactions = stats['transactions'] or 1
+        stats['batch_avg'] = stats['writes'] / transactions
+        stats['commit_avg'] = stats['commit_time'] / transactions
+        return stats
+
 
 class Database:
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: str, pool_size: int = 4,
+                 write_batch: int = 100, write_window: float = 0.002,
+                 slow_query_ms: float = None, id_stride: int = 1, id_offset: int = 0,
+                 cache_size: int = 1000, cache_ttl: float = 30):
         self.db_path = db_path
+        self.pool = ConnectionPool(
+            db_path, readers=pool_size,
+            max_batch=write_batch, batch_window=write_window
+        )
+        # slow_query_ms включает профилирование запросов с указанным порогом
+        if slow_query_ms is not None:
+            self.pool.profiler = QueryProfiler(slow_query_ms / 1000)
+        # Номера заявок шарда (storage.ShardedStorage): id % id_stride == id_offset
+        self.id_stride = id_stride
+        self.id_offset = id_offset
+        self.schema_version = 0
+        # Заявки, прочитанные по номеру; cache_size=0 отключает кэш
+        self.feedback_cache = TTLCache(cache_size, cache_ttl)
+        # Сигнал фоновому обработчику outbox о новых уведомлениях
+        self.outbox_event = asyncio.Event()
 
     async def init_db(self):
-        """Инициализация базы данных и создание таблиц"""
-        async with aiosqlite.connect(self.db_path) as db:
-            # Таблица пользователей
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY,
-                    user_id INTEGER UNIQUE NOT NULL,
-                    username TEXT,
-                    first_name TEXT,
-                    last_name TEXT,
-                    is_admin BOOLEAN DEFAULT FALSE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # Таблица заявок
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS feedback (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    username TEXT,
-                    first_name TEXT,
-                    last_name TEXT,
-                    category TEXT NOT NULL,
-                    subcategory TEXT,
-                    feedback_type TEXT NOT NULL,
-                    message TEXT NOT NULL,
-                    is_anonymous BOOLEAN DEFAULT FALSE,
-                    status TEXT DEFAULT 'new',
-                    admin_response TEXT,
-                    admin_id INTEGER,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (user_id)
-                )
-            """)
-            
-            # Таблица категорий
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS categories (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL UNIQUE,
-                    description TEXT,
-                    is_active BOOLEAN DEFAULT TRUE
-                )
-            """)
-            
-            await db.commit()
-            
-            # Добавляем базовые категории
-            await self.init_categories()
-
-    async def init_categories(self):
-        """Инициализация базовых категорий"""
-        categories = [
-            ("Цех термопластавтоматов (ТПА)", "Вопросы по работе цеха ТПА"),
-            ("Цех литья алюминия", "Вопросы по работе цеха литья алюминия"),
-            ("Монтаж, упаковка, сборка светильников", "Вопросы по монтажу и сборке"),
-            ("Логистика и склад", "Вопросы по логистике и складским операциям"),
-            ("HR и кадры", "Вопросы по кадровой политике"),
-            ("Общие вопросы", "Общие вопросы по работе предприятия")
-        ]
-        
-        async with aiosqlite.connect(self.db_path) as db:
-            for name, description in categories:
-                await db.execute(
-                    "INSERT OR IGNORE INTO categories (name, description) VALUES (?, ?)",
-                    (name, description)
-                )
-            await db.commit()
+        """Инициализация базы данных: открытие пула и применение миграций"""
+        await self.pool.open()
+        self.schema_version = await migrate(self.pool)
 
+    async def close(self):
+        """Закрытие соединений с базой данных"""
+        await self.pool.close()
+
+    def get_pool_stats(self) -> Dict:
+        """Статистика пула соединений и групповой записи"""
+        return self.pool.stats()
+
+    def get_cache_stats(self) -> Dict:
+        """Статистика кэша заявок"""
+        return self.feedback_cache.stats()
+
+    @property
+    def profiler(self) -> Optional[QueryProfiler]:
+        return self.pool.profiler
+
+    def get_query_stats(self, order_by: str = 'total_time', limit: int = None) -> List[Dict]:
+        """Статистика запросов по формам (пустая, если профилирование выключено)"""
+        if self.pool.profiler is None:
+            return []
+        return self.pool.profiler.stats(order_by, limit)
+
+    @instrumented
     async def add_user(self, user_id: int, username: str = None, 
                       first_name: str = None, last_name: str = None):
         """Добавление пользователя"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async def operation(db):
             await db.execute("""
                 INSERT OR REPLACE INTO users 
                 (user_id, username, first_name, last_name) 
                 VALUES (?, ?, ?, ?)
             """, (user_id, username, first_name, last_name))
-            await db.commit()
+        
+        await self.pool.write(operation)
 
+    @instrumented
     async def set_admin(self, user_id: int, is_admin: bool = True):
         """Установка админских прав"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async def operation(db):
             await db.execute(
                 "UPDATE users SET is_admin = ? WHERE user_id = ?",
                 (is_admin, user_id)
             )
-            await db.commit()
+        
+        await self.pool.write(operation)
 
+    @instrumented
     async def is_admin(self, user_id: int) -> bool:
         """Проверка админских прав"""
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute(
+        async with self.pool.reader() as db:
+            async with db.execute(
                 "SELECT is_admin FROM users WHERE user_id = ?",
                 (user_id,)
-            )
-            result = await cursor.fetchone()
+            ) as cursor:
+                result = await cursor.fetchone()
             return result[0] if result else False
 
+    @instrumented
     async def add_feedback(self, user_id: int, username: str, first_name: str, 
                           last_name: str, category: str, feedback_type: str, 
                           message: str, is_anonymous: bool = False, 
-                          subcategory: str = None) -> int:
-        """Добавление заявки"""
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute("""
+                          subcategory: str = None,
+                          notifications: Callable[[int, Optional[int]], List[Dict]] = None,
+                          signature: bytes = None,
+                          duplicate_candidates: Sequence[int] = ()) -> int:
+        """Добавление заявки
+
+        notifications — функция, которая по номеру новой заявки и номеру
+        заявки, дубликатом которой она признана (или None), возвращает
+        уведомления для outbox; они записываются в той же транзакции.
+
+        duplicate_candidates — похожие заявки (dedup.DuplicateDetector) по
+        убыванию сходства: новая заявка связывается с первой из них, которая
+        еще открыта и сама не является дубликатом. Сигнатура signature
+        сохраняется только для заявок-оригиналов.
+        """
+        async def operation(db):
+            duplicate_of = None
+            for candidate in duplicate_candidates:
+                async with db.execute("""
+                    SELECT 1 FROM feedback
+                    WHERE id = ? AND status != 'closed' AND duplicate_of IS NULL
+                """, (candidate,)) as cursor:
+                    if await cursor.fetchone():
+                        duplicate_of = candidate
+                        break
+            
+            async with db.execute("""
                 INSERT INTO feedback 
-                (user_id, username, first_name, last_name, category, subcategory,
-                 feedback_type, message, is_anonymous) 
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (user_id, username, first_name, last_name, category, 
-                  subcategory, feedback_type, message, is_anonymous))
-            await db.commit()
-            return cursor.lastrowid
+                (id, user_id, username, first_name, last_name, category, subcategory,
+                 feedback_type, message, is_anonymous, duplicate_of) 
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (await self._next_feedback_id(db), user_id, username, first_name, last_name,
+                  category, subcategory, feedback_type, message, is_anonymous,
+                  duplicate_of)) as cursor:
+                feedback_id = cursor.lastrowid
+            
+            if signature is not None and duplicate_of is None:
+                await db.execute(
+                    "INSERT INTO feedback_signatures (feedback_id, category, signature) VALUES (?, ?, ?)",
+                    (feedback_id, category, signature)
+                )
+            
+            if notifications:
+                await self._enqueue_outbox(db, notifications(feedback_id, duplicate_of), feedback_id)
+            
+            return feedback_id
+        
+        feedback_id = await self.pool.write(operation)
+        
+        if notifications:
+            self.outbox_event.set()
+        
+        return feedback_id
+
+    async def _next_feedback_id(self, db: aiosqlite.Connection) -> Optional[int]:
+        """Номер новой заявки: None (AUTOINCREMENT) или следующий номер шарда"""
+        if self.id_stride == 1:
+            return None
+        # sqlite_sequence учитывает и номера заявок, перенесенных в архив
+        async with db.execute("SELECT seq FROM sqlite_sequence WHERE name = 'feedback'") as cursor:
+            row = await cursor.fetchone()
+        last = row[0] if row else 0
+        feedback_id = last - last % self.id_stride + self.id_offset
+        return feedback_id if feedback_id > last else feedback_id + self.id_stride
+
+    @instrumented
+    async def get_unsigned_feedback(self, since: str) -> List[Dict]:
+        """Открытые заявки-оригиналы, созданные после since, без сигнатуры MinHash"""
+        async with self.pool.reader() as db:
+            async with db.execute("""
+                SELECT f.id, f.category, f.message FROM feedback f
+                WHERE f.status != 'closed' AND f.duplicate_of IS NULL AND f.created_at >= ?
+                  AND NOT EXISTS (SELECT 1 FROM feedback_signatures s WHERE s.feedback_id = f.id)
+            """, (since,)) as cursor:
+                rows = await cursor.fetchall()
+            return [dict(row) for row in rows]
+
+    @instrumented
+    async def save_signatures(self, signatures: List[Tuple[int, str, bytes]]):
+        """Сохранение сигнатур MinHash: [(номер заявки, категория, сигнатура), ...]"""
+        async def operation(db):
+            await db.executemany("""
+                INSERT OR IGNORE INTO feedback_signatures (feedback_id, category, signature, created_at)
+                SELECT id, ?, ?, created_at FROM feedback WHERE id = ?
+            """, [(category, signature, feedback_id) for feedback_id, category, signature in signatures])
+        
+        await self.pool.write(operation)
 
+    @instrumented
+    async def get_signatures(self, since: str = None) -> List[Dict]:
+        """Сигнатуры MinHash, записанные начиная с since, в порядке записи"""
+        async with self.pool.reader() as db:
+            async with db.execute("""
+                SELECT feedback_id, category, signature, created_at FROM feedback_signatures
+                WHERE created_at >= COALESCE(?, '')
+                ORDER BY created_at, feedback_id
+            """, (since,)) as cursor:
+                rows = await cursor.fetchall()
+            return [dict(row) for row in rows]
+
+    @instrumented
     async def get_feedback_list(self, status: str = None, category: str = None, 
-                               limit: int = 50) -> List[Dict]:
-        """Получение списка заявок"""
-        query = "SELECT * FROM feedback WHERE 1=1"
+                               limit: int = 50) -> List[FeedbackSummary]:
+        """Получение списка заявок (включая архивные)"""
+        where, params = self._filter_clause(status, category)
+        query, params = self._summary_query(where, params, "DESC", limit,
+                                            include_archive=_archive_may_match(status))
+        
+        async with self.pool.reader() as db:
+            async with db.execute(query, params) as cursor:
+                cursor.row_factory = summary_row
+                return await cursor.fetchall()
+
+    @staticmethod
+    def _summary_query(where: str, params: list, order: str, limit: int,
+                       include_archive: bool = False) -> Tuple[str, list]:
+        """Запрос limit заявок (FeedbackSummary) в порядке (created_at, id).
+
+        С архивом SQLite сливает (MERGE UNION ALL) два прохода по индексам
+        (..., created_at, id) рабочей таблицы и архива без сортировки.
+        """
+        query = f"SELECT {SUMMARY_SELECT} FROM feedback WHERE {where}"
+        if include_archive:
+            query += (f" UNION ALL SELECT {ARCHIVE_SUMMARY_SELECT} FROM feedback_archive "
+                      f"WHERE {where}")
+            params = [*params, *params]
+        return f"{query} ORDER BY created_at {order}, id {order} LIMIT ?", [*params, limit]
+
+    async def _keyset_page(self, where: str, params: list, cursor: str = None,
+                           direction: str = 'next', limit: int = 10,
+                           include_archive: bool = False) -> Dict:
+        """Страница заявок (FeedbackSummary) по ключу (created_at, id), от новых к старым.
+
+        direction='next' — более старые заявки после курсора,
+        direction='prev' — более новые заявки перед курсором.
+        include_archive — вместе с перенесенными в архив.
+        """
+        params = list(params)
+        order = "DESC"
+        
+        if cursor:
+            created_at, feedback_id = decode_cursor(cursor)
+            if direction == 'prev':
+                where += " AND (created_at, id) > (?, ?)"
+                order = "ASC"
+            else:
+                where += " AND (created_at, id) < (?, ?)"
+            params.extend([created_at, feedback_id])
+        
+        query, params = self._summary_query(where, params, order, limit + 1, include_archive)
+        
+        async with self.pool.reader() as db:
+            async with db.execute(query, params) as db_cursor:
+                db_cursor.row_factory = summary_row
+                rows = await db_cursor.fetchall()
+        
+        has_more = len(rows) > limit
+        items = rows[:limit]
+        if order == "ASC":
+            items.reverse()
+        
+        if direction == 'prev' and cursor:
+            has_newer, has_older = has_more, True
+        else:
+            has_newer, has_older = cursor is not None, has_more
+        
+        return {
+            'items': items,
+            'prev_cursor': encode_cursor(items[0].created_at, items[0].id)
+                           if items and has_newer else None,
+            'next_cursor': encode_cursor(items[-1].created_at, items[-1].id)
+                           if items and has_older else None
+        }
+
+    @instrumented
+    async def get_feedback_by_user(self, user_id: int, cursor: str = None,
+                                   limit: int = 10, direction: str = 'next') -> Dict:
+        """Страница всей истории заявок пользователя, включая архив (индексы user_id, created_at)"""
+        return await self._keyset_page(
+            "user_id = ?", [user_id], cursor=cursor, direction=direction, limit=limit,
+            include_archive=True
+        )
+
+    @instrumented
+    async def count_feedback_by_user(self, user_id: int) -> int:
+        """Количество заявок пользователя, включая архив"""
+        async with self.pool.reader() as db:
+            async with db.execute(
+                "SELECT (SELECT COUNT(*) FROM feedback WHERE user_id = ?)"
+                " + (SELECT COUNT(*) FROM feedback_archive WHERE user_id = ?)",
+                (user_id, user_id)
+            ) as cursor:
+                return (await cursor.fetchone())[0]
+
+    @staticmethod
+    def _filter_clause(status: str = None, category: str = None,
+                       feedback_type: str = None, date_from: str = None,
+                       date_to: str = None) -> Tuple[str, list]:
+        """Условие WHERE по фильтрам; date_from включительно, date_to — нет"""
+        where = "1=1"
         params = []
         
         if status:
-            query += " AND status = ?"
+            where += " AND status = ?"
             params.append(status)
         
         if category:
-            query += " AND category = ?"
+            where += " AND category = ?"
             params.append(category)
         
-        query += " ORDER BY created_at DESC LIMIT ?"
-        params.append(limit)
+        if feedback_type:
+            where += " AND feedback_type = ?"
+            params.append(feedback_type)
         
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            cursor = await db.execute(query, params)
-            rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
+        if date_from:
+            where += " AND created_at >= ?"
+            params.append(date_from)
+        
+        if date_to:
+            where += " AND created_at < ?"
+            params.append(date_to)
+        
+        return where, params
+
+    @instrumented
+    async def get_feedback_page(self, status: str = None, category: str = None,
+                                cursor: str = None, direction: str = 'next',
+                                limit: int = 5) -> Dict:
+        """Страница заявок с фильтрами и курсором для следующей/предыдущей страницы.
 
+        Закрытые заявки и списки без статуса включают архив, как и счетчики статистики.
+        """
+        where, params = self._filter_clause(status, category)
+        return await self._keyset_page(
+            where, params, cursor=cursor, direction=direction, limit=limit,
+            include_archive=_archive_may_match(status)
+        )
+
+    @instrumented
+    async def count_feedback(self, status: str = None, category: str = None,
+                             feedback_type: str = None, date_from: str = None,
+                             date_to: str = None, include_archive: bool = False) -> int:
+        """Количество заявок по фильтрам (по индексу, без чтения строк)"""
+        where, params = self._filter_clause(status, category, feedback_type, date_from, date_to)
+        query = f"SELECT COUNT(*) FROM feedback WHERE {where}"
+        if include_archive and _archive_may_match(status):
+            query = f"SELECT ({query}) + (SELECT COUNT(*) FROM feedback_archive WHERE {where})"
+            params = params * 2
+        
+        async with self.pool.reader() as db:
+            async with db.execute(query, params) as cursor:
+                return (await cursor.fetchone())[0]
+
+    @instrumented
+    async def search_feedback(self, terms: List[str], status: str = None, category: str = None,
+                              feedback_type: str = None, date_from: str = None,
+                              date_to: str = None, cursor: str = None,
+                              direction: str = 'next', limit: int = 5) -> Dict:
+        """Страница полнотекстового поиска (search.py): лучшие по bm25 первыми.
+
+        Курсор — (оценка, id) последней заявки страницы; фильтры проверяются
+        по строкам feedback, найденным по индексу.
+        """
+        if not terms:
+            return search_page([], limit, cursor, direction, False)
+        
+        where, params = self._filter_clause(status, category, feedback_type, date_from, date_to)
+        params = [fts_query(terms), *params]
+        after = ""
+        order = "ASC"
+        if cursor:
+            score, feedback_id = decode_search_cursor(cursor)
+            if direction == 'prev':
+                after = "WHERE (score, id) < (?, ?)"
+                order = "DESC"
+            else:
+                after = "WHERE (score, id) > (?, ?)"
+            params.extend([score, feedback_id])
+        
+        weights = ", ".join(str(weight) for weight in BM25_WEIGHTS)
+        query = f"""
+            SELECT * FROM (
+                SELECT feedback.*, bm25(feedback_fts, {weights}) AS score
+                FROM feedback_fts JOIN feedback ON feedback.id = feedback_fts.rowid
+                WHERE feedback_fts MATCH ? AND {where}
+            ) {after}
+            ORDER BY score {order}, id {order} LIMIT ?
+        """
+        params.append(limit + 1)
+        
+        async with self.pool.reader() as db:
+            async with db.execute(query, params) as db_cursor:
+                rows = await db_cursor.fetchall()
+        
+        has_more = len(rows) > limit
+        rows = [dict(row) for row in rows[:limit]]
+        if order == "DESC":
+            rows.reverse()
+        return search_page(rows, limit, cursor, direction, has_more)
+
+    @instrumented
+    async def count_search(self, terms: List[str], status: str = None, category: str = None,
+                           feedback_type: str = None, date_from: str = None,
+                           date_to: str = None) -> int:
+        """Количество заявок, найденных полнотекстовым поиском"""
+        if not terms:
+            return 0
+        
+        where, params = self._filter_clause(status, category, feedback_type, date_from, date_to)
+        query = f"""
+            SELECT COUNT(*) FROM feedback_fts JOIN feedback ON feedback.id = feedback_fts.rowid
+            WHERE feedback_fts MATCH ? AND {where}
+        """
+        async with self.pool.reader() as db:
+            async with db.execute(query, [fts_query(terms), *params]) as cursor:
+                return (await cursor.fetchone())[0]
+
+    async def iter_feedback(self, status: str = None, category: str = None,
+                            feedback_type: str = None, date_from: str = None,
+                            date_to: str = None, chunk_size: int = 1000,
+                            include_archive: bool = True):
+        """Потоковое чтение заявок по фильтрам пачками по chunk_size строк.
+
+        Каждая пачка — отдельный запрос по ключу id > последнего прочитанного,
+        поэтому соединение пула занято только на время одной пачки, а
+        длинный экспорт не держит транзакцию чтения и не мешает WAL checkpoint.
+        Архивные заявки объединяются с рабочими в общем порядке id.
+        """
+        where, params = self._filter_clause(status, category, feedback_type, date_from, date_to)
+        columns = ", ".join(FEEDBACK_COLUMNS)
+        if include_archive:
+            query = (f"SELECT {columns} FROM feedback WHERE {where} AND id > ? "
+                     f"UNION ALL SELECT {_archive_select()} FROM feedback_archive "
+                     f"WHERE {where} AND id > ? ORDER BY id LIMIT ?")
+        else:
+            query = f"SELECT {columns} FROM feedback WHERE {where} AND id > ? ORDER BY id LIMIT ?"
+        last_id = 0
+        
+        while True:
+            if include_archive:
+                query_params = [*params, last_id, *params, last_id, chunk_size]
+            else:
+                query_params = [*params, last_id, chunk_size]
+            
+            async with self.pool.reader() as db:
+                async with db.execute(query, query_params) as cursor:
+                    rows = await cursor.fetchall()
+            
+            if not rows:
+                return
+            
+            yield [dict(row) for row in rows]
+            
+            if len(rows) < chunk_size:
+                return
+            last_id = rows[-1]['id']
+
+    @instrumented
     async def get_feedback_by_id(self, feedback_id: int) -> Optional[Dict]:
-        """Получение заявки по ID"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            cursor = await db.execute(
+        """Получение заявки по ID (включая перенесенные в архив)"""
+        cached = self.feedback_cache.get(feedback_id)
+        if cached is not None:
+            return dict(cached)
+        
+        token = self.feedback_cache.token()
+        async with self.pool.reader() as db:
+            async with db.execute(
                 "SELECT * FROM feedback WHERE id = ?",
                 (feedback_id,)
-            )
-            row = await cursor.fetchone()
-            return dict(row) if row else None
+            ) as cursor:
+                row = await cursor.fetchone()
+            
+            if row is None:
+                async with db.execute(
+                    f"SELECT {_archive_select()} FROM feedback_archive WHERE id = ?",
+                    (feedback_id,)
+                ) as cursor:
+                    row = await cursor.fetchone()
+        
+        if row is None:
+            return None
+        feedback = dict(row)
+        self.feedback_cache.fill(feedback_id, feedback, token)
+        return dict(feedback)
 
+    @instrumented
     async def update_feedback_status(self, feedback_id: int, status: str, 
-                                   admin_id: int = None, admin_response: str = None):
-        """Обновление статуса заявки"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
+                                   admin_id: int = None, admin_response: str = None,
+                                   notifications: Callable[[int], List[Dict]] = None
+                                   ) -> Optional[Dict]:
+        """Обновление статуса заявки (с уведомлениями в outbox в той же транзакции)
+
+        Возвращает обновленную заявку или None, если ее нет в рабочей таблице.
+        """
+        async def operation(db):
+            async with db.execute("""
                 UPDATE feedback 
                 SET status = ?, admin_id = ?, admin_response = ?, 
                     updated_at = CURRENT_TIMESTAMP 
                 WHERE id = ?
-            """, (status, admin_id, admin_response, feedback_id))
-            await db.commit()
+                RETURNING *
+            """, (status, admin_id, admin_response, feedback_id)) as cursor:
+                row = await cursor.fetchone()
+            
+            # Уведомления — только об изменении, которое действительно произошло
+            if row is not None and notifications:
+                await self._enqueue_outbox(db, notifications(feedback_id), feedback_id)
+            
+            return dict(row) if row else None
+        
+        try:
+            feedback = await self.pool.write(operation)
+        except BaseException:
+            # При отмене ожидания запись могла быть уже зафиксирована
+            self.feedback_cache.invalidate(feedback_id)
+            raise
+        
+        if feedback is None:
+            self.feedback_cache.invalidate(feedback_id)
+        else:
+            self.feedback_cache.put(feedback_id, feedback)
+        
+        if feedback is not None and notifications:
+            self.outbox_event.set()
+        
+        return dict(feedback) if feedback else None
 
+    @instrumented
     async def get_categories(self) -> List[Dict]:
         """Получение списка категорий"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            cursor = await db.execute(
+        async with self.pool.reader() as db:
+            async with db.execute(
                 "SELECT * FROM categories WHERE is_active = TRUE ORDER BY name"
-            )
-            rows = await cursor.fetchall()
+            ) as cursor:
+                rows = await cursor.fetchall()
             return [dict(row) for row in rows]
 
+    async def _enqueue_outbox(self, db: aiosqlite.Connection, messages: List[Dict],
+                              feedback_id: int = None):
+        await db.executemany("""
+            INSERT INTO outbox
+            (chat_id, text, parse_mode, reply_markup, feedback_id, reply_to_feedback_id)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, [(m['chat_id'], m['text'], m.get('parse_mode'), m.get('reply_markup'), feedback_id,
+               m.get('reply_to_feedback_id'))
+              for m in messages])
+
+    @instrumented
+    async def claim_outbox(self, limit: int = 50, lease: float = 60) -> List[Dict]:
+        """Выборка готовых к отправке уведомлений.
+
+        Выбранные записи откладываются на lease секунд: если процесс упадет
+        во время отправки, они будут повторены после истечения аренды.
+        """
+        now = time.time()
+        
+        async def operation(db):
+            async with db.execute("""
+                UPDATE outbox SET next_attempt_at = ?
+                WHERE id IN (
+                    SELECT id FROM outbox
+                    WHERE status = 'pending' AND next_attempt_at <= ?
+                    ORDER BY next_attempt_at, id
+                    LIMIT ?
+                )
+                RETURNING *
+            """, (now + lease, now, limit)) as cursor:
+                rows = [dict(row) for row in await cursor.fetchall()]
+            
+            # Уведомления о дубликатах отправляются ответом на доставленное
+            # уведомление об исходной заявке в том же чате
+            for row in rows:
+                row['reply_to_message_id'] = None
+                if row['reply_to_feedback_id'] is None:
+                    continue
+                async with db.execute("""
+                    SELECT message_id FROM outbox
+                    WHERE feedback_id = ? AND chat_id = ? AND status = 'sent'
+                      AND reply_to_feedback_id IS NULL
+                    ORDER BY id LIMIT 1
+                """, (row['reply_to_feedback_id'], row['chat_id'])) as cursor:
+                    thread = await cursor.fetchone()
+                if thread is not None:
+                    row['reply_to_message_id'] = thread[0]
+            return rows
+        
+        rows = await self.pool.write(operation)
+        return sorted(rows, key=lambda row: row['id'])
+
+    @instrumented
+    async def extend_outbox_lease(self, outbox_ids: List[int], lease: float = 60):
+        """Продление аренды выбранных уведомлений, пока их отправка не закончилась"""
+        if not outbox_ids:
+            return
+        placeholders = ", ".join("?" * len(outbox_ids))
+        
+        async def operation(db):
+            await db.execute(f"""
+                UPDATE outbox SET next_attempt_at = ?
+                WHERE id IN ({placeholders}) AND status = 'pending'
+            """, (time.time() + lease, *outbox_ids))
+        
+        await self.pool.write(operation)
+
+    @instrumented
+    async def mark_outbox_sent(self, delivered: List[Tuple[int, Optional[int]]]):
+        """Отметить уведомления доставленными: [(id, message_id), ...]"""
+        async def operation(db):
+            await db.executemany("""
+                UPDATE outbox
+                SET status = 'sent', message_id = ?, sent_at = CURRENT_TIMESTAMP,
+                    attempts = attempts + 1, last_error = NULL
+                WHERE id = ?
+            """, [(message_id, outbox_id) for outbox_id, message_id in delivered])
+        
+        await self.pool.write(operation)
+
+    @instrumented
+    async def mark_outbox_failed(self, outbox_id: int, error: str,
+                                 retry_at: float = None):
+        """Неудачная попытка отправки: повтор в retry_at или dead-letter"""
+        async def operation(db):
+            await db.execute("""
+                UPDATE outbox
+                SET attempts = attempts + 1, last_error = ?,
+                    status = CASE WHEN ? IS NULL THEN 'dead' ELSE 'pending' END,
+                    next_attempt_at = COALESCE(?, next_attempt_at)
+                WHERE id = ?
+            """, (error[:1000], retry_at, retry_at, outbox_id))
+        
+        await self.pool.write(operation)
+
+    @instrumented
+    async def purge_outbox(self, older_than_days: int = 7) -> int:
+        """Удаление давно доставленных уведомлений"""
+        async def operation(db):
+            async with db.execute("""
+                DELETE FROM outbox
+                WHERE status = 'sent' AND sent_at < datetime('now', ?)
+            """, (f"-{older_than_days} days",)) as cursor:
+                return cursor.rowcount
+        
+        return await self.pool.write(operation)
+
+    @instrumented
+    async def get_outbox_stats(self) -> Dict:
+        """Количество уведомлений по статусам"""
+        async with self.pool.reader() as db:
+            async with db.execute(
+                "SELECT status, COUNT(*) FROM outbox GROUP BY status"
+            ) as cursor:
+                rows = await cursor.fetchall()
+        
+        stats = {'pending': 0, 'sent': 0, 'dead': 0}
+        stats.update({status: count for status, count in rows})
+        return stats
+
+    @instrumented
+    async def get_breakdown(self) -> Dict:
+        """Сводная статистика: статус × категория × тип из таблицы счетчиков"""
+        async with self.pool.reader() as db:
+            async with db.execute("""
+                SELECT status, category, feedback_type, count
+                FROM feedback_counters
+                WHERE count > 0
+            """) as cursor:
+                rows = await cursor.fetchall()
+        
+        return build_breakdown(rows)
+
+    @instrumented
+    async def rebuild_counters(self) -> Dict:
+        """Пересчет счетчиков по таблицам feedback и feedback_archive
+
+        Возвращает количество строк счетчиков и число исправленных расхождений.
+        """
+        async def operation(db):
+            async with db.execute(
+                "SELECT category, feedback_type, status, count FROM feedback_counters WHERE count != 0"
+            ) as cursor:
+                before = {tuple(row[:3]): row[3] for row in await cursor.fetchall()}
+            
+            await db.execute("DELETE FROM feedback_counters")
+            await db.execute(COUNTERS_REBUILD_WITH_ARCHIVE)
+            
+            async with db.execute(
+                "SELECT category, feedback_type, status, count FROM feedback_counters"
+            ) as cursor:
+                after = {tuple(row[:3]): row[3] for row in await cursor.fetchall()}
+            
+            return before, after
+        
+        before, after = await self.pool.write(operation)
+        
+        fixed = sum(1 for key in before.keys() | after.keys()
+                    if before.get(key, 0) != after.get(key, 0))
+        
+        return {'rows': len(after), 'fixed': fixed}
+
+    @instrumented
+    async def archive_closed(self, older_than: str, limit: int = 500,
+                             compress: bool = True) -> int:
+        """Перенос закрытых заявок, не менявшихся с older_than, в архив.
+
+        За один вызов переносится не более limit заявок. Возвращает их число.
+        """
+        async def operation(db):
+            async with db.execute("""
+                SELECT id FROM feedback
+                WHERE status = 'closed' AND updated_at < ?
+                ORDER BY updated_at LIMIT ?
+            """, (older_than, limit)) as cursor:
+                ids = [row[0] for row in await cursor.fetchall()]
+            
+            if not ids:
+                return ids
+            
+            placeholders = ", ".join("?" * len(ids))
+            columns = ", ".join(FEEDBACK_COLUMNS)
+            select = _archive_select(pack=True) if compress else columns
+            await db.execute(f"""
+                INSERT INTO feedback_archive ({columns})
+                SELECT {select} FROM feedback WHERE id IN ({placeholders})
+            """, ids)
+            await db.execute(f"DELETE FROM feedback WHERE id IN ({placeholders})", ids)
+            return ids
+        
+        ids = await self.pool.write(operation)
+        # Архивная строка отдается через _archive_select и перечитается при обращении
+        self.feedback_cache.invalidate(*ids)
+        return len(ids)
+
+    @instrumented
+    async def incremental_vacuum(self, pages: int = 256) -> int:
+        """Возврат в ОС не более pages свободных страниц. Возвращает, сколько освобождено."""
+        async def operation(db):
+            async with db.execute("PRAGMA freelist_count") as cursor:
+                before = (await cursor.fetchone())[0]
+            if before == 0:
+                return 0
+            async with db.execute(f"PRAGMA incremental_vacuum({int(pages)})") as cursor:
+                await cursor.fetchall()
+            async with db.execute("PRAGMA freelist_count") as cursor:
+                return before - (await cursor.fetchone())[0]
+        
+        return await self.pool.write(operation)
+
+    @instrumented
+    async def get_vacuum_mode(self) -> str:
+        """Режим auto_vacuum базы: none, full или incremental"""
+        # Читатели не перечитывают режим после VACUUM, поэтому спрашиваем писателя
+        async def operation(db):
+            async with db.execute("PRAGMA auto_vacuum") as cursor:
+                return (await cursor.fetchone())[0]
+        
+        mode = await self.pool.write(operation, transaction=False)
+        return {0: 'none', 1: 'full', 2: 'incremental'}.get(mode, str(mode))
+
+    @instrumented
+    async def vacuum(self):
+        """Полный VACUUM: перестройка файла БД и переход в режим incremental.
+
+        Блокирует запись на время выполнения, запускается вручную администратором.
+        """
+        async def operation(db):
+            await db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            await db.execute("VACUUM")
+        
+        await self.pool.write(operation, transaction=False)
+
+    @instrumented
+    async def get_archive_stats(self) -> Dict:
+        """Размеры рабочей таблицы и архива, свободные страницы файла"""
+        async with self.pool.reader() as db:
+            async with db.execute("""
+                SELECT (SELECT COUNT(*) FROM feedback),
+                       (SELECT COUNT(*) FROM feedback_archive)
+            """) as cursor:
+                hot, archived = await cursor.fetchone()
+            async with db.execute("PRAGMA freelist_count") as cursor:
+                free_pages = (await cursor.fetchone())[0]
+            async with db.execute("PRAGMA page_count") as cursor:
+                page_count = (await cursor.fetchone())[0]
+        
+        return {
+            'hot': hot,
+            'archived': archived,
+            'free_pages': free_pages,
+            'page_count': page_count,
+        }
+
+    @instrumented
     async def get_stats(self) -> Dict:
         """Получение статистики"""
-        async with aiosqlite.connect(self.db_path) as db:
-            # Общее количество заявок
-            cursor = await db.execute("SELECT COUNT(*) FROM feedback")
-            total = (await cursor.fetchone())[0]
-            
-            # Новые заявки
-            cursor = await db.execute("SELECT COUNT(*) FROM feedback WHERE status = 'new'")
-            new = (await cursor.fetchone())[0]
-            
-            # Заявки в работе
-            cursor = await db.execute("SELECT COUNT(*) FROM feedback WHERE status = 'in_progress'")
-            in_progress = (await cursor.fetchone())[0]
-            
-            # Закрытые заявки
-            cursor = await db.execute("SELECT COUNT(*) FROM feedback WHERE status = 'closed'")
-            closed = (await cursor.fetchone())[0]
-            
-            return {
-                'total': total,
-                'new': new,
-                'in_progress': in_progress,
-                'closed': closed
-            }
-
+        breakdown = await self.get_breakdown()
+        
+        return {
+            'total': breakdown['total'],
+            'new': breakdown['by_status']['new'],
+            'in_progress': breakdown['by_status']['in_progress'],
+            'closed': breakdown['by_status']['closed']
+        }
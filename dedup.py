@@ -0,0 +1,247 @@
+"""
+Поиск почти одинаковых заявок (MinHash + LSH).
+
+Когда в цехе ломается станок, десятки сотрудников пишут практически одно
+и то же. DuplicateDetector держит в памяти индекс MinHash-сигнатур открытых
+заявок за последние дни: текст разбивается на символьные k-граммы,
+сигнатура — минимумы хэшей k-грамм по num_perm перестановкам, а LSH делит
+сигнатуру на полосы и ищет кандидатов по совпадению хотя бы одной полосы
+в той же категории. Проверка новой заявки — несколько обращений к словарю,
+без запросов к БД.
+
+Сигнатуры хранятся в таблице feedback_signatures и пишутся в той же
+транзакции, что и заявка; индекс догружает новые строки по времени записи
+(refresh), поэтому видит и заявки других процессов и шардов. Закрытые
+заявки удаляются из таблицы триггером, а из памяти — сразу при закрытии в
+этом процессе (discard), при сверке с таблицей раз в resync_interval
+секунд (закрытые другими процессами и архивированные) и по истечении окна:
+индекс ограничен открытыми заявками за окно. Окончательную проверку
+кандидата (заявка открыта и сама не дубликат) выполняет add_feedback
+хранилища внутри транзакции записи.
+"""
+
+import hashlib
+import heapq
+import logging
+import random
+import re
+import time
+from array import array
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set, Tuple
+
+from storage import FeedbackStorage
+
+logger = logging.getLogger(__name__)
+
+_NON_WORD = re.compile(r"[\W_]+")
+
+
+def normalize_text(text: str) -> str:
+    """Текст без регистра, пунктуации и лишних пробелов; ё → е"""
+    return _NON_WORD.sub(" ", text.lower().replace("ё", "е")).strip()
+
+
+def shingles(text: str, k: int = 4) -> Set[int]:
+    """64-битные хэши символьных k-грамм нормализованного текста"""
+    text = normalize_text(text)
+    grams = {text[i:i + k] for i in range(max(1, len(text) - k + 1))} if text else set()
+    return {
+        int.from_bytes(hashlib.blake2b(gram.encode("utf-8"), digest_size=8).digest(), "little")
+        for gram in grams
+    }
+
+
+class MinHasher:
+    """Сигнатуры MinHash: перестановки задаются XOR-масками 64-битного хэша"""
+
+    def __init__(self, num_perm: int = 32, seed: int = 1):
+        rng = random.Random(seed)
+        self.num_perm = num_perm
+        self._masks = [rng.getrandbits(64) for _ in range(num_perm)]
+
+    def signature(self, hashes: Set[int]) -> Tuple[int, ...]:
+        return tuple(min(map(mask.__xor__, hashes)) for mask in self._masks)
+
+    @staticmethod
+    def similarity(a: Tuple[int, ...], b: Tuple[int, ...]) -> float:
+        """Оценка коэффициента Жаккара по доле совпавших минимумов"""
+        return sum(x == y for x, y in zip(a, b)) / len(a)
+
+    @staticmethod
+    def pack(signature: Tuple[int, ...]) -> bytes:
+        return array("Q", signature).tobytes()
+
+    @staticmethod
+    def unpack(data: bytes) -> Tuple[int, ...]:
+        return tuple(array("Q", data))
+
+
+class DuplicateDetector:
+    """Индекс MinHash/LSH открытых заявок по категориям"""
+
+    def __init__(self, db: FeedbackStorage, threshold: float = 0.6, window_days: float = 7,
+                 num_perm: int = 32, bands: int = 16, shingle_size: int = 4,
+                 min_shingles: int = 12, max_candidates: int = 5,
+                 resync_interval: float = 600):
+        if num_perm % bands:
+            raise ValueError("num_perm должно делиться на bands")
+        self.db = db
+        self.threshold = threshold
+        self.window = window_days * 86400
+        # 16 полос по 2 значения: кандидатами становятся заявки со сходством
+        # от ~0.25, точный отбор по порогу — сравнением сигнатур
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        # Короткие тексты ("не работает") слишком похожи друг на друга
+        self.min_shingles = min_shingles
+        self.max_candidates = max_candidates
+        self.hasher = MinHasher(num_perm)
+        self.resync_interval = resync_interval
+        # (категория, номер полосы, значения полосы) -> номера заявок
+        self._buckets: Dict[Tuple, Set[int]] = defaultdict(set)
+        # номер заявки -> (категория, сигнатура, время создания)
+        self._entries: Dict[int, Tuple[str, Tuple[int, ...], float]] = {}
+        # (время создания, номер) — куча для удаления по окну; записи уже
+        # удаленных заявок пропускаются при извлечении
+        self._expiry: List[Tuple[float, int]] = []
+        self._last_created: Optional[str] = None
+        self._next_resync = time.monotonic() + resync_interval
+        self._stats = {'checks': 0, 'matches': 0, 'expired': 0, 'resynced': 0}
+
+    def _band_keys(self, category: str, signature: Tuple[int, ...]):
+        rows = self.rows
+        return [(category, band, signature[band * rows:(band + 1) * rows])
+                for band in range(self.bands)]
+
+    def signature(self, text: str) -> Optional[Tuple[int, ...]]:
+        """Сигнатура текста или None, если текст слишком короткий для сравнения"""
+        hashes = shingles(text, self.shingle_size)
+        if len(hashes) < self.min_shingles:
+            return None
+        return self.hasher.signature(hashes)
+
+    def add(self, feedback_id: int, category: str, signature: Tuple[int, ...],
+            created: float = None):
+        if feedback_id in self._entries:
+            return
+        created = created or time.time()
+        self._entries[feedback_id] = (category, signature, created)
+        heapq.heappush(self._expiry, (created, feedback_id))
+        for key in self._band_keys(category, signature):
+            self._buckets[key].add(feedback_id)
+
+    def discard(self, feedback_id: int):
+        entry = self._entries.pop(feedback_id, None)
+        if entry is None:
+            return
+        category, signature, _ = entry
+        for key in self._band_keys(category, signature):
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(feedback_id)
+                if not bucket:
+                    del self._buckets[key]
+
+    def prune(self, now: float = None) -> int:
+        """Удаление заявок старше окна; возвращает их число"""
+        expired = (now or time.time()) - self.window
+        removed = 0
+        while self._expiry and self._expiry[0][0] < expired:
+            created, feedback_id = heapq.heappop(self._expiry)
+            entry = self._entries.get(feedback_id)
+            if entry is not None and entry[2] == created:
+                self.discard(feedback_id)
+                removed += 1
+        self._stats['expired'] += removed
+        return removed
+
+    def find(self, category: str, signature: Tuple[int, ...]) -> List[Tuple[int, float]]:
+        """Похожие заявки той же категории: [(номер, сходство), ...] по убыванию сходства"""
+        expired = time.time() - self.window
+        candidates = set()
+        for key in self._band_keys(category, signature):
+            candidates |= self._buckets.get(key, set())
+
+        matches = []
+        for feedback_id in candidates:
+            _, other, created = self._entries[feedback_id]
+            if created < expired:
+                self.discard(feedback_id)
+                self._stats['expired'] += 1
+                continue
+            similarity = self.hasher.similarity(signature, other)
+            if similarity >= self.threshold:
+                matches.append((feedback_id, similarity))
+
+        matches.sort(key=lambda match: (-match[1], match[0]))
+        return matches[:self.max_candidates]
+
+    def check(self, category: str, text: str) -> Tuple[Optional[bytes], List[int]]:
+        """Проверка новой заявки перед сохранением.
+
+        Возвращает упакованную сигнатуру для feedback_signatures и номера
+        заявок-кандидатов для add_feedback(duplicate_candidates=...).
+        """
+        self._stats['checks'] += 1
+        signature = self.signature(text)
+        if signature is None:
+            return None, []
+        matches = self.find(category, signature)
+        if matches:
+            self._stats['matches'] += 1
+        return self.hasher.pack(signature), [feedback_id for feedback_id, _ in matches]
+
+    def _since(self) -> str:
+        since = datetime.now(timezone.utc) - timedelta(seconds=self.window)
+        return since.strftime('%Y-%m-%d %H:%M:%S')
+
+    async def load(self):
+        """Начальная загрузка: сигнатуры открытых заявок за окно, недостающие вычисляются"""
+        missing = await self.db.get_unsigned_feedback(self._since())
+        signatures = []
+        for row in missing:
+            signature = self.signature(row['message'])
+            if signature is not None:
+                signatures.append((row['id'], row['category'], self.hasher.pack(signature)))
+        if signatures:
+            await self.db.save_signatures(signatures)
+            logger.info("Вычислены сигнатуры для %s открытых заявок", len(signatures))
+        await self.refresh()
+
+    async def resync(self, settle: float = 60) -> int:
+        """Удаление заявок, сигнатур которых больше нет в таблице (закрыты или в архиве)"""
+        # Заявки последних settle секунд могли быть догружены параллельным
+        # refresh после чтения таблицы: их сверка — в следующий раз
+        settled = time.time() - settle
+        current = {row['feedback_id'] for row in await self.db.get_signatures(since=self._since())}
+        stale = [feedback_id for feedback_id, (_, _, created) in self._entries.items()
+                 if created < settled and feedback_id not in current]
+        for feedback_id in stale:
+            self.discard(feedback_id)
+        self._stats['resynced'] += len(stale)
+        return len(stale)
+
+    async def refresh(self):
+        """Догрузка сигнатур, записанных после последней загрузки, и очистка индекса"""
+        self.prune()
+        if time.monotonic() >= self._next_resync:
+            self._next_resync = time.monotonic() + self.resync_interval
+            await self.resync()
+        since = self._since()
+        if self._last_created is not None:
+            since = max(since, self._last_created)
+        # Строки за последнюю секунду читаются повторно, add() их пропускает
+        for row in await self.db.get_signatures(since=since):
+            created = datetime.strptime(row['created_at'], '%Y-%m-%d %H:%M:%S')
+            created = created.replace(tzinfo=timezone.utc).timestamp()
+            self.add(row['feedback_id'], row['category'],
+                     self.hasher.unpack(row['signature']), created)
+            self._last_created = row['created_at']
+
+    def stats(self) -> Dict:
+        """Размер индекса и число найденных дубликатов"""
+        return {'indexed': len(self._entries), 'buckets': len(self._buckets),
+                'expiry_queue': len(self._expiry), **self._stats}
@@ -0,0 +1,388 @@
+"""
+Выгрузка заявок в CSV, JSONL и XLSX для администраторов.
+
+Заявки читаются пачками (iter_feedback хранилища) и сразу дописываются во
+временный файл, поэтому память не растет с размером выгрузки. Запись в
+файл выполняется в отдельном потоке, чтобы не блокировать цикл событий.
+XLSX собирается вручную: лист пишется потоком прямо в zip-архив книги со
+строками inline, без таблицы общих строк. Выгрузка идет фоновой задачей,
+которая обновляет сообщение с прогрессом и отправляет готовый файл через
+send_document.
+"""
+
+import asyncio
+import csv
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import time
+import zipfile
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from xml.sax.saxutils import escape
+
+from aiogram import Bot
+from aiogram.types import FSInputFile
+
+from config import FEEDBACK_CATEGORIES, FEEDBACK_STATUSES, FEEDBACK_TYPES
+from storage import FeedbackStorage
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ("csv", "jsonl", "xlsx")
+
+# Колонки выгрузки: поле заявки -> заголовок
+EXPORT_COLUMNS = [
+    ("id", "Номер"),
+    ("created_at", "Создана"),
+    ("updated_at", "Обновлена"),
+    ("status", "Статус"),
+    ("feedback_type", "Тип"),
+    ("category", "Категория"),
+    ("message", "Сообщение"),
+    ("is_anonymous", "Анонимно"),
+    ("user_id", "ID пользователя"),
+    ("username", "Username"),
+    ("first_name", "Имя"),
+    ("last_name", "Фамилия"),
+    ("admin_id", "ID администратора"),
+    ("admin_response", "Ответ администратора"),
+    ("duplicate_of", "Дубликат заявки"),
+]
+
+# Персональные данные, которые не выгружаются для анонимных заявок
+PERSONAL_FIELDS = ("user_id", "username", "first_name", "last_name")
+
+# Максимум строк листа Excel без заголовка
+XLSX_MAX_ROWS = 1048575
+# Ограничение Bot API на размер отправляемого файла
+TELEGRAM_FILE_LIMIT = 50 * 1024 * 1024
+# Не чаще одного обновления сообщения с прогрессом за столько секунд
+PROGRESS_INTERVAL = 3.0
+
+
+class ExportError(Exception):
+    """Ошибка параметров или выполнения выгрузки (текст показывается админу)"""
+
+
+def parse_export_args(args: Optional[str]) -> Tuple[str, Dict]:
+    """Разбор аргументов /export: формат и фильтры key=value.
+
+    Пример: "xlsx status=new category=hr type=complaint from=2024-01-01 to=2024-03-31"
+    """
+    fmt = "csv"
+    filters = {}
+
+    for token in (args or "").split():
+        if "=" not in token:
+            if token.lower() not in EXPORT_FORMATS:
+                raise ExportError(f"Неизвестный формат «{token}». Доступны: {', '.join(EXPORT_FORMATS)}")
+            fmt = token.lower()
+            continue
+
+        key, value = token.split("=", 1)
+        key = key.lower()
+        if key == "status":
+            if value not in FEEDBACK_STATUSES:
+                raise ExportError(f"Неизвестный статус. Доступны: {', '.join(FEEDBACK_STATUSES)}")
+            filters['status'] = value
+        elif key == "category":
+            if value not in FEEDBACK_CATEGORIES:
+                raise ExportError(f"Неизвестная категория. Доступны: {', '.join(FEEDBACK_CATEGORIES)}")
+            filters['category'] = FEEDBACK_CATEGORIES[value]
+        elif key == "type":
+            if value not in FEEDBACK_TYPES:
+                raise ExportError(f"Неизвестный тип. Доступны: {', '.join(FEEDBACK_TYPES)}")
+            filters['feedback_type'] = value
+        elif key in ("from", "to"):
+            try:
+                date = datetime.strptime(value, "%Y-%m-%d")
+            except ValueError:
+                raise ExportError(f"Дата «{value}» должна быть в формате ГГГГ-ММ-ДД")
+            if key == "from":
+                filters['date_from'] = date.strftime("%Y-%m-%d %H:%M:%S")
+            else:
+                # Дата окончания включительно
+                filters['date_to'] = (date + timedelta(days=1)).strftime("%Y-%m-%d %H:%M:%S")
+        else:
+            raise ExportError(f"Неизвестный фильтр «{key}». Доступны: status, category, type, from, to")
+
+    return fmt, filters
+
+
+def export_row(row: Dict) -> Dict:
+    """Строка выгрузки: колонки в порядке EXPORT_COLUMNS, без персональных данных анонимных заявок"""
+    values = {key: row.get(key) for key, _ in EXPORT_COLUMNS}
+    values['is_anonymous'] = bool(values['is_anonymous'])
+    if values['is_anonymous']:
+        for key in PERSONAL_FIELDS:
+            values[key] = None
+    return values
+
+
+class CsvExportWriter:
+    """CSV с BOM, чтобы Excel правильно определил UTF-8"""
+
+    extension = "csv"
+
+    def __init__(self, path: str):
+        self._file = open(path, "w", encoding="utf-8-sig", newline="")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow([title for _, title in EXPORT_COLUMNS])
+
+    def write_rows(self, rows: List[Dict]):
+        for row in rows:
+            values = export_row(row)
+            self._writer.writerow(["" if value is None else value for value in values.values()])
+
+    def close(self):
+        self._file.close()
+
+
+class JsonlExportWriter:
+    """Одна заявка — один JSON-объект в строке"""
+
+    extension = "jsonl"
+
+    def __init__(self, path: str):
+        self._file = open(path, "w", encoding="utf-8")
+
+    def write_rows(self, rows: List[Dict]):
+        self._file.writelines(
+            json.dumps(export_row(row), ensure_ascii=False, default=str) + "\n" for row in rows
+        )
+
+    def close(self):
+        self._file.close()
+
+
+# Символы, недопустимые в XML 1.0
+_XML_ILLEGAL = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+# Максимальная длина текста в ячейке Excel
+_XLSX_CELL_LIMIT = 32767
+
+_XLSX_STATIC = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Заявки" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '<Relationship Id="rId2" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+        'Target="styles.xml"/>'
+        '</Relationships>'
+    ),
+    # Стиль 1 — жирный шрифт для заголовка
+    "xl/styles.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+        '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="1"><fill><patternFill patternType="none"/></fill></fills>'
+        '<borders count="1"><border/></borders>'
+        '<cellStyleXfs count="1"><xf/></cellStyleXfs>'
+        '<cellXfs count="2"><xf fontId="0"/><xf fontId="1" applyFont="1"/></cellXfs>'
+        '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+        '</styleSheet>'
+    ),
+}
+
+
+class XlsxExportWriter:
+    """Потоковая запись книги XLSX с одним листом"""
+
+    extension = "xlsx"
+
+    def __init__(self, path: str):
+        self._zip = zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED)
+        # Статические части пишем до открытия потока листа
+        for name, content in _XLSX_STATIC.items():
+            self._zip.writestr(name, content)
+        self._sheet = self._zip.open("xl/worksheets/sheet1.xml", "w", force_zip64=True)
+        self._sheet.write(
+            b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+            b'<sheetData>'
+        )
+        self._write_row([title for _, title in EXPORT_COLUMNS], style=1)
+
+    @staticmethod
+    def _cell(value, style: int = 0) -> str:
+        style_attr = f' s="{style}"' if style else ""
+        if value is None:
+            return f"<c{style_attr}/>"
+        if isinstance(value, bool):
+            return f'<c t="b"{style_attr}><v>{int(value)}</v></c>'
+        if isinstance(value, (int, float)):
+            return f"<c{style_attr}><v>{value}</v></c>"
+        text = _XML_ILLEGAL.sub("", str(value))[:_XLSX_CELL_LIMIT]
+        return f'<c t="inlineStr"{style_attr}><is><t xml:space="preserve">{escape(text)}</t></is></c>'
+
+    def _write_row(self, values, style: int = 0):
+        cells = "".join(self._cell(value, style) for value in values)
+        self._sheet.write(f"<row>{cells}</row>".encode("utf-8"))
+
+    def write_rows(self, rows: List[Dict]):
+        for row in rows:
+            self._write_row(export_row(row).values())
+
+    def close(self):
+        self._sheet.write(b"</sheetData></worksheet>")
+        self._sheet.close()
+        self._zip.close()
+
+
+WRITERS = {
+    "csv": CsvExportWriter,
+    "jsonl": JsonlExportWriter,
+    "xlsx": XlsxExportWriter,
+}
+
+
+async def export_feedback(db: FeedbackStorage, path: str, fmt: str, filters: Dict,
+                          progress: Callable[[int], Awaitable] = None,
+                          chunk_size: int = 1000) -> int:
+    """Выгрузка заявок по фильтрам в файл. Возвращает число строк."""
+    writer = await asyncio.to_thread(WRITERS[fmt], path)
+    written = 0
+    try:
+        async for chunk in db.iter_feedback(**filters, chunk_size=chunk_size):
+            await asyncio.to_thread(writer.write_rows, chunk)
+            written += len(chunk)
+            if progress:
+                await progress(written)
+    finally:
+        await asyncio.to_thread(writer.close)
+    return written
+
+
+def _compress(path: str) -> str:
+    """Упаковка файла в zip, если он не проходит по размеру в Telegram"""
+    zip_path = path + ".zip"
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.write(path, os.path.basename(path))
+    os.remove(path)
+    return zip_path
+
+
+# Фоновые выгрузки: чат администратора -> задача
+_jobs: Dict[int, asyncio.Task] = {}
+
+
+def is_export_running(chat_id: int) -> bool:
+    task = _jobs.get(chat_id)
+    return task is not None and not task.done()
+
+
+def start_export_job(bot: Bot, db: FeedbackStorage, chat_id: int, message_id: int,
+                     fmt: str, filters: Dict, total: int) -> asyncio.Task:
+    """Запуск выгрузки в фоне; message_id — сообщение, в котором показывается прогресс"""
+    task = asyncio.create_task(
+        _run_export(bot, db, chat_id, message_id, fmt, filters, total),
+        name=f"export-{chat_id}"
+    )
+    _jobs[chat_id] = task
+
+    def forget(_):
+        if _jobs.get(chat_id) is task:
+            del _jobs[chat_id]
+
+    task.add_done_callback(forget)
+    return task
+
+
+async def cancel_export_jobs():
+    """Остановка всех фоновых выгрузок (при завершении бота)"""
+    tasks = list(_jobs.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _run_export(bot: Bot, db: FeedbackStorage, chat_id: int, message_id: int,
+                      fmt: str, filters: Dict, total: int):
+    started = time.monotonic()
+    last_update = started
+
+    async def progress(done: int):
+        nonlocal last_update
+        now = time.monotonic()
+        if now - last_update < PROGRESS_INTERVAL or done >= total:
+            return
+        last_update = now
+        try:
+            await bot.edit_message_text(
+                f"⏳ Выгрузка: {done} из {total} ({done * 100 // max(total, 1)}%)",
+                chat_id=chat_id, message_id=message_id
+            )
+        except Exception as e:
+            logger.warning("Не удалось обновить прогресс выгрузки: %s", e)
+
+    tmp_dir = tempfile.mkdtemp(prefix="feedback_export_")
+    filename = f"feedback_{datetime.now().strftime('%Y%m%d_%H%M')}.{fmt}"
+    path = os.path.join(tmp_dir, filename)
+
+    try:
+        rows = await export_feedback(db, path, fmt, filters, progress)
+
+        if os.path.getsize(path) > TELEGRAM_FILE_LIMIT and fmt != "xlsx":
+            path = await asyncio.to_thread(_compress, path)
+        if os.path.getsize(path) > TELEGRAM_FILE_LIMIT:
+            raise ExportError("Файл больше 50 МБ, сузьте фильтры выгрузки")
+
+        await bot.send_document(
+            chat_id,
+            FSInputFile(path, filename=os.path.basename(path)),
+            caption=f"📤 Заявок: {rows}"
+        )
+        await bot.edit_message_text(
+            f"✅ Выгрузка готова: {rows} заявок за {time.monotonic() - started:.0f} с",
+            chat_id=chat_id, message_id=message_id
+        )
+        logger.info("Выгрузка %s для %s: %s строк", fmt, chat_id, rows)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.exception("Ошибка выгрузки заявок")
+        reason = str(e) if isinstance(e, ExportError) else "внутренняя ошибка"
+        try:
+            await bot.edit_message_text(
+                f"❌ Выгрузка не выполнена: {reason}",
+                chat_id=chat_id, message_id=message_id
+            )
+        except Exception:
+            pass
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
@@ -0,0 +1,252 @@
+"""
+Хранилище состояний FSM в SQLite с LRU-кэшем в памяти.
+
+Стандартный MemoryStorage aiogram держит незаконченные сценарии (черновики
+заявок, ответы администраторов) в памяти без ограничения и теряет их при
+перезапуске. SQLiteFSMStorage:
+
+- читает состояние из LRU-кэша на max_size ключей, при промахе — из SQLite;
+  отсутствие состояния тоже кэшируется, поэтому проверка состояния на
+  каждом сообщении не обращается к базе;
+- записывает изменения отложенно (write-behind): измененные ключи
+  сбрасываются одной транзакцией раз в flush_interval секунд, при
+  накоплении flush_batch изменений и при закрытии;
+- забывает сценарии, которые не менялись дольше ttl секунд: в кэше — при
+  чтении, в базе — периодической очисткой.
+
+Пустое состояние без данных хранится как отсутствие строки. Несброшенные
+изменения лежат отдельно от кэша и не вытесняются, так что память ограничена
+max_size плюс изменения одного интервала; сбой процесса теряет не больше них.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict, namedtuple
+from typing import Any, Dict, Optional
+
+import aiosqlite
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS fsm_state (
+        key TEXT PRIMARY KEY,
+        state TEXT,
+        data TEXT NOT NULL,
+        updated_at REAL NOT NULL
+    ) WITHOUT ROWID
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_fsm_state_updated ON fsm_state (updated_at)",
+]
+
+# data — JSON: сериализуется при записи, поэтому ошибка видна хендлеру, а не сбросу
+Record = namedtuple('Record', ['state', 'data', 'updated_at'])
+EMPTY = Record(None, '{}', 0.0)
+
+
+def is_empty(record: Record) -> bool:
+    return record.state is None and record.data == '{}'
+
+
+class SQLiteFSMStorage(BaseStorage):
+    """Состояния FSM: LRU в памяти, отложенная запись в SQLite, TTL"""
+
+    def __init__(self, db_path: str, max_size: int = 10000, ttl: float = 86400,
+                 flush_interval: float = 1.0, flush_batch: int = 500,
+                 sweep_interval: float = 600):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.flush_batch = max(1, flush_batch)
+        self.sweep_interval = sweep_interval
+        self._conn: Optional[aiosqlite.Connection] = None
+        self._cache: "OrderedDict[str, Record]" = OrderedDict()
+        # Изменения, ожидающие сброса, и пачка, которая записывается сейчас
+        self._dirty: Dict[str, Record] = {}
+        self._flushing: Dict[str, Record] = {}
+        self._flush_needed = asyncio.Event()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._closing = False
+        self._stats = {
+            'hits': 0, 'misses': 0, 'expired': 0, 'evicted': 0,
+            'flushes': 0, 'flushed': 0, 'flush_errors': 0, 'swept': 0,
+        }
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+    async def open(self):
+        self._conn = await aiosqlite.connect(self.db_path)
+        await self._conn.execute("PRAGMA journal_mode = WAL")
+        await self._conn.execute("PRAGMA synchronous = NORMAL")
+        # Файл могут открывать рабочие процессы (BOT_WORKERS)
+        await self._conn.execute("PRAGMA busy_timeout = 5000")
+        for statement in SCHEMA:
+            await self._conn.execute(statement)
+        await self._conn.commit()
+        self._closing = False
+        self._flush_task = asyncio.create_task(self._flush_loop(), name="fsm-flush")
+
+    async def close(self):
+        """Сброс несохраненных изменений и закрытие; повторный вызов ничего не делает"""
+        if self._conn is None:
+            return
+        self._closing = True
+        self._flush_needed.set()
+        await self._flush_task
+        self._flush_task = None
+        try:
+            # Повтор, если сброс в цикле завершился ошибкой
+            await self.flush()
+        except Exception:
+            logger.exception("Не сохранено состояний FSM: %s", len(self._dirty))
+        await self._conn.close()
+        self._conn = None
+
+    def _peek(self, key: str) -> Optional[Record]:
+        record = self._dirty.get(key) or self._flushing.get(key)
+        if record is None:
+            record = self._cache.get(key)
+            if record is not None:
+                self._cache.move_to_end(key)
+        return record
+
+    def _remember(self, key: str, record: Record):
+        self._cache[key] = record
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+            self._stats['evicted'] += 1
+
+    def _expired(self, record: Record, now: float) -> bool:
+        return not is_empty(record) and record.updated_at + self.ttl <= now
+
+    async def _record(self, key: str) -> Record:
+        now = time.time()
+        record = self._peek(key)
+        if record is not None:
+            self._stats['hits'] += 1
+            if self._expired(record, now):
+                # Строку в базе удалит очистка
+                self._stats['expired'] += 1
+                self._remember(key, EMPTY)
+                return EMPTY
+            return record
+
+        self._stats['misses'] += 1
+        async with self._conn.execute(
+            "SELECT state, data, updated_at FROM fsm_state WHERE key = ? AND updated_at > ?",
+            (key, now - self.ttl)
+        ) as cursor:
+            row = await cursor.fetchone()
+        # Пока шло чтение, ключ мог быть изменен: новое значение важнее прочитанного
+        latest = self._peek(key)
+        if latest is not None:
+            return latest
+        record = Record(*row) if row is not None else EMPTY
+        self._remember(key, record)
+        return record
+
+    def _write(self, key: str, state: Optional[str], data: str):
+        record = Record(state, data, time.time())
+        if is_empty(record):
+            record = EMPTY
+        self._dirty[key] = record
+        self._remember(key, record)
+        if len(self._dirty) >= self.flush_batch:
+            self._flush_needed.set()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        name = self._key(key)
+        await self._record(name)
+        # Без ожиданий между чтением и записью: данные берутся самые свежие
+        current = self._peek(name) or EMPTY
+        self._write(name, state.state if isinstance(state, State) else state, current.data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._record(self._key(key))).state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        name = self._key(key)
+        payload = json.dumps(data, ensure_ascii=False)
+        await self._record(name)
+        current = self._peek(name) or EMPTY
+        self._write(name, current.state, payload)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return json.loads((await self._record(self._key(key))).data)
+
+    async def flush(self):
+        """Запись накопленных изменений одной транзакцией"""
+        if not self._dirty or self._conn is None:
+            return
+        self._flushing, self._dirty = self._dirty, {}
+        batch = self._flushing
+        try:
+            await self._conn.executemany(
+                """
+                INSERT INTO fsm_state (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                    state = excluded.state, data = excluded.data, updated_at = excluded.updated_at
+                """,
+                [(key, *record) for key, record in batch.items() if not is_empty(record)]
+            )
+            await self._conn.executemany(
+                "DELETE FROM fsm_state WHERE key = ?",
+                [(key,) for key, record in batch.items() if is_empty(record)]
+            )
+            await self._conn.commit()
+        except BaseException:
+            self._stats['flush_errors'] += 1
+            await self._conn.rollback()
+            # Изменения, сделанные во время записи, новее неудачной пачки
+            for key, record in batch.items():
+                self._dirty.setdefault(key, record)
+            raise
+        finally:
+            self._flushing = {}
+        self._stats['flushes'] += 1
+        self._stats['flushed'] += len(batch)
+
+    async def sweep(self) -> int:
+        """Удаление сценариев, не менявшихся дольше ttl"""
+        now = time.time()
+        for key in [key for key, record in self._cache.items() if self._expired(record, now)]:
+            del self._cache[key]
+        cursor = await self._conn.execute(
+            "DELETE FROM fsm_state WHERE updated_at <= ?", (now - self.ttl,)
+        )
+        await self._conn.commit()
+        self._stats['swept'] += cursor.rowcount
+        return cursor.rowcount
+
+    async def _flush_loop(self):
+        next_sweep = time.monotonic()
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_needed.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_needed.clear()
+            try:
+                await self.flush()
+                if not self._closing and time.monotonic() >= next_sweep:
+                    swept = await self.sweep()
+                    if swept:
+                        logger.info("Удалено брошенных состояний FSM: %s", swept)
+                    next_sweep = time.monotonic() + self.sweep_interval
+            except Exception:
+                logger.exception("Ошибка записи состояний FSM")
+            if self._closing:
+                return
+
+    def stats(self) -> Dict:
+        """Размер кэша, попадания и сбросы в базу"""
+        return {'size': len(self._cache), 'pending': len(self._dirty), **self._stats}
@@ -5,12 +5,17 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from datetime import datetime
 import html
+import logging
+import math
 
-from database import Database
+from storage import FeedbackStorage
+from dedup import DuplicateDetector
 from keyboards import *
 from config import FEEDBACK_CATEGORIES, FEEDBACK_TYPES, ADMIN_IDS
+from outbox import outbox_message
 
-router = Router()
+router = Router(name="main")
+logger = logging.getLogger(__name__)
 
 # Состояния для FSM
 class FeedbackStates(StatesGroup):
@@ -20,11 +25,8 @@ class FeedbackStates(StatesGroup):
     waiting_for_confirmation = State()
     waiting_for_admin_response = State()
 
-# Временное хранилище данных пользователей
-user_data = {}
-
-@router.message(Command("start"))
-async def cmd_start(message: Message, db: Database):
+@router.message(Command("start"), flags={"throttling": "start"})
+async def cmd_start(message: Message, db: FeedbackStorage):
     """Обработчик команды /start"""
     user = message.from_user
     
@@ -138,24 +140,13 @@ async def process_message(message: Message, state: FSMContext):
     )
     await state.set_state(FeedbackStates.waiting_for_confirmation)
 
-@router.callback_query(F.data == "confirm_send")
-async def confirm_send(callback: CallbackQuery, state: FSMContext, db: Database):
+@router.callback_query(F.data == "confirm_send", flags={"throttling": "submit"})
+async def confirm_send(callback: CallbackQuery, state: FSMContext, db: FeedbackStorage,
+                       dedup: DuplicateDetector = None):
     """Подтверждение и отправка заявки"""
     data = await state.get_data()
     user = callback.from_user
     
-    # Сохраняем заявку в базу данных
-    feedback_id = await db.add_feedback(
-        user_id=user.id,
-        username=user.username,
-        first_name=user.first_name,
-        last_name=user.last_name,
-        category=data['category'],
-        feedback_type=data['feedback_type'],
-        message=data['message_text'],
-        is_anonymous=data['is_anonymous']
-    )
-    
     # Формируем сообщение для админов
     feedback_type_text = FEEDBACK_TYPES[data['feedback_type']]
     tag = f"[{feedback_type_text}]"
@@ -164,8 +155,14 @@ async def confirm_send(callback: CallbackQuery, state: FSMContext, db: Database)
     if user.username:
         sender_info += f" (@{user.username})"
     
-    admin_message = f"""
-🔔 <b>Новая заявка #{feedback_id}</b>
+    def admin_notifications(feedback_id: int, duplicate_of: int = None):
+        if duplicate_of:
+            # Похожие заявки собираются в ветку ответов на уведомление об исходной
+            header = f"🔁 <b>Похожая заявка #{feedback_id}</b> (дубликат #{duplicate_of})"
+        else:
+            header = f"🔔 <b>Новая заявка #{feedback_id}</b>"
+        admin_message = f"""
+{header}
 
 {tag} <b>{data['category']}</b>
 
@@ -175,18 +172,33 @@ async def confirm_send(callback: CallbackQuery, state: FSMContext, db: Database)
 <b>Сообщение:</b>
 {html.escape(data['message_text'])}
 """
+        keyboard = get_feedback_action_keyboard(feedback_id)
+        return [outbox_message(admin_id, admin_message, keyboard, reply_to_feedback_id=duplicate_of)
+                for admin_id in ADMIN_IDS]
     
-    # Отправляем уведомления админам
-    for admin_id in ADMIN_IDS:
-        try:
-            await callback.bot.send_message(
-                admin_id,
-                admin_message,
-                parse_mode="HTML",
-                reply_markup=get_feedback_action_keyboard(feedback_id)
-            )
-        except Exception as e:
-            print(f"Ошибка отправки уведомления админу {admin_id}: {e}")
+    # Похожие открытые заявки той же категории (индекс в памяти, без запросов к БД)
+    signature, candidates = None, []
+    if dedup is not None:
+        signature, candidates = dedup.check(data['category'], data['message_text'])
+    
+    # Сохраняем заявку и уведомления админам в одной транзакции;
+    # доставку выполняет фоновый обработчик outbox
+    feedback_id = await db.add_feedback(
+        user_id=user.id,
+        username=user.username,
+        first_name=user.first_name,
+        last_name=user.last_name,
+        category=data['category'],
+        feedback_type=data['feedback_type'],
+        message=data['message_text'],
+        is_anonymous=data['is_anonymous'],
+        notifications=admin_notifications,
+        signature=signature,
+        duplicate_candidates=candidates
+    )
+    
+    if signature is not None:
+        await dedup.refresh()
     
     await callback.message.edit_text(
         f"✅ <b>Заявка #{feedback_id} успешно отправлена!</b>\n\n"
@@ -212,41 +224,76 @@ async def cancel_feedback(callback: CallbackQuery, state: FSMContext):
     await callback.message.edit_text("❌ Создание заявки отменено.")
     await state.clear()
 
-@router.message(F.text == "📊 Мои заявки")
-async def my_feedback(message: Message, db: Database):
-    """Просмотр заявок пользователя"""
-    user_id = message.from_user.id
-    
-    # Получаем заявки пользователя
-    feedback_list = await db.get_feedback_list()
-    user_feedback = [f for f in feedback_list if f['user_id'] == user_id]
+# Количество заявок на странице "Мои заявки"
+MY_FEEDBACK_PER_PAGE = 10
+
+STATUS_EMOJI = {
+    'new': '🆕',
+    'in_progress': '⏳',
+    'closed': '✅'
+}
+
+async def render_my_feedback(db: FeedbackStorage, user_id: int, page: int = 1,
+                             cursor: str = None, direction: str = 'next'):
+    """Текст и клавиатура страницы заявок пользователя"""
+    result = await db.get_feedback_by_user(
+        user_id, cursor=cursor, limit=MY_FEEDBACK_PER_PAGE, direction=direction
+    )
     
-    if not user_feedback:
-        await message.answer("У вас пока нет заявок.")
-        return
+    if not result['items']:
+        return "У вас пока нет заявок.", None
     
     text = "<b>📊 Ваши заявки:</b>\n\n"
     
-    for feedback in user_feedback[:10]:  # Показываем последние 10
-        status_emoji = {
-            'new': '🆕',
-            'in_progress': '⏳',
-            'closed': '✅'
-        }
+    for feedback in result['items']:
+        feedback_type = FEEDBACK_TYPES.get(feedback.feedback_type, feedback.feedback_type)
+        status = STATUS_EMOJI.get(feedback.status, '❓')
         
-        feedback_type = FEEDBACK_TYPES.get(feedback['feedback_type'], feedback['feedback_type'])
-        status = status_emoji.get(feedback['status'], '❓')
+        text += f"{status} <b>#{feedback.id}</b> - {feedback_type}\n"
+        text += f"📂 {feedback.category}\n"
+        text += f"📅 {feedback.created_at[:16]}\n"
         
-        text += f"{status} <b>#{feedback['id']}</b> - {feedback_type}\n"
-        text += f"📂 {feedback['category']}\n"
-        text += f"📅 {feedback['created_at'][:16]}\n"
-        
-        if feedback['admin_response']:
+        if feedback.has_response:
             text += f"💬 <i>Есть ответ</i>\n"
         
         text += "\n"
     
-    await message.answer(text, parse_mode="HTML")
+    keyboard = None
+    if result['prev_cursor'] or result['next_cursor']:
+        total = await db.count_feedback_by_user(user_id)
+        total_pages = max(page, math.ceil(total / MY_FEEDBACK_PER_PAGE))
+        keyboard = get_pagination_keyboard(
+            page, total_pages, "my",
+            prev_cursor=result['prev_cursor'],
+            next_cursor=result['next_cursor'],
+            back_callback=None
+        )
+    
+    return text, keyboard
+
+@router.message(F.text == "📊 Мои заявки", flags={"throttling": "list"})
+async def my_feedback(message: Message, db: FeedbackStorage):
+    """Просмотр заявок пользователя"""
+    text, keyboard = await render_my_feedback(db, message.from_user.id)
+    await message.answer(text, reply_markup=keyboard, parse_mode="HTML")
+
+@router.callback_query(F.data.startswith("my:"), flags={"throttling": "list"})
+async def my_feedback_page(callback: CallbackQuery, db: FeedbackStorage):
+    """Переход между страницами заявок пользователя"""
+    _, page, direction, cursor = callback.data.split(":", 3)
+    
+    text, keyboard = await render_my_feedback(
+        db, callback.from_user.id, page=int(page), cursor=cursor,
+        direction='prev' if direction == 'p' else 'next'
+    )
+    
+    await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
+    await callback.answer()
+
+@router.callback_query(F.data == "current_page")
+async def current_page(callback: CallbackQuery):
+    """Нажатие на номер текущей страницы"""
+    await callback.answer()
 
 @router.message(F.text == "ℹ️ Помощь")
 async def help_command(message: Message):
@@ -70,7 +70,7 @@ def get_admin_panel_keyboard():
             [InlineKeyboardButton(text="⏳ В работе", callback_data="admin_progress")],
             [InlineKeyboardButton(text="✅ Закрытые", callback_data="admin_closed")],
             [InlineKeyboardButton(text="📊 Статистика", callback_data="admin_stats")],
-            [InlineKeyboardButton(text="🔍 Поиск по категории", callback_data="admin_search")],
+            [InlineKeyboardButton(text="🔍 Поиск", callback_data="admin_search")],
             [InlineKeyboardButton(text="❌ Закрыть", callback_data="cancel")]
         ]
     )
@@ -97,23 +97,27 @@ def get_back_keyboard():
     )
     return keyboard
 
-def get_pagination_keyboard(page: int, total_pages: int, prefix: str):
-    """Клавиатура пагинации"""
+def get_pagination_keyboard(page: int, total_pages: int, prefix: str,
+                            prev_cursor: str = None, next_cursor: str = None,
+                            back_callback: str = "admin_panel"):
+    """Клавиатура пагинации
+
+    Курсоры страниц кодируются в callback_data в формате
+    '{prefix}:{страница}:{направление}:{курсор}'.
+    """
     buttons = []
     
-    if page > 1:
-        buttons.append(InlineKeyboardButton(text="⬅️", callback_data=f"{prefix}_page_{page-1}"))
+    if prev_cursor:
+        buttons.append(InlineKeyboardButton(text="⬅️", callback_data=f"{prefix}:{page-1}:p:{prev_cursor}"))
     
     buttons.append(InlineKeyboardButton(text=f"{page}/{total_pages}", callback_data="current_page"))
     
-    if page < total_pages:
-        buttons.append(InlineKeyboardButton(text="➡️", callback_data=f"{prefix}_page_{page+1}"))
+    if next_cursor:
+        buttons.append(InlineKeyboardButton(text="➡️", callback_data=f"{prefix}:{page+1}:n:{next_cursor}"))
     
-    keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[
-            buttons,
-            [InlineKeyboardButton(text="🔙 Назад", callback_data="admin_panel")]
-        ]
-    )
+    rows = [buttons]
+    if back_callback:
+        rows.append([InlineKeyboardButton(text="🔙 Назад", callback_data=back_callback)])
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=rows)
     return keyboard
-
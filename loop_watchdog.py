@@ -0,0 +1,152 @@
+"""
+Контроль задержки событийного цикла.
+
+Бот работает в одном цикле asyncio, и любая синхронная работа в хендлере
+задерживает всех остальных пользователей. LoopWatchdog непрерывно
+измеряет задержку цикла (насколько позже запланированного просыпается
+heartbeat-задача) и отдает ее в метрики. Отдельный поток следит за
+heartbeat: если цикл не отвечает дольше порога, он снимает стек потока
+цикла через sys._current_frames() — это и есть код, который блокирует
+цикл прямо сейчас — и пишет его в лог вместе с именем текущей задачи.
+
+В отладочном режиме дополнительно включается loop.set_debug(): asyncio сам
+сообщает о колбэках дольше порога, а TaskNamingMiddleware дает задачам
+обработки апдейтов имена хендлеров, чтобы эти сообщения можно было
+сопоставить с кодом.
+"""
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Deque, Dict, Optional
+
+from metrics import LOOP_LAG, LOOP_STALLS, Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+
+class LoopWatchdog:
+    """Измерение задержки цикла и снятие стека при блокировке"""
+
+    def __init__(self, interval: float = 0.1, threshold: float = 0.25,
+                 max_reports: int = 20, lag_histogram: Histogram = LOOP_LAG,
+                 stall_counter: Counter = LOOP_STALLS):
+        self.interval = interval
+        self.threshold = threshold
+        self.lag_histogram = lag_histogram
+        self.stall_counter = stall_counter
+        # Последние отчеты о блокировках (время, длительность, задача, стек)
+        self.reports: Deque[Dict] = deque(maxlen=max_reports)
+        self.current_lag = 0.0
+        self.max_lag = 0.0
+        self.stalls = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._last_beat = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._heartbeat(), name="loop-watchdog")
+        self._thread = threading.Thread(target=self._monitor, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    async def _heartbeat(self):
+        while True:
+            scheduled = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - scheduled - self.interval)
+            self._last_beat = now
+            self.current_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            self.lag_histogram.observe(lag)
+
+    def _monitor(self):
+        reported_beat = None
+        while not self._stop.wait(self.interval / 2):
+            beat = self._last_beat
+            stalled = time.monotonic() - beat - self.interval
+            # Один отчет на блокировку: следующий — только после нового heartbeat
+            if stalled < self.threshold or beat == reported_beat:
+                continue
+            reported_beat = beat
+            self._report(stalled)
+
+    def _report(self, stalled: float):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return
+        stack = "".join(traceback.format_stack(frame))
+        task = asyncio.current_task(self._loop)
+        task_name = task.get_name() if task is not None else "-"
+
+        self.stalls += 1
+        self.stall_counter.inc()
+        self.reports.append({
+            'time': time.time(),
+            'stalled': stalled,
+            'task': task_name,
+            'stack': stack,
+        })
+        logger.warning(
+            "Цикл событий заблокирован уже %.0f мс (задача %s), стек:\n%s",
+            stalled * 1000, task_name, stack
+        )
+
+    def stats(self) -> Dict:
+        """Текущая и максимальная задержка цикла, число блокировок"""
+        return {
+            'lag': self.current_lag,
+            'max_lag': self.max_lag,
+            'stalls': self.stalls,
+        }
+
+
+def enable_debug(loop: asyncio.AbstractEventLoop, slow_callback: float = 0.1):
+    """Отладочный режим asyncio: предупреждения о колбэках дольше slow_callback"""
+    loop.set_debug(True)
+    loop.slow_callback_duration = slow_callback
+    logging.getLogger("asyncio").setLevel(logging.WARNING)
+    logger.info("Отладочный режим asyncio включен, порог %.0f мс", slow_callback * 1000)
+
+
+class TaskNamingMiddleware:
+    """Переименовывает задачу обработки апдейта по имени хендлера.
+
+    Сообщения asyncio о медленных колбэках и отчеты LoopWatchdog содержат
+    имя задачи, поэтому вместо "Task-123" в них виден "main.my_feedback".
+    """
+
+    async def __call__(self, handler, event, data):
+        task = asyncio.current_task()
+        handler_object = data.get('handler')
+        if task is not None and handler_object is not None:
+            router = data.get('event_router')
+            prefix = f"{router.name}." if router is not None else ""
+            task.set_name(f"{prefix}{handler_object.callback.__name__}")
+        return await handler(event, data)
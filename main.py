@@ -1,54 +1,325 @@
 import asyncio
 import logging
+import secrets
+import signal
+from typing import Optional, Tuple
+
 from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.fsm.storage.memory import MemoryStorage as MemoryFSMStorage
 
-from config import BOT_TOKEN, DATABASE_PATH
-from database import Database
+from config import (
+    BOT_TOKEN, DATABASE_PATH, STORAGE_ENGINE, DB_SHARDS, DB_SHARD_KEY, DB_POOL_SIZE, DB_WRITE_BATCH, DB_WRITE_WINDOW_MS,
+    DB_CACHE_SIZE, DB_CACHE_TTL, DB_PROFILE_QUERIES, DB_SLOW_QUERY_MS,
+    FSM_STORAGE, FSM_DATABASE_PATH, FSM_CACHE_SIZE, FSM_TTL_HOURS, FSM_FLUSH_INTERVAL_MS,
+    OUTBOUND_GLOBAL_RATE, OUTBOUND_CHAT_RATE, OUTBOUND_GROUP_RATE, OUTBOUND_MAX_RETRIES,
+    BOT_MODE, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_SECRET,
+    WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE, BOT_WORKERS,
+    METRICS_PORT, LOOP_LAG_THRESHOLD_MS, ASYNCIO_DEBUG,
+    ARCHIVE_AFTER_DAYS, ARCHIVE_INTERVAL_HOURS, ARCHIVE_COMPRESS,
+    ADMIN_IDS, THROTTLE_LIMITS, THROTTLE_ADMIN_MULTIPLIER,
+    DEDUP_THRESHOLD, DEDUP_WINDOW_DAYS
+)
+from storage import FeedbackStorage, MaintenanceStorage, create_storage
+from fsm_storage import SQLiteFSMStorage
+from export import cancel_export_jobs
+from metrics import (
+    REGISTRY, MetricsMiddleware, OutboundMetrics, start_metrics_server, stats_collector
+)
+from loop_watchdog import LoopWatchdog, TaskNamingMiddleware, enable_debug
+from outbound import EditDeduplicator, RateGovernor, SharedChatBuckets, SharedTokenBucket
+from outbox import OutboxWorker
+from archive import Archiver
+from dedup import DuplicateDetector
+from throttling import ThrottlingMiddleware
+from webhook import UpdateQueue, WebhookServer, feed_dispatcher
+from workers import CONTEXT, Supervisor, poll_updates
 from handlers import router as main_router
 from admin_handlers import router as admin_router
 
 # Настройка логирования
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    format='%(asctime)s - %(processName)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
 
-async def main():
-    """Главная функция запуска бота"""
+
+def start_watchdog() -> LoopWatchdog:
+    """Контроль задержки цикла: метрика и стек кода, блокирующего цикл"""
+    watchdog = LoopWatchdog(threshold=LOOP_LAG_THRESHOLD_MS / 1000)
+    watchdog.start()
+    if ASYNCIO_DEBUG:
+        enable_debug(asyncio.get_running_loop(), slow_callback=LOOP_LAG_THRESHOLD_MS / 1000)
+    REGISTRY.add_collector(stats_collector("bot_event_loop", "Событийный цикл", watchdog.stats))
+    return watchdog
+
+
+def create_bot(global_bucket: SharedTokenBucket = None, session=None,
+               chat_buckets: SharedChatBuckets = None) -> Bot:
+    """Бот с планировщиком исходящих; global_bucket и chat_buckets — общие лимиты процессов"""
+    bot = Bot(token=BOT_TOKEN, session=session)
     
-    # Инициализация бота
-    bot = Bot(token=BOT_TOKEN)
+    # Все исходящие сообщения проходят через общий планировщик лимитов
+    governor = RateGovernor(
+        global_rate=OUTBOUND_GLOBAL_RATE,
+        chat_rate=OUTBOUND_CHAT_RATE,
+        group_rate=OUTBOUND_GROUP_RATE,
+        max_retries=OUTBOUND_MAX_RETRIES,
+        global_bucket=global_bucket,
+        chat_buckets=chat_buckets
+    )
+    # Редактирования без изменений не отправляются и не занимают лимиты
+    edit_dedup = EditDeduplicator()
+    bot.session.middleware(edit_dedup)
+    bot.session.middleware(governor)
+    # Счетчики запросов к Telegram (каждая попытка после планировщика)
+    bot.session.middleware(OutboundMetrics())
     
-    # Инициализация диспетчера
-    dp = Dispatcher()
+    REGISTRY.add_collector(stats_collector("bot_outbound", "Планировщик исходящих", governor.stats))
+    REGISTRY.add_collector(stats_collector("bot_edit_dedup", "Пропуск редактирований", edit_dedup.stats))
+    return bot
+
+
+def create_storage_from_config() -> FeedbackStorage:
+    """Хранилище по настройкам окружения (движок задается STORAGE_ENGINE)"""
+    db = create_storage(
+        STORAGE_ENGINE,
+        DATABASE_PATH,
+        shards=DB_SHARDS,
+        shard_by=DB_SHARD_KEY,
+        pool_size=DB_POOL_SIZE,
+        write_batch=DB_WRITE_BATCH,
+        write_window=DB_WRITE_WINDOW_MS / 1000,
+        cache_size=DB_CACHE_SIZE,
+        cache_ttl=DB_CACHE_TTL,
+        slow_query_ms=DB_SLOW_QUERY_MS if DB_PROFILE_QUERIES else None
+    )
+    if not isinstance(db, MaintenanceStorage):
+        logger.warning("Хранилище в памяти: заявки не сохраняются между перезапусками")
+    else:
+        REGISTRY.add_collector(stats_collector("bot_db_pool", "Пул соединений БД", db.get_pool_stats))
+        REGISTRY.add_collector(stats_collector("bot_feedback_cache", "Кэш заявок", db.get_cache_stats))
+    if db.profiler is not None:
+        REGISTRY.add_collector(db.profiler.collect)
+    return db
+
+
+async def create_fsm_storage() -> BaseStorage:
+    """Хранилище состояний FSM по настройкам окружения (FSM_STORAGE)"""
+    if FSM_STORAGE == 'memory':
+        return MemoryFSMStorage()
+    if FSM_STORAGE != 'sqlite':
+        raise ValueError(f"Неизвестное хранилище FSM_STORAGE: {FSM_STORAGE} (доступны: sqlite, memory)")
+    fsm = SQLiteFSMStorage(
+        FSM_DATABASE_PATH,
+        max_size=FSM_CACHE_SIZE,
+        ttl=FSM_TTL_HOURS * 3600,
+        flush_interval=FSM_FLUSH_INTERVAL_MS / 1000
+    )
+    await fsm.open()
+    REGISTRY.add_collector(stats_collector("bot_fsm", "Состояния FSM", fsm.stats))
+    return fsm
+
+
+async def create_dispatcher(db: FeedbackStorage) -> Dispatcher:
+    """Диспетчер с роутерами и middleware хендлеров"""
+    dp = Dispatcher(storage=await create_fsm_storage())
     
-    # Инициализация базы данных
-    db = Database(DATABASE_PATH)
-    await db.init_db()
+    # Индекс похожих заявок для связывания дубликатов
+    dedup = None
+    if DEDUP_THRESHOLD > 0:
+        dedup = DuplicateDetector(db, threshold=DEDUP_THRESHOLD, window_days=DEDUP_WINDOW_DAYS)
+        await dedup.load()
+        REGISTRY.add_collector(stats_collector("bot_dedup", "Поиск дубликатов", dedup.stats))
     
     # Регистрация роутеров
     dp.include_router(main_router)
     dp.include_router(admin_router)
     
+    # Ограничение частоты запросов: лишние апдейты отбрасываются до обращения к БД
+    throttling = ThrottlingMiddleware(
+        THROTTLE_LIMITS, admin_ids=ADMIN_IDS, admin_multiplier=THROTTLE_ADMIN_MULTIPLIER
+    )
+    dp.message.middleware(throttling)
+    dp.callback_query.middleware(throttling)
+    REGISTRY.add_collector(stats_collector("bot_throttling", "Ограничение частоты", throttling.stats))
+    
     # Middleware для передачи базы данных в хендлеры
     @dp.message.middleware()
     @dp.callback_query.middleware()
     async def db_middleware(handler, event, data):
         data['db'] = db
+        data['dedup'] = dedup
         return await handler(event, data)
     
+    # Задержки хендлеров по роутеру, хендлеру и типу апдейта
+    metrics_middleware = MetricsMiddleware()
+    dp.message.middleware(metrics_middleware)
+    dp.callback_query.middleware(metrics_middleware)
+    
+    # В отладочном режиме задачи апдейтов называются по хендлерам
+    if ASYNCIO_DEBUG:
+        task_naming = TaskNamingMiddleware()
+        dp.message.middleware(task_naming)
+        dp.callback_query.middleware(task_naming)
+    
+    return dp
+
+
+def start_background(db: FeedbackStorage, bot: Bot) -> Tuple[OutboxWorker, Optional[Archiver]]:
+    """Фоновая доставка уведомлений из outbox и архивирование заявок"""
+    outbox_worker = OutboxWorker(db, bot)
+    outbox_worker.start()
+    REGISTRY.add_collector(stats_collector("bot_outbox", "Доставка уведомлений", outbox_worker.stats))
+    
+    # Перенос старых закрытых заявок в архив (только для файлов SQLite)
+    archiver = None
+    if ARCHIVE_AFTER_DAYS > 0 and isinstance(db, MaintenanceStorage):
+        archiver = Archiver(
+            db,
+            older_than_days=ARCHIVE_AFTER_DAYS,
+            interval=ARCHIVE_INTERVAL_HOURS * 3600,
+            compress=ARCHIVE_COMPRESS
+        )
+        archiver.start()
+        REGISTRY.add_collector(stats_collector("bot_archive", "Архивирование заявок", archiver.stats))
+    
+    return outbox_worker, archiver
+
+
+async def shutdown(bot: Bot, db: FeedbackStorage, watchdog: LoopWatchdog,
+                   dp: Optional[Dispatcher] = None):
+    await cancel_export_jobs()
+    if dp is not None:
+        # Несохраненные состояния FSM записываются до выхода
+        await dp.storage.close()
+    await db.close()
+    await bot.session.close()
+    await watchdog.stop()
+
+
+async def wait_for_signal():
+    """Ожидание SIGINT/SIGTERM"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+
+def used_update_types() -> list:
+    """Типы апдейтов роутеров для супервизора, который сам их не обрабатывает"""
+    dp = Dispatcher()
+    dp.include_router(main_router)
+    dp.include_router(admin_router)
+    return dp.resolve_used_update_types()
+
+
+async def main():
+    """Главная функция запуска бота"""
+    
+    if BOT_MODE not in ('polling', 'webhook'):
+        raise ValueError(f"Неизвестный режим BOT_MODE: {BOT_MODE} (доступны: polling, webhook)")
+    if BOT_MODE == 'webhook' and not WEBHOOK_URL:
+        raise ValueError("Для BOT_MODE=webhook необходимо указать WEBHOOK_URL")
+    if BOT_WORKERS > 1 and STORAGE_ENGINE == 'memory':
+        raise ValueError("BOT_WORKERS > 1 требует общего хранилища (STORAGE_ENGINE=sqlite или sharded)")
+    
+    watchdog = start_watchdog()
+    
+    # В многопроцессном режиме лимиты Telegram делят все процессы: в чат пишут
+    # и его рабочий процесс, и OutboxWorker супервизора
+    global_bucket = chat_buckets = None
+    if BOT_WORKERS > 1:
+        global_bucket = SharedTokenBucket(OUTBOUND_GLOBAL_RATE, OUTBOUND_GLOBAL_RATE, CONTEXT)
+        chat_buckets = SharedChatBuckets(OUTBOUND_CHAT_RATE, OUTBOUND_GROUP_RATE, context=CONTEXT)
+    
+    # Инициализация бота
+    bot = create_bot(global_bucket, chat_buckets=chat_buckets)
+    
+    # Инициализация хранилища
+    db = create_storage_from_config()
+    await db.init_db()
+    
+    # Хендлеры: в этом процессе или в рабочих процессах супервизора
+    supervisor = queue = dp = None
+    if BOT_WORKERS > 1:
+        supervisor = Supervisor(
+            BOT_WORKERS, global_bucket, chat_buckets,
+            queue_size=WEBHOOK_QUEUE_SIZE,
+            outbox_event=db.outbox_event
+        )
+        await supervisor.start()
+        REGISTRY.add_collector(stats_collector("bot_supervisor", "Рабочие процессы", supervisor.stats))
+        queue = supervisor.queue
+        allowed_updates = used_update_types()
+    else:
+        dp = await create_dispatcher(db)
+        if BOT_MODE == 'webhook':
+            queue = UpdateQueue(feed_dispatcher(dp, bot), partitions=WEBHOOK_WORKERS,
+                                queue_size=WEBHOOK_QUEUE_SIZE)
+        allowed_updates = dp.resolve_used_update_types()
+    
+    outbox_worker, archiver = start_background(db, bot)
+    
+    # Прием апдейтов вебхуком: очередь с ограниченной емкостью и пул обработчиков
+    webhook = None
+    if BOT_MODE == 'webhook':
+        webhook = WebhookServer(
+            queue, bot,
+            path=WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET or secrets.token_urlsafe(32)
+        )
+        REGISTRY.add_collector(stats_collector("bot_webhook", "Прием апдейтов вебхуком", webhook.stats))
+    
+    # Метрики Prometheus, включая текущее состояние пула, планировщика и outbox
+    metrics_runner = None
+    if METRICS_PORT:
+        metrics_runner = await start_metrics_server(port=METRICS_PORT)
+    
     logger.info("Бот запущен")
     
     try:
-        # Запуск бота
-        await dp.start_polling(bot)
+        if webhook is not None:
+            await webhook.start(WEBHOOK_HOST, WEBHOOK_PORT)
+            await bot.set_webhook(
+                f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+                secret_token=webhook.secret_token,
+                allowed_updates=allowed_updates
+            )
+            # Работаем до SIGINT/SIGTERM; вебхук не удаляем, чтобы Telegram
+            # накопил апдейты на время перезапуска
+            await wait_for_signal()
+            logger.info("Бот остановлен")
+        else:
+            # Вебхук от запуска в режиме webhook не дает получать апдейты через getUpdates
+            await bot.delete_webhook()
+            if supervisor is not None:
+                # Один поллер раздает апдейты рабочим процессам
+                poller = asyncio.create_task(poll_updates(bot, queue, allowed_updates))
+                await wait_for_signal()
+                poller.cancel()
+                await asyncio.gather(poller, return_exceptions=True)
+                logger.info("Бот остановлен")
+            else:
+                # Запуск бота
+                await dp.start_polling(bot)
     except KeyboardInterrupt:
         logger.info("Бот остановлен")
     finally:
-        await bot.session.close()
+        if webhook is not None:
+            # Сначала дообрабатываются принятые апдейты, затем закрывается все остальное
+            await webhook.stop()
+        if supervisor is not None:
+            await supervisor.stop()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        if archiver is not None:
+            await archiver.stop()
+        await outbox_worker.stop()
+        await shutdown(bot, db, watchdog, dp)
 
 if __name__ == "__main__":
     asyncio.run(main())
-
@@ -0,0 +1,338 @@
+"""
+Метрики бота в текстовом формате Prometheus.
+
+Счетчики и гистограммы собираются в процессе без внешних зависимостей:
+задержки хендлеров (MetricsMiddleware), время запросов к базе данных,
+число строк и ожидание соединения (Database), исходящие запросы к
+Telegram (OutboundMetrics). Состояние пула БД, планировщика исходящих и
+outbox снимается в момент запроса через зарегистрированные коллекторы.
+Все метрики отдает небольшой aiohttp-сервер на /metrics.
+"""
+
+import bisect
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+from aiohttp import web
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин по умолчанию (секунды)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Запросы к SQLite обычно укладываются в миллисекунды
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict) -> Tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: ожидаются метки {self.labelnames}, получены {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик"""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    """Гистограмма с фиксированными корзинами"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # ключ меток -> [счетчики корзин..., +Inf], сумма
+        self._values: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def count(self, **labels) -> int:
+        state = self._values.get(self._key(labels))
+        return sum(state[0]) if state else 0
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Набор метрик и коллекторов, отдаваемых на /metrics.
+
+    Коллектор — функция без аргументов, возвращающая записи
+    (name, type, help, [(labels_dict, value), ...]) для значений, которые
+    удобнее снимать в момент запроса (размеры очередей, состояние пула).
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], Iterable]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector: Callable[[], Iterable]):
+        self._collectors.append(collector)
+
+    def remove_collector(self, collector: Callable[[], Iterable]):
+        if collector in self._collectors:
+            self._collectors.remove(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+
+        for collector in list(self._collectors):
+            try:
+                families = list(collector())
+            except Exception:
+                logger.exception("Ошибка сбора метрик")
+                continue
+            for name, kind, documentation, samples in families:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    label_text = _format_labels(list(labels), list(labels.values()))
+                    lines.append(f"{name}{label_text} {_format_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HANDLER_LATENCY = REGISTRY.histogram(
+    "bot_handler_duration_seconds", "Время обработки апдейта хендлером",
+    ("router", "handler", "update_type")
+)
+HANDLER_ERRORS = REGISTRY.counter(
+    "bot_handler_errors_total", "Исключения в хендлерах",
+    ("router", "handler", "update_type")
+)
+DB_QUERY_LATENCY = REGISTRY.histogram(
+    "bot_db_query_duration_seconds", "Время выполнения методов Database",
+    ("method",), DB_BUCKETS
+)
+DB_QUERY_ERRORS = REGISTRY.counter(
+    "bot_db_query_errors_total", "Ошибки методов Database", ("method",)
+)
+DB_ROWS = REGISTRY.counter(
+    "bot_db_rows_total", "Строк возвращено методами Database", ("method",)
+)
+DB_CONNECTION_WAIT = REGISTRY.histogram(
+    "bot_db_connection_wait_seconds",
+    "Ожидание соединения: read — читатель из пула, write — очередь групповой записи",
+    ("kind",), DB_BUCKETS
+)
+LOOP_LAG = REGISTRY.histogram(
+    "bot_event_loop_lag_seconds", "Задержка событийного цикла",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+LOOP_STALLS = REGISTRY.counter(
+    "bot_event_loop_stalls_total", "Блокировки событийного цикла дольше порога"
+)
+THROTTLED = REGISTRY.counter(
+    "bot_throttled_total", "Апдейты, отброшенные ограничением частоты",
+    ("throttle_class", "update_type")
+)
+OUTBOUND_REQUESTS = REGISTRY.counter(
+    "bot_outbound_requests_total", "Запросы к Telegram Bot API", ("method", "result")
+)
+OUTBOUND_LATENCY = REGISTRY.histogram(
+    "bot_outbound_request_duration_seconds", "Время запроса к Telegram Bot API", ("method",)
+)
+
+WEBHOOK_REQUESTS = REGISTRY.counter(
+    "bot_webhook_requests_total", "Запросы к вебхуку по результату приема", ("result",)
+)
+UPDATE_QUEUE_LATENCY = REGISTRY.histogram(
+    "bot_update_queue_seconds",
+    "Апдейт в UpdateQueue от приема: queue — ожидание в очереди, total — до конца обработки",
+    ("stage",)
+)
+
+
+def count_rows(result) -> int:
+    """Число строк в результате метода Database"""
+    if result is None or isinstance(result, (bool, int, float, str)):
+        return 0
+    if isinstance(result, dict):
+        # Страница списка заявок
+        if isinstance(result.get('items'), list):
+            return len(result['items'])
+        return 1
+    if isinstance(result, (list, tuple)):
+        return len(result)
+    return 0
+
+
+def stats_collector(prefix: str, documentation: str, source: Callable[[], Dict]):
+    """Коллектор, отдающий числовые значения словаря stats() как gauge"""
+    def collect():
+        families = []
+        for key, value in source().items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            families.append((f"{prefix}_{key}", "gauge", f"{documentation}: {key}", [({}, value)]))
+        return families
+    return collect
+
+
+class MetricsMiddleware:
+    """Middleware диспетчера: гистограмма задержек по роутеру, хендлеру и типу апдейта"""
+
+    def __init__(self, latency: Histogram = HANDLER_LATENCY, errors: Counter = HANDLER_ERRORS):
+        self.latency = latency
+        self.errors = errors
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get('handler')
+        router = data.get('event_router')
+        update = data.get('event_update')
+        labels = {
+            'router': router.name if router is not None else "",
+            'handler': handler_object.callback.__name__ if handler_object is not None else "",
+            'update_type': update.event_type if update is not None else type(event).__name__,
+        }
+
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            self.errors.inc(**labels)
+            raise
+        finally:
+            self.latency.observe(time.perf_counter() - started, **labels)
+
+
+class OutboundMetrics(BaseRequestMiddleware):
+    """Middleware сессии бота: счетчики и время запросов к Telegram.
+
+    Регистрируется после RateGovernor, поэтому учитывает каждую попытку
+    отдельно и не включает ожидание в очереди планировщика.
+    """
+
+    def __init__(self, requests: Counter = OUTBOUND_REQUESTS, latency: Histogram = OUTBOUND_LATENCY):
+        self.requests = requests
+        self.latency = latency
+
+    async def __call__(self, make_request, bot: Bot, method):
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            result = await make_request(bot, method)
+        except TelegramRetryAfter:
+            self.requests.inc(method=name, result="retry_after")
+            raise
+        except Exception as e:
+            self.requests.inc(method=name, result=type(e).__name__)
+            raise
+        finally:
+            self.latency.observe(time.perf_counter() - started, method=name)
+
+        self.requests.inc(method=name, result="ok")
+        return result
+
+
+async def start_metrics_server(host: str = "0.0.0.0", port: int = 8000,
+                               registry: Registry = REGISTRY) -> web.AppRunner:
+    """Запуск HTTP-сервера с /metrics. Возвращает runner для остановки (cleanup)."""
+    async def handle_metrics(request):
+        return web.Response(body=registry.render().encode(), headers={'Content-Type': CONTENT_TYPE})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logger.info("Метрики доступны на http://%s:%s/metrics", host, port)
+    return runner
@@ -0,0 +1,426 @@
+"""
+Миграции схемы базы данных.
+
+Версия схемы хранится в PRAGMA user_version. Каждая миграция применяется
+в отдельной транзакции вместе с повышением версии, поэтому прерванный
+запуск не оставляет схему в промежуточном состоянии. Если версия файла
+совпадает с текущей, при запуске не выполняется ни одного DDL-оператора.
+
+Новые изменения схемы добавляются только в конец списка MIGRATIONS с
+очередным номером версии; уже выпущенные миграции не редактируются.
+"""
+
+import logging
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# statements: SQL-строки или async-функции, принимающие соединение писателя
+Migration = namedtuple('Migration', ['version', 'description', 'statements'])
+
+DEFAULT_CATEGORIES = [
+    ("Цех термопластавтоматов (ТПА)", "Вопросы по работе цеха ТПА"),
+    ("Цех литья алюминия", "Вопросы по работе цеха литья алюминия"),
+    ("Монтаж, упаковка, сборка светильников", "Вопросы по монтажу и сборке"),
+    ("Логистика и склад", "Вопросы по логистике и складским операциям"),
+    ("HR и кадры", "Вопросы по кадровой политике"),
+    ("Общие вопросы", "Общие вопросы по работе предприятия")
+]
+
+
+async def _seed_categories(db):
+    await db.executemany(
+        "INSERT OR IGNORE INTO categories (name, description) VALUES (?, ?)",
+        DEFAULT_CATEGORIES
+    )
+
+
+# Пересчет сводных счетчиков по таблице feedback
+COUNTERS_REBUILD = """
+    INSERT INTO feedback_counters (category, feedback_type, status, count)
+    SELECT category, feedback_type, COALESCE(status, ''), COUNT(*)
+    FROM feedback
+    GROUP BY category, feedback_type, COALESCE(status, '')
+"""
+
+# Пересчет счетчиков с учетом архива закрытых заявок (миграция 5)
+COUNTERS_REBUILD_WITH_ARCHIVE = """
+    INSERT INTO feedback_counters (category, feedback_type, status, count)
+    SELECT category, feedback_type, COALESCE(status, ''), COUNT(*)
+    FROM (
+        SELECT category, feedback_type, status FROM feedback
+        UNION ALL
+        SELECT category, feedback_type, status FROM feedback_archive
+    )
+    GROUP BY category, feedback_type, COALESCE(status, '')
+"""
+
+
+
+def _fts_text(column: str) -> str:
+    """Текст для индекса поиска: unicode61 не приравнивает «ё» к «е»"""
+    return f"replace(replace({column}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+# Удаление строки из индекса без хранимого текста (content='') требует
+# тех же значений, что были проиндексированы
+FTS_DELETE_OLD = f"""
+            INSERT INTO feedback_fts (feedback_fts, rowid, message, admin_response)
+            VALUES ('delete', OLD.id, {_fts_text('OLD.message')}, {_fts_text('OLD.admin_response')});"""
+FTS_INSERT_NEW = f"""
+            INSERT INTO feedback_fts (rowid, message, admin_response)
+            VALUES (NEW.id, {_fts_text('NEW.message')}, {_fts_text('NEW.admin_response')});"""
+
+
+MIGRATIONS = [
+    Migration(1, "Базовые таблицы и категории", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER UNIQUE NOT NULL,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            is_admin BOOLEAN DEFAULT FALSE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS feedback (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            category TEXT NOT NULL,
+            subcategory TEXT,
+            feedback_type TEXT NOT NULL,
+            message TEXT NOT NULL,
+            is_anonymous BOOLEAN DEFAULT FALSE,
+            status TEXT DEFAULT 'new',
+            admin_response TEXT,
+            admin_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS categories (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,
+            description TEXT,
+            is_active BOOLEAN DEFAULT TRUE
+        )
+        """,
+        _seed_categories,
+    ]),
+
+    Migration(2, "Индексы списков заявок и статистики", [
+        # Заявки пользователя ("Мои заявки")
+        """
+        CREATE INDEX IF NOT EXISTS idx_feedback_user_created
+        ON feedback (user_id, created_at DESC, id DESC)
+        """,
+        # Списки заявок в админ-панели
+        """
+        CREATE INDEX IF NOT EXISTS idx_feedback_status_created
+        ON feedback (status, created_at DESC, id DESC)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_feedback_category_created
+        ON feedback (category, created_at DESC, id DESC)
+        """,
+        # Покрывающий индекс для подсчетов по статусу и пересчета счетчиков
+        """
+        CREATE INDEX IF NOT EXISTS idx_feedback_breakdown
+        ON feedback (status, category, feedback_type)
+        """,
+    ]),
+
+    # Сводные счетчики заявок по (категория, тип, статус), которые триггеры
+    # поддерживают в точном соответствии с таблицей feedback
+    Migration(3, "Счетчики заявок на триггерах", [
+        """
+        CREATE TABLE IF NOT EXISTS feedback_counters (
+            category TEXT NOT NULL,
+            feedback_type TEXT NOT NULL,
+            status TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (category, feedback_type, status)
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_feedback_counters_insert
+        AFTER INSERT ON feedback
+        BEGIN
+            INSERT INTO feedback_counters (category, feedback_type, status, count)
+            VALUES (NEW.category, NEW.feedback_type, COALESCE(NEW.status, ''), 1)
+            ON CONFLICT (category, feedback_type, status) DO UPDATE SET count = count + 1;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_feedback_counters_update
+        AFTER UPDATE OF status, category, feedback_type ON feedback
+        WHEN OLD.status IS NOT NEW.status
+          OR OLD.category IS NOT NEW.category
+          OR OLD.feedback_type IS NOT NEW.feedback_type
+        BEGIN
+            UPDATE feedback_counters SET count = count - 1
+            WHERE category = OLD.category AND feedback_type = OLD.feedback_type
+              AND status = COALESCE(OLD.status, '');
+            INSERT INTO feedback_counters (category, feedback_type, status, count)
+            VALUES (NEW.category, NEW.feedback_type, COALESCE(NEW.status, ''), 1)
+            ON CONFLICT (category, feedback_type, status) DO UPDATE SET count = count + 1;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_feedback_counters_delete
+        AFTER DELETE ON feedback
+        BEGIN
+            UPDATE feedback_counters SET count = count - 1
+            WHERE category = OLD.category AND feedback_type = OLD.feedback_type
+              AND status = COALESCE(OLD.status, '');
+        END
+        """,
+        "DELETE FROM feedback_counters",
+        COUNTERS_REBUILD,
+    ]),
+
+    # Исходящие уведомления, записываемые в одной транзакции с заявкой
+    Migration(4, "Очередь исходящих уведомлений (outbox)", [
+        """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            parse_mode TEXT,
+            reply_markup TEXT,
+            feedback_id INTEGER,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL DEFAULT 0,
+            last_error TEXT,
+            message_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sent_at TIMESTAMP
+        )
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_outbox_pending
+        ON outbox (next_attempt_at) WHERE status = 'pending'
+        """,
+    ]),
+
+    # Архив старых закрытых заявок. message и admin_response объявлены без
+    # типа (BLOB): в них хранится либо текст, либо сжатый pack_text() BLOB.
+    # Триггеры архива учитывают его строки в счетчиках, поэтому перенос
+    # заявки в архив не меняет статистику.
+    Migration(5, "Архив закрытых заявок", [
+        """
+        CREATE TABLE IF NOT EXISTS feedback_archive (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            category TEXT NOT NULL,
+            subcategory TEXT,
+            feedback_type TEXT NOT NULL,
+            message BLOB NOT NULL,
+            is_anonymous BOOLEAN DEFAULT FALSE,
+            status TEXT,
+            admin_response BLOB,
+            admin_id INTEGER,
+            created_at TIMESTAMP,
+            updated_at TIMESTAMP,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_feedback_archive_counters_insert
+        AFTER INSERT ON feedback_archive
+        BEGIN
+            INSERT INTO feedback_counters (category, feedback_type, status, count)
+            VALUES (NEW.category, NEW.feedback_type, COALESCE(NEW.status, ''), 1)
+            ON CONFLICT (category, feedback_type, status) DO UPDATE SET count = count + 1;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_feedback_archive_counters_delete
+        AFTER DELETE ON feedback_archive
+        BEGIN
+            UPDATE feedback_counters SET count = count - 1
+            WHERE category = OLD.category AND feedback_type = OLD.feedback_type
+              AND status = COALESCE(OLD.status, '');
+        END
+        """,
+        # Отбор кандидатов в архив: закрытые заявки по времени закрытия
+        """
+        CREATE INDEX IF NOT EXISTS idx_feedback_status_updated
+        ON feedback (status, updated_at)
+        """,
+    ]),
+
+    # Связь почти одинаковых заявок. feedback_signatures хранит MinHash-
+    # сигнатуры открытых заявок-оригиналов (см. dedup.py); закрытие или
+    # удаление заявки убирает ее сигнатуру. reply_to_feedback_id в outbox
+    # отправляет уведомление ответом на уведомление об исходной заявке.
+    Migration(6, "Поиск дубликатов заявок", [
+        "ALTER TABLE feedback ADD COLUMN duplicate_of INTEGER",
+        "ALTER TABLE feedback_archive ADD COLUMN duplicate_of INTEGER",
+        "ALTER TABLE outbox ADD COLUMN reply_to_feedback_id INTEGER",
+        """
+        CREATE INDEX IF NOT EXISTS idx_feedback_duplicate_of
+        ON feedback (duplicate_of) WHERE duplicate_of IS NOT NULL
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_outbox_feedback
+        ON outbox (feedback_id, chat_id) WHERE feedback_id IS NOT NULL
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS feedback_signatures (
+            feedback_id INTEGER PRIMARY KEY,
+            category TEXT NOT NULL,
+            signature BLOB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_feedback_signatures_close
+        AFTER UPDATE OF status ON feedback
+        WHEN NEW.status = 'closed'
+        BEGIN
+            DELETE FROM feedback_signatures WHERE feedback_id = NEW.id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_feedback_signatures_delete
+        AFTER DELETE ON feedback
+        BEGIN
+            DELETE FROM feedback_signatures WHERE feedback_id = OLD.id;
+        END
+        """,
+    ]),
+
+    # Догрузка индекса дубликатов по времени записи сигнатуры
+    Migration(7, "Индекс сигнатур по времени", [
+        """
+        CREATE INDEX IF NOT EXISTS idx_feedback_signatures_created
+        ON feedback_signatures (created_at, feedback_id)
+        """,
+    ]),
+
+    # Полнотекстовый индекс текста заявок и ответов (см. search.py). Таблица
+    # хранит только индекс: строки читаются из feedback по rowid = id.
+    # Архивные заявки удаляются из feedback, а с ними и из индекса.
+    Migration(8, "Полнотекстовый поиск по заявкам", [
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS feedback_fts USING fts5(
+            message, admin_response,
+            content='', tokenize='unicode61 remove_diacritics 2'
+        )
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_feedback_fts_insert
+        AFTER INSERT ON feedback
+        BEGIN{FTS_INSERT_NEW}
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_feedback_fts_update
+        AFTER UPDATE OF message, admin_response ON feedback
+        WHEN OLD.message IS NOT NEW.message OR OLD.admin_response IS NOT NEW.admin_response
+        BEGIN{FTS_DELETE_OLD}{FTS_INSERT_NEW}
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_feedback_fts_delete
+        AFTER DELETE ON feedback
+        BEGIN{FTS_DELETE_OLD}
+        END
+        """,
+        f"""
+        INSERT INTO feedback_fts (rowid, message, admin_response)
+        SELECT id, {_fts_text('message')}, {_fts_text('admin_response')} FROM feedback
+        """,
+    ]),
+
+    # Список всех заявок без фильтров (в том числе страницы с курсором)
+    # читается по индексу, а не полным проходом с сортировкой
+    Migration(9, "Индекс заявок по времени создания", [
+        """
+        CREATE INDEX IF NOT EXISTS idx_feedback_created
+        ON feedback (created_at DESC, id DESC)
+        """,
+    ]),
+
+    # Архивные заявки остаются в "Моих заявках" и списках закрытых заявок
+    # админ-панели: страницы архива тоже читаются по индексам
+    Migration(10, "Индексы списков архива", [
+        """
+        CREATE INDEX IF NOT EXISTS idx_feedback_archive_user_created
+        ON feedback_archive (user_id, created_at DESC, id DESC)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_feedback_archive_status_created
+        ON feedback_archive (status, created_at DESC, id DESC)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_feedback_archive_category_created
+        ON feedback_archive (category, created_at DESC, id DESC)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_feedback_archive_created
+        ON feedback_archive (created_at DESC, id DESC)
+        """,
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1].version
+
+
+async def get_user_version(db) -> int:
+    async with db.execute("PRAGMA user_version") as cursor:
+        return (await cursor.fetchone())[0]
+
+
+async def migrate(pool) -> int:
+    """Применение недостающих миграций. Возвращает итоговую версию схемы."""
+    async with pool.reader() as db:
+        current = await get_user_version(db)
+
+    if current == SCHEMA_VERSION:
+        return current
+
+    if current > SCHEMA_VERSION:
+        logger.warning(
+            "Версия схемы БД (%s) новее поддерживаемой кодом (%s)",
+            current, SCHEMA_VERSION
+        )
+        return current
+
+    for migration in MIGRATIONS:
+        if migration.version <= current:
+            continue
+
+        async def apply(db, migration=migration):
+            # Версию перечитываем внутри транзакции записи: миграцию мог уже
+            # применить другой процесс
+            if migration.version <= await get_user_version(db):
+                return False
+
+            for statement in migration.statements:
+                if callable(statement):
+                    await statement(db)
+                else:
+                    await db.execute(statement)
+
+            await db.execute(f"PRAGMA user_version = {migration.version}")
+            return True
+
+        if await pool.write(apply):
+            logger.info("Применена миграция БД %s: %s", migration.version, migration.description)
+        current = migration.version
+
+    return current
@@ -0,0 +1,384 @@
+"""
+Исходящие запросы к Telegram Bot API.
+
+RateGovernor подключается как middleware сессии бота и через него проходят
+все отправки и редактирования сообщений, включая message.answer() и
+callback.message.edit_text() в хендлерах. Лимиты Telegram соблюдаются
+ведрами токенов: общее (~30 сообщений в секунду) и по каждому чату
+(~1 в секунду для личных чатов, ~20 в минуту для групп). Ответ
+TelegramRetryAfter не теряет сообщение: чат блокируется ровно на
+указанное время, после чего запрос повторяется.
+
+EditDeduplicator помнит хэш текста и клавиатуры последних сообщений бота
+и не отправляет редактирования, которые ничего не меняют: такие запросы
+тратят лимиты и завершаются ошибкой "message is not modified".
+
+В многопроцессном режиме (workers.py) общий лимит хранится в
+SharedTokenBucket, а ведра чатов — в SharedChatBuckets: в один чат пишут
+и рабочий процесс, обрабатывающий его апдейты, и OutboxWorker супервизора
+(уведомления администраторам и пользователям).
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import (
+    CopyMessage,
+    EditMessageCaption,
+    EditMessageReplyMarkup,
+    EditMessageText,
+    ForwardMessage,
+    SendDocument,
+    SendMessage,
+    SendPhoto,
+)
+from aiogram.types import InlineKeyboardMarkup, Message
+
+logger = logging.getLogger(__name__)
+
+# Методы, на которые распространяются лимиты Telegram
+THROTTLED_METHODS = (
+    SendMessage,
+    SendDocument,
+    SendPhoto,
+    CopyMessage,
+    ForwardMessage,
+    EditMessageText,
+    EditMessageCaption,
+    EditMessageReplyMarkup,
+)
+
+
+class OutboundQueueFull(Exception):
+    """Очередь исходящих сообщений переполнена, запрос отброшен"""
+
+
+class TokenBucket:
+    """Ведро токенов с резервированием: каждый запрос сразу получает
+    задержку до своей очереди, поэтому ожидающие обслуживаются по порядку."""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, now: float) -> float:
+        """Занять токен, вернуть время ожидания в секундах"""
+        self._refill(now)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def try_take(self, now: float) -> bool:
+        """Взять токен без ожидания; False, если ведро пусто"""
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def block(self, now: float, seconds: float):
+        """Не выдавать токены ближайшие seconds секунд (flood wait)"""
+        self._refill(now)
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+    @property
+    def is_full(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+class SharedTokenBucket:
+    """Ведро токенов в разделяемой памяти: общий лимит для нескольких процессов.
+
+    Состояние (токены и время пополнения) хранится в multiprocessing.Array
+    и меняется под его блокировкой; объект передается рабочим процессам
+    при запуске (workers.Supervisor). Интерфейс — как у TokenBucket.
+    """
+
+    def __init__(self, rate: float, capacity: float, context=multiprocessing,
+                 state=None, offset: int = 0):
+        self.rate = rate
+        self.capacity = capacity
+        # state/offset — ячейка общего массива SharedChatBuckets
+        if state is None:
+            state = context.Array('d', [capacity, time.monotonic()])
+        self._state = state
+        self._tokens = offset
+        self._updated = offset + 1
+
+    def _refill(self, now: float):
+        tokens, updated = self._state[self._tokens], self._state[self._updated]
+        # Время другого процесса могло быть взято чуть позже нашего
+        now = max(now, updated)
+        self._state[self._tokens] = min(self.capacity, tokens + (now - updated) * self.rate)
+        self._state[self._updated] = now
+
+    def reserve(self, now: float) -> float:
+        with self._state.get_lock():
+            self._refill(now)
+            self._state[self._tokens] -= 1
+            tokens = self._state[self._tokens]
+        return 0.0 if tokens >= 0 else -tokens / self.rate
+
+    def try_take(self, now: float) -> bool:
+        with self._state.get_lock():
+            self._refill(now)
+            if self._state[self._tokens] >= 1:
+                self._state[self._tokens] -= 1
+                return True
+            return False
+
+    def block(self, now: float, seconds: float):
+        with self._state.get_lock():
+            self._refill(now)
+            self._state[self._tokens] = min(self._state[self._tokens], 0) - seconds * self.rate
+
+    @property
+    def is_full(self) -> bool:
+        with self._state.get_lock():
+            self._refill(time.monotonic())
+            return self._state[self._tokens] >= self.capacity
+
+
+class SharedChatBuckets:
+    """Ведра чатов в разделяемой памяти для нескольких процессов.
+
+    Число ячеек фиксировано: чат попадает в ячейку по хэшу id, и редкие
+    чаты с общей ячейкой делят один лимит (отправка только замедляется,
+    лимит Telegram не превышается). Каждая ячейка — пара [токены, время
+    пополнения] общего multiprocessing.Array.
+    """
+
+    def __init__(self, chat_rate: float = 1, group_rate: float = 20 / 60,
+                 capacity: float = 3, slots: int = 4096, context=multiprocessing):
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.capacity = capacity
+        self.slots = slots
+        now = time.monotonic()
+        self._state = context.Array('d', [capacity, now] * slots)
+
+    def _slot(self, chat_id) -> int:
+        # hash() строк различается между процессами, crc32 — нет
+        if isinstance(chat_id, str):
+            return zlib.crc32(chat_id.encode()) % self.slots
+        return chat_id % self.slots
+
+    def bucket(self, chat_id) -> SharedTokenBucket:
+        """Ведро чата; интерфейс — как у TokenBucket"""
+        # Отрицательные id и @username — группы и каналы
+        is_group = isinstance(chat_id, str) or chat_id < 0
+        rate = self.group_rate if is_group else self.chat_rate
+        return SharedTokenBucket(rate, self.capacity, state=self._state,
+                                 offset=2 * self._slot(chat_id))
+
+
+class RateGovernor(BaseRequestMiddleware):
+    """Общий планировщик исходящих сообщений с учетом лимитов Telegram"""
+
+    def __init__(self, global_rate: float = 30, chat_rate: float = 1,
+                 group_rate: float = 20 / 60, chat_burst: float = 3,
+                 max_retries: int = 3, max_queue: int = 1000,
+                 max_chats: int = 10000, global_bucket: SharedTokenBucket = None,
+                 chat_buckets: SharedChatBuckets = None):
+        # global_bucket и chat_buckets — общие ведра процессов workers.Supervisor
+        self.global_bucket = global_bucket or TokenBucket(global_rate, global_rate)
+        self.chat_buckets = chat_buckets
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_queue = max_queue
+        self.max_chats = max_chats
+        self._chats: "OrderedDict[int, TokenBucket]" = OrderedDict()
+        self.queue_depth = 0
+        self._stats = {
+            'sent': 0,
+            'failed': 0,
+            'retries': 0,
+            'flood_waits': 0,
+            'dropped': 0,
+            'wait_time': 0.0,
+        }
+
+    def _chat_bucket(self, chat_id) -> Optional[TokenBucket]:
+        if chat_id is None:
+            return None
+        if self.chat_buckets is not None:
+            return self.chat_buckets.bucket(chat_id)
+
+        bucket = self._chats.get(chat_id)
+        if bucket is not None:
+            self._chats.move_to_end(chat_id)
+            return bucket
+
+        # Отрицательные id и @username — группы и каналы
+        is_group = isinstance(chat_id, str) or chat_id < 0
+        if is_group:
+            bucket = TokenBucket(self.group_rate, self.chat_burst)
+        else:
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+        self._chats[chat_id] = bucket
+
+        # Вытесняем давно неактивные чаты, ведра которых уже полные
+        while len(self._chats) > self.max_chats:
+            oldest_id, oldest = next(iter(self._chats.items()))
+            if not oldest.is_full:
+                break
+            del self._chats[oldest_id]
+
+        return bucket
+
+    async def _wait_turn(self, chat_id):
+        if self.queue_depth >= self.max_queue:
+            self._stats['dropped'] += 1
+            raise OutboundQueueFull(f"Очередь исходящих сообщений переполнена ({self.queue_depth})")
+
+        now = time.monotonic()
+        delay = self.global_bucket.reserve(now)
+        chat_bucket = self._chat_bucket(chat_id)
+        if chat_bucket is not None:
+            delay = max(delay, chat_bucket.reserve(now))
+
+        if delay > 0:
+            self.queue_depth += 1
+            try:
+                await asyncio.sleep(delay)
+            finally:
+                self.queue_depth -= 1
+            self._stats['wait_time'] += delay
+
+    async def __call__(self, make_request, bot: Bot, method):
+        if not isinstance(method, THROTTLED_METHODS):
+            return await make_request(bot, method)
+
+        chat_id = getattr(method, 'chat_id', None)
+        attempt = 0
+
+        while True:
+            await self._wait_turn(chat_id)
+            try:
+                result = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self._stats['flood_waits'] += 1
+                if attempt >= self.max_retries:
+                    self._stats['dropped'] += 1
+                    raise
+
+                attempt += 1
+                self._stats['retries'] += 1
+                logger.warning(
+                    "Flood wait %s с для чата %s (%s), повтор %s/%s",
+                    e.retry_after, chat_id, type(method).__name__, attempt, self.max_retries
+                )
+
+                now = time.monotonic()
+                chat_bucket = self._chat_bucket(chat_id)
+                (chat_bucket or self.global_bucket).block(now, e.retry_after)
+                continue
+            except Exception:
+                self._stats['failed'] += 1
+                raise
+
+            self._stats['sent'] += 1
+            return result
+
+    def stats(self) -> Dict:
+        """Счетчики исходящих запросов"""
+        stats = dict(self._stats)
+        stats['queue_depth'] = self.queue_depth
+        stats['tracked_chats'] = len(self._chats)
+        return stats
+
+
+def _markup_hash(markup) -> Optional[int]:
+    # Обычная клавиатура (ReplyKeyboardMarkup) не редактируется, для
+    # edit-методов у такого сообщения inline-клавиатуры нет
+    if not isinstance(markup, InlineKeyboardMarkup):
+        return None
+    return hash(markup.model_dump_json(exclude_none=True))
+
+
+def _text_hash(method) -> int:
+    entities = tuple(entity.model_dump_json(exclude_none=True) for entity in method.entities or ())
+    return hash((method.text, str(method.parse_mode), entities))
+
+
+class EditDeduplicator(BaseRequestMiddleware):
+    """Пропуск редактирований, не меняющих сообщение.
+
+    Для последних max_messages сообщений (LRU по (chat_id, message_id))
+    хранится хэш текста и inline-клавиатуры — по отправленным сообщениям и
+    успешным редактированиям. EditMessageText и EditMessageReplyMarkup с
+    тем же содержимым не отправляются и сразу возвращают True. Регистрируется
+    перед RateGovernor, чтобы пропущенные запросы не занимали лимиты.
+    """
+
+    def __init__(self, max_messages: int = 10000):
+        self.max_messages = max_messages
+        # (chat_id, message_id) -> (хэш текста, хэш клавиатуры)
+        self._messages: "OrderedDict[Tuple, Tuple[Optional[int], Optional[int]]]" = OrderedDict()
+        self._stats = {'skipped': 0, 'passed': 0}
+
+    def _remember(self, key: Tuple, text_hash: Optional[int], markup_hash: Optional[int]):
+        self._messages[key] = (text_hash, markup_hash)
+        self._messages.move_to_end(key)
+        while len(self._messages) > self.max_messages:
+            self._messages.popitem(last=False)
+
+    async def __call__(self, make_request, bot: Bot, method):
+        if isinstance(method, SendMessage):
+            result = await make_request(bot, method)
+            if isinstance(result, Message):
+                self._remember((result.chat.id, result.message_id),
+                               _text_hash(method), _markup_hash(method.reply_markup))
+            return result
+
+        if not isinstance(method, (EditMessageText, EditMessageReplyMarkup)) or method.message_id is None:
+            return await make_request(bot, method)
+
+        key = (method.chat_id, method.message_id)
+        current = self._messages.get(key)
+        markup_hash = _markup_hash(method.reply_markup)
+        if isinstance(method, EditMessageText):
+            # Без reply_markup Telegram убирает клавиатуру
+            new = (_text_hash(method), markup_hash)
+        else:
+            new = (current[0] if current else None, markup_hash)
+
+        if current is not None and current == new:
+            self._messages.move_to_end(key)
+            self._stats['skipped'] += 1
+            return True
+
+        self._stats['passed'] += 1
+        try:
+            result = await make_request(bot, method)
+        except Exception:
+            # Состояние сообщения неизвестно (удалено, изменено иначе)
+            self._messages.pop(key, None)
+            raise
+        self._remember(key, *new)
+        return result
+
+    def stats(self) -> Dict:
+        """Число пропущенных и отправленных редактирований"""
+        stats = dict(self._stats)
+        stats['tracked_messages'] = len(self._messages)
+        return stats
+
@@ -0,0 +1,187 @@
+"""
+Доставка уведомлений из таблицы outbox.
+
+Хендлеры не отправляют уведомления сами: они записывают их в outbox в той
+же транзакции, что и изменение заявки, и сразу отвечают пользователю.
+OutboxWorker выбирает готовые записи пачками, отправляет их параллельно
+(темп задает RateGovernor), повторяет неудачные попытки с экспоненциальной
+задержкой и переводит безнадежные в статус 'dead'. Перезапуск бота не
+теряет уведомления: недоставленные записи остаются в таблице.
+
+Выбранная пачка арендуется на lease секунд, и пока ее отправка не
+закончилась, ее аренда продлевается: ожидание лимитов
+Telegram может растянуть отправку пачки дольше аренды, и без продления
+записи были бы выбраны повторно и отправлены дважды.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from aiogram.types import InlineKeyboardMarkup
+
+from storage import FeedbackStorage
+
+logger = logging.getLogger(__name__)
+
+
+def outbox_message(chat_id: int, text: str, reply_markup: InlineKeyboardMarkup = None,
+                   parse_mode: Optional[str] = "HTML", reply_to_feedback_id: int = None) -> Dict:
+    """Уведомление для записи в outbox.
+
+    reply_to_feedback_id — отправить ответом на уведомление о другой заявке
+    в том же чате (ветка уведомлений о дубликатах).
+    """
+    return {
+        'chat_id': chat_id,
+        'text': text,
+        'parse_mode': parse_mode,
+        'reply_markup': reply_markup.model_dump_json(exclude_none=True) if reply_markup else None,
+        'reply_to_feedback_id': reply_to_feedback_id
+    }
+
+
+class OutboxWorker:
+    """Фоновая доставка уведомлений из outbox"""
+
+    def __init__(self, db: FeedbackStorage, bot: Bot, batch_size: int = 50,
+                 max_attempts: int = 8, base_delay: float = 5,
+                 max_delay: float = 3600, poll_interval: float = 5, lease: float = 60):
+        self.db = db
+        self.bot = bot
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self._task: Optional[asyncio.Task] = None
+        self._last_purge = 0.0
+        self._stats = {'delivered': 0, 'retried': 0, 'dead': 0, 'batches': 0, 'lease_renewals': 0}
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="outbox-worker")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            # Сбрасываем сигнал до выборки, чтобы не пропустить новые записи
+            self.db.outbox_event.clear()
+            try:
+                delivered = await self.process_batch()
+                await self._purge_sent()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Ошибка обработки outbox")
+                delivered = 0
+
+            # Полная пачка — сразу берем следующую, иначе ждем новых записей
+            if delivered < self.batch_size:
+                try:
+                    await asyncio.wait_for(self.db.outbox_event.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def process_batch(self) -> int:
+        """Отправка одной пачки уведомлений. Возвращает размер пачки."""
+        batch = await self.db.claim_outbox(self.batch_size, self.lease)
+        if not batch:
+            return 0
+
+        self._stats['batches'] += 1
+        # Отправленные записи отмечаются после всей пачки, поэтому продлевается вся пачка
+        renewer = asyncio.create_task(
+            self._renew_lease([row['id'] for row in batch]), name="outbox-lease"
+        )
+        try:
+            results = await asyncio.gather(
+                *(self._send(row) for row in batch), return_exceptions=True
+            )
+        finally:
+            renewer.cancel()
+            await asyncio.gather(renewer, return_exceptions=True)
+
+        delivered = []
+        for row, result in zip(batch, results):
+            if isinstance(result, BaseException):
+                await self._handle_failure(row, result)
+            else:
+                delivered.append((row['id'], result))
+
+        if delivered:
+            await self.db.mark_outbox_sent(delivered)
+            self._stats['delivered'] += len(delivered)
+
+        return len(batch)
+
+    async def _renew_lease(self, outbox_ids: List[int]):
+        """Продление аренды пачки, пока идет ее отправка"""
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                await self.db.extend_outbox_lease(outbox_ids, self.lease)
+                self._stats['lease_renewals'] += 1
+            except Exception:
+                # Следующая попытка — до истечения аренды
+                logger.exception("Ошибка продления аренды outbox")
+
+    async def _send(self, row: Dict) -> int:
+        reply_markup = None
+        if row['reply_markup']:
+            reply_markup = InlineKeyboardMarkup.model_validate_json(row['reply_markup'])
+
+        message = await self.bot.send_message(
+            row['chat_id'],
+            row['text'],
+            parse_mode=row['parse_mode'],
+            reply_markup=reply_markup,
+            reply_to_message_id=row.get('reply_to_message_id'),
+            allow_sending_without_reply=True if row.get('reply_to_message_id') else None
+        )
+        return message.message_id
+
+    async def _handle_failure(self, row: Dict, error: BaseException):
+        attempts = row['attempts'] + 1
+        # Бот заблокирован или чат не существует — повтор не поможет
+        permanent = isinstance(error, (TelegramForbiddenError, TelegramBadRequest))
+
+        if permanent or attempts >= self.max_attempts:
+            await self.db.mark_outbox_failed(row['id'], str(error))
+            self._stats['dead'] += 1
+            logger.error(
+                "Уведомление %s в чат %s не доставлено после %s попыток: %s",
+                row['id'], row['chat_id'], attempts, error
+            )
+            return
+
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        await self.db.mark_outbox_failed(row['id'], str(error), retry_at=time.time() + delay)
+        self._stats['retried'] += 1
+        logger.warning(
+            "Ошибка отправки уведомления %s в чат %s, повтор через %s с: %s",
+            row['id'], row['chat_id'], delay, error
+        )
+
+    async def _purge_sent(self):
+        # Раз в час удаляем давно доставленные уведомления
+        if time.monotonic() - self._last_purge < 3600:
+            return
+        self._last_purge = time.monotonic()
+        await self.db.purge_outbox()
+
+    def stats(self) -> Dict:
+        """Счетчики доставки"""
+        return dict(self._stats)
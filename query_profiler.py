@@ -0,0 +1,205 @@
+"""
+Профилирование SQL-запросов (включается настройкой DB_PROFILE_QUERIES).
+
+ConnectionPool выдает вместо соединения обертку, которая замеряет каждый
+execute/executemany и накапливает статистику по форме запроса (SQL без
+лишних пробелов и литералов): число вызовов, суммарное и максимальное
+время. План EXPLAIN QUERY PLAN снимается один раз для каждой формы; полный
+проход по таблице (SCAN без индекса) учитывается при каждом вызове.
+Запросы медленнее порога пишутся в лог вместе с параметрами и планом.
+"""
+
+import logging
+import re
+import time
+from typing import Dict, List, Optional, Sequence
+
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+# Запросы, для которых имеет смысл EXPLAIN QUERY PLAN
+_EXPLAINABLE = ("SELECT", "WITH", "UPDATE", "DELETE", "INSERT", "REPLACE")
+
+_WHITESPACE = re.compile(r"\s+")
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+# SCAN без индекса: "SCAN feedback", но не "SCAN feedback USING INDEX ..."
+_TABLE_SCAN = re.compile(r"^SCAN (\w+)$")
+
+
+def statement_shape(sql: str) -> str:
+    """Форма запроса: SQL в одну строку, литералы заменены на ?"""
+    return _LITERALS.sub("?", _WHITESPACE.sub(" ", sql).strip())
+
+
+def _short(value, limit: int = 100):
+    if isinstance(value, str) and len(value) > limit:
+        return value[:limit] + "…"
+    return value
+
+
+class StatementStats:
+    """Накопленная статистика одной формы запроса"""
+
+    __slots__ = ('shape', 'calls', 'total_time', 'max_time', 'slow', 'full_scans', 'plan', 'scanned')
+
+    def __init__(self, shape: str):
+        self.shape = shape
+        self.calls = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.slow = 0
+        self.full_scans = 0
+        self.plan: Optional[List[str]] = None
+        self.scanned: List[str] = []
+
+    def as_dict(self) -> Dict:
+        return {
+            'shape': self.shape,
+            'calls': self.calls,
+            'total_time': self.total_time,
+            'avg_time': self.total_time / self.calls if self.calls else 0.0,
+            'max_time': self.max_time,
+            'slow': self.slow,
+            'full_scans': self.full_scans,
+            'scanned_tables': list(self.scanned),
+            'plan': list(self.plan or []),
+        }
+
+
+class QueryProfiler:
+    """Статистика по формам запросов и журнал медленных запросов"""
+
+    def __init__(self, slow_threshold: float = 0.1, max_shapes: int = 500):
+        self.slow_threshold = slow_threshold
+        self.max_shapes = max_shapes
+        self._statements: Dict[str, StatementStats] = {}
+
+    def wrap(self, conn: aiosqlite.Connection) -> "ProfiledConnection":
+        return ProfiledConnection(conn, self)
+
+    async def _explain(self, conn: aiosqlite.Connection, sql: str, params) -> List[str]:
+        try:
+            async with conn.execute(f"EXPLAIN QUERY PLAN {sql}", params or ()) as cursor:
+                return [row[3] for row in await cursor.fetchall()]
+        except Exception as e:
+            return [f"EXPLAIN не выполнен: {e}"]
+
+    async def record(self, conn: aiosqlite.Connection, sql: str, params, elapsed: float):
+        shape = statement_shape(sql)
+        stats = self._statements.get(shape)
+        if stats is None:
+            if len(self._statements) >= self.max_shapes:
+                # Формы запросов строятся из фиксированных шаблонов, переполнение
+                # означает литералы в SQL — такие запросы не агрегируем
+                return
+            stats = self._statements[shape] = StatementStats(shape)
+
+        if stats.plan is None:
+            if shape.upper().startswith(_EXPLAINABLE):
+                stats.plan = await self._explain(conn, sql, params)
+            else:
+                stats.plan = []
+            stats.scanned = [m.group(1) for m in map(_TABLE_SCAN.match, stats.plan) if m]
+            if stats.scanned:
+                logger.warning(
+                    "Полный проход по таблице %s: %s", ", ".join(stats.scanned), shape
+                )
+
+        stats.calls += 1
+        stats.total_time += elapsed
+        stats.max_time = max(stats.max_time, elapsed)
+        if stats.scanned:
+            stats.full_scans += 1
+
+        if elapsed >= self.slow_threshold:
+            stats.slow += 1
+            if isinstance(params, dict):
+                shown = {key: _short(value) for key, value in params.items()}
+            else:
+                shown = [_short(value) for value in params or ()]
+            logger.warning(
+                "Медленный запрос %.1f мс: %s; параметры: %r; план: %s",
+                elapsed * 1000, shape, shown, " | ".join(stats.plan) or "-"
+            )
+
+    def stats(self, order_by: str = 'total_time', limit: int = None) -> List[Dict]:
+        """Статистика по формам запросов, по убыванию order_by"""
+        rows = sorted(
+            (stats.as_dict() for stats in self._statements.values()),
+            key=lambda row: row[order_by], reverse=True
+        )
+        return rows[:limit] if limit else rows
+
+    def reset(self):
+        self._statements.clear()
+
+    def collect(self):
+        """Коллектор для metrics.Registry"""
+        statements = list(self._statements.values())
+        return [
+            ("bot_db_statement_calls", "gauge", "Вызовы запроса по форме",
+             [({'statement': s.shape[:200]}, s.calls) for s in statements]),
+            ("bot_db_statement_seconds", "gauge", "Суммарное время запроса по форме",
+             [({'statement': s.shape[:200]}, s.total_time) for s in statements]),
+            ("bot_db_statement_max_seconds", "gauge", "Максимальное время запроса по форме",
+             [({'statement': s.shape[:200]}, s.max_time) for s in statements]),
+            ("bot_db_statement_full_scans", "gauge", "Вызовы с полным проходом по таблице",
+             [({'statement': s.shape[:200]}, s.full_scans) for s in statements if s.scanned]),
+        ]
+
+
+class _ProfiledExecute:
+    """Результат execute: поддерживает и await, и async with, как в aiosqlite"""
+
+    def __init__(self, conn: aiosqlite.Connection, profiler: QueryProfiler, sql: str, params):
+        self._conn = conn
+        self._profiler = profiler
+        self._sql = sql
+        self._params = params
+        self._cursor = None
+        self._started = 0.0
+
+    def __await__(self):
+        return self._execute().__await__()
+
+    async def _execute(self):
+        started = time.perf_counter()
+        cursor = await self._conn.execute(self._sql, self._params)
+        await self._profiler.record(self._conn, self._sql, self._params, time.perf_counter() - started)
+        return cursor
+
+    async def __aenter__(self):
+        self._started = time.perf_counter()
+        self._cursor = await self._conn.execute(self._sql, self._params)
+        return self._cursor
+
+    async def __aexit__(self, exc_type, exc, tb):
+        # Время до закрытия курсора включает чтение строк
+        await self._cursor.close()
+        await self._profiler.record(
+            self._conn, self._sql, self._params, time.perf_counter() - self._started
+        )
+
+
+class ProfiledConnection:
+    """Обертка соединения aiosqlite с замером запросов"""
+
+    def __init__(self, conn: aiosqlite.Connection, profiler: QueryProfiler):
+        self._conn = conn
+        self._profiler = profiler
+
+    def execute(self, sql: str, parameters: Sequence = None) -> _ProfiledExecute:
+        return _ProfiledExecute(self._conn, self._profiler, sql, parameters)
+
+    async def executemany(self, sql: str, parameters):
+        parameters = list(parameters)
+        started = time.perf_counter()
+        cursor = await self._conn.executemany(sql, parameters)
+        await self._profiler.record(
+            self._conn, sql, parameters[0] if parameters else None, time.perf_counter() - started
+        )
+        return cursor
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
@@ -0,0 +1,135 @@
+"""
+Полнотекстовый поиск заявок.
+
+Текст заявки и ответ администратора индексируются в FTS5-таблице
+feedback_fts (миграция 8) токенизатором unicode61: регистр кириллицы не
+различается, «ё» приводится к «е» при индексации и в запросе. Стеммера для
+русского языка в FTS5 нет, поэтому слова запроса обрезаются до основы
+(отбрасываются частые окончания) и ищутся по префиксу: «конвейера» находит
+«конвейер», «конвейеры» и «конвейерная».
+
+Запрос — слова и фильтры key=value, как у /export:
+"конвейер шум status=new category=tpa from=2024-05-01 to=2024-05-31".
+Заявка должна содержать все слова; результаты упорядочены по bm25 (текст
+заявки весит больше ответа) и листаются курсором (оценка, id).
+"""
+
+import html
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+WORD = re.compile(r"\w+")
+
+# Окончания, отбрасываемые от слов запроса (длинные проверяются первыми)
+ENDINGS = tuple(sorted((
+    "ами", "ями", "ого", "его", "ому", "ему", "ыми", "ими", "ых", "их", "ая", "яя",
+    "ое", "ее", "ой", "ей", "ий", "ый", "ую", "юю", "ом", "ем", "ах", "ях", "ов", "ев",
+    "ам", "ям", "а", "я", "ы", "и", "у", "ю", "е", "о", "ь",
+), key=len, reverse=True))
+# Основа короче не обрезается: слишком общий префикс совпадает с массой слов
+MIN_STEM = 4
+MAX_TERMS = 8
+
+# Веса колонок message и admin_response в bm25
+BM25_WEIGHTS = (1.0, 0.5)
+
+
+def normalize(text: str) -> str:
+    return text.lower().replace("ё", "е")
+
+
+def stem(word: str) -> str:
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def search_terms(text: str) -> List[str]:
+    """Основы слов запроса без повторов (не больше MAX_TERMS)"""
+    terms = []
+    for word in WORD.findall(normalize(text)):
+        term = stem(word)
+        if term not in terms:
+            terms.append(term)
+    return terms[:MAX_TERMS]
+
+
+def fts_query(terms: Iterable[str]) -> str:
+    """Выражение MATCH: все основы, каждая по префиксу"""
+    # Основы состоят только из символов \w, кавычки в них не встречаются
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+def encode_search_cursor(score: float, feedback_id: int) -> str:
+    # repr восстанавливает float без потерь: сравнение с курсором точное
+    return f"{score!r}_{feedback_id}"
+
+
+def decode_search_cursor(cursor: str) -> Tuple[float, int]:
+    score, feedback_id = cursor.rsplit("_", 1)
+    return float(score), int(feedback_id)
+
+
+def search_page(rows: List[Dict], limit: int, cursor: Optional[str], direction: str,
+                has_more: bool) -> Dict:
+    """Страница результатов из rows, упорядоченных по (score, id)"""
+    if direction == 'prev' and cursor:
+        items = rows[-limit:]
+        has_better, has_worse = has_more, True
+    else:
+        items = rows[:limit]
+        has_better, has_worse = cursor is not None, has_more
+
+    return {
+        'items': items,
+        'prev_cursor': encode_search_cursor(items[0]['score'], items[0]['id'])
+                       if items and has_better else None,
+        'next_cursor': encode_search_cursor(items[-1]['score'], items[-1]['id'])
+                       if items and has_worse else None
+    }
+
+
+def _matching(word: str, terms: List[str]) -> bool:
+    return any(word.startswith(term) for term in terms)
+
+
+def match_score(row: Dict, terms: List[str]) -> Optional[float]:
+    """Оценка заявки без FTS5 (хранилище в памяти): меньше — лучше, None — не найдена"""
+    words = {
+        column: WORD.findall(normalize(row.get(column) or ""))
+        for column in ('message', 'admin_response')
+    }
+    if not all(any(_matching(word, [term]) for column in words.values() for word in column)
+               for term in terms):
+        return None
+    hits = 0.0
+    for weight, column in zip(BM25_WEIGHTS, ('message', 'admin_response')):
+        column_words = words[column]
+        if column_words:
+            hits += weight * sum(_matching(word, terms) for word in column_words) / len(column_words)
+    return -hits
+
+
+def snippet(text: str, terms: List[str], width: int = 120) -> str:
+    """Фрагмент текста вокруг первого совпадения, HTML с выделенными словами"""
+    text = text or ""
+    matches = [match for match in WORD.finditer(text) if _matching(normalize(match.group()), terms)]
+    start = 0
+    if matches and matches[0].start() > width // 3:
+        start = matches[0].start() - width // 3
+    end = min(len(text), start + width)
+
+    parts = ["…" if start else ""]
+    position = start
+    for match in matches:
+        if match.start() < start:
+            continue
+        if match.end() > end:
+            break
+        parts.append(html.escape(text[position:match.start()]))
+        parts.append(f"<b>{html.escape(match.group())}</b>")
+        position = match.end()
+    parts.append(html.escape(text[position:end]))
+    parts.append("…" if end < len(text) else "")
+    return "".join(parts)
@@ -0,0 +1,877 @@
+"""
+Хранилища заявок.
+
+Хендлеры работают с хранилищем через протокол FeedbackStorage: пользователи,
+заявки (создание, чтение, смена статуса), списки с курсорами, статистика и
+категории. Реализации:
+
+* database.Database — один файл SQLite (по умолчанию);
+* ShardedStorage — несколько файлов SQLite, заявки распределяются по
+  категории или году, поэтому записи идут через несколько писателей;
+* MemoryStorage — индексированное хранилище в памяти для тестов и
+  бенчмарков, без файлов и потоков aiosqlite.
+
+Обслуживание файлов (архив, VACUUM, статистика пула и кэша) описывает
+отдельный протокол MaintenanceStorage: его реализуют движки SQLite, а
+вызывающий код проверяет его через isinstance.
+
+Движок выбирается настройкой STORAGE_ENGINE (create_storage).
+"""
+
+import asyncio
+import bisect
+import os
+import sqlite3
+import time
+import zlib
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import (
+    AsyncIterator, Callable, Dict, List, Optional, Protocol, Sequence, Tuple, runtime_checkable
+)
+
+from database import (
+    FEEDBACK_COLUMNS, Database, FeedbackSummary, build_breakdown, decode_cursor, encode_cursor,
+    summarize
+)
+from migrations import DEFAULT_CATEGORIES
+from query_profiler import QueryProfiler
+from search import decode_search_cursor, match_score, search_page
+
+STORAGE_ENGINES = ('sqlite', 'sharded', 'memory')
+
+
+@runtime_checkable
+class FeedbackStorage(Protocol):
+    """Операции с заявками, которые используют хендлеры и фоновые задачи"""
+
+    outbox_event: asyncio.Event
+    # Профилировщик SQL или None, если профилирование выключено или неприменимо
+    profiler: Optional[QueryProfiler]
+
+    async def init_db(self): ...
+
+    async def close(self): ...
+
+    async def add_user(self, user_id: int, username: str = None,
+                       first_name: str = None, last_name: str = None): ...
+
+    async def set_admin(self, user_id: int, is_admin: bool = True): ...
+
+    async def is_admin(self, user_id: int) -> bool: ...
+
+    async def add_feedback(self, user_id: int, username: str, first_name: str,
+                           last_name: str, category: str, feedback_type: str,
+                           message: str, is_anonymous: bool = False,
+                           subcategory: str = None,
+                           notifications: Callable[[int, Optional[int]], List[Dict]] = None,
+                           signature: bytes = None,
+                           duplicate_candidates: Sequence[int] = ()) -> int: ...
+
+    async def get_feedback_by_id(self, feedback_id: int) -> Optional[Dict]: ...
+
+    async def update_feedback_status(self, feedback_id: int, status: str,
+                                     admin_id: int = None, admin_response: str = None,
+                                     notifications: Callable[[int], List[Dict]] = None
+                                     ) -> Optional[Dict]: ...
+
+    # Списки и страницы (items) состоят из FeedbackSummary, а не полных строк
+    async def get_feedback_list(self, status: str = None, category: str = None,
+                                limit: int = 50) -> List[FeedbackSummary]: ...
+
+    async def get_feedback_page(self, status: str = None, category: str = None,
+                                cursor: str = None, direction: str = 'next',
+                                limit: int = 5) -> Dict: ...
+
+    async def get_feedback_by_user(self, user_id: int, cursor: str = None,
+                                   limit: int = 10, direction: str = 'next') -> Dict: ...
+
+    async def count_feedback_by_user(self, user_id: int) -> int: ...
+
+    async def count_feedback(self, status: str = None, category: str = None,
+                             feedback_type: str = None, date_from: str = None,
+                             date_to: str = None, include_archive: bool = False) -> int: ...
+
+    def iter_feedback(self, status: str = None, category: str = None,
+                      feedback_type: str = None, date_from: str = None,
+                      date_to: str = None, chunk_size: int = 1000,
+                      include_archive: bool = True) -> AsyncIterator[List[Dict]]: ...
+
+    async def search_feedback(self, terms: List[str], status: str = None, category: str = None,
+                              feedback_type: str = None, date_from: str = None,
+                              date_to: str = None, cursor: str = None,
+                              direction: str = 'next', limit: int = 5) -> Dict: ...
+
+    async def count_search(self, terms: List[str], status: str = None, category: str = None,
+                           feedback_type: str = None, date_from: str = None,
+                           date_to: str = None) -> int: ...
+
+    async def get_categories(self) -> List[Dict]: ...
+
+    async def get_stats(self) -> Dict: ...
+
+    async def get_breakdown(self) -> Dict: ...
+
+    async def rebuild_counters(self) -> Dict: ...
+
+    async def get_unsigned_feedback(self, since: str) -> List[Dict]: ...
+
+    async def save_signatures(self, signatures: List[Tuple[int, str, bytes]]): ...
+
+    async def get_signatures(self, since: str = None) -> List[Dict]: ...
+
+    async def claim_outbox(self, limit: int = 50, lease: float = 60) -> List[Dict]: ...
+
+    async def extend_outbox_lease(self, outbox_ids: List[int], lease: float = 60): ...
+
+    async def mark_outbox_sent(self, delivered: List[Tuple[int, Optional[int]]]): ...
+
+    async def mark_outbox_failed(self, outbox_id: int, error: str, retry_at: float = None): ...
+
+    async def purge_outbox(self, older_than_days: int = 7) -> int: ...
+
+    async def get_outbox_stats(self) -> Dict: ...
+
+    def get_query_stats(self, order_by: str = 'total_time', limit: int = None) -> List[Dict]: ...
+
+
+@runtime_checkable
+class MaintenanceStorage(Protocol):
+    """Обслуживание файлов SQLite: архив, VACUUM, пул соединений и кэш заявок"""
+
+    async def archive_closed(self, older_than: str, limit: int = 500,
+                             compress: bool = True) -> int: ...
+
+    async def incremental_vacuum(self, pages: int = 256) -> int: ...
+
+    async def get_vacuum_mode(self) -> str: ...
+
+    async def vacuum(self): ...
+
+    async def get_archive_stats(self) -> Dict: ...
+
+    def get_pool_stats(self) -> Dict: ...
+
+    def get_cache_stats(self) -> Dict: ...
+
+
+def _utc_now() -> str:
+    # Формат CURRENT_TIMESTAMP SQLite
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _page(rows: List[FeedbackSummary], limit: int, cursor: Optional[str], direction: str,
+          has_more: bool) -> Dict:
+    """Страница по ключу (created_at, id) из rows, упорядоченных от новых к старым"""
+    if direction == 'prev' and cursor:
+        items = rows[-limit:]
+        has_newer, has_older = has_more, True
+    else:
+        items = rows[:limit]
+        has_newer, has_older = cursor is not None, has_more
+
+    return {
+        'items': items,
+        'prev_cursor': encode_cursor(items[0].created_at, items[0].id)
+                       if items and has_newer else None,
+        'next_cursor': encode_cursor(items[-1].created_at, items[-1].id)
+                       if items and has_older else None
+    }
+
+
+def _sum_counts(target: Dict, source: Dict):
+    for key, value in source.items():
+        if isinstance(value, dict):
+            _sum_counts(target.setdefault(key, {}), value)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            target[key] = target.get(key, 0) + value
+
+
+class MemoryStorage:
+    """Хранилище заявок в памяти с индексами под запросы хендлеров.
+
+    Списки заявок по фильтрам (статус, категория, пользователь) хранятся
+    отсортированными по (created_at, id), поэтому страницы по курсору и
+    подсчеты не перебирают все заявки. Данные живут до close().
+    """
+
+    # Профилирование SQL к этому хранилищу неприменимо
+    profiler = None
+
+    def __init__(self):
+        self.outbox_event = asyncio.Event()
+        self._reset()
+
+    def get_query_stats(self, order_by: str = 'total_time', limit: int = None) -> List[Dict]:
+        return []
+
+    def _reset(self):
+        self._users: Dict[int, Dict] = {}
+        self._feedback: Dict[int, Dict] = {}
+        # (status, category) с None вместо любого значения -> [(created_at, id)]
+        self._indexes: Dict[Tuple, List[Tuple[str, int]]] = defaultdict(list)
+        self._by_user: Dict[int, List[Tuple[str, int]]] = defaultdict(list)
+        self._counters: Dict[Tuple[str, str, str], int] = defaultdict(int)
+        self._signatures: Dict[int, Dict] = {}
+        self._outbox: Dict[int, Dict] = {}
+        self._last_feedback_id = 0
+        self._last_outbox_id = 0
+        self._categories = [
+            {'id': i, 'name': name, 'description': description, 'is_active': 1}
+            for i, (name, description) in enumerate(DEFAULT_CATEGORIES, 1)
+        ]
+
+    async def init_db(self):
+        pass
+
+    async def close(self):
+        self._reset()
+
+    def load_sqlite(self, path: str):
+        """Загрузка пользователей и заявок из файла SQLite (снимок для бенчмарков)"""
+        conn = sqlite3.connect(path)
+        conn.row_factory = sqlite3.Row
+        try:
+            for row in conn.execute("SELECT user_id, username, first_name, last_name, is_admin FROM users"):
+                self._users[row['user_id']] = dict(row)
+            columns = ", ".join(FEEDBACK_COLUMNS)
+            for row in conn.execute(f"SELECT {columns} FROM feedback ORDER BY id"):
+                self._insert(dict(row))
+        finally:
+            conn.close()
+
+    # --- Индексы -----------------------------------------------------------
+
+    @staticmethod
+    def _index_keys(row: Dict):
+        status, category = row['status'], row['category']
+        return ((None, None), (status, None), (None, category), (status, category))
+
+    def _insert(self, row: Dict):
+        self._feedback[row['id']] = row
+        self._last_feedback_id = max(self._last_feedback_id, row['id'])
+        bisect.insort(self._by_user[row['user_id']], (row['created_at'], row['id']))
+        self._index(row)
+
+    def _index(self, row: Dict):
+        key = (row['created_at'], row['id'])
+        for index in self._index_keys(row):
+            bisect.insort(self._indexes[index], key)
+        self._counters[(row['status'] or '', row['category'], row['feedback_type'])] += 1
+
+    def _unindex(self, row: Dict):
+        key = (row['created_at'], row['id'])
+        for index in self._index_keys(row):
+            keys = self._indexes[index]
+            del keys[bisect.bisect_left(keys, key)]
+        self._counters[(row['status'] or '', row['category'], row['feedback_type'])] -= 1
+
+    def _keyset_page(self, keys: List[Tuple[str, int]], cursor: str = None,
+                     direction: str = 'next', limit: int = 10) -> Dict:
+        if cursor and direction == 'prev':
+            start = bisect.bisect_right(keys, decode_cursor(cursor))
+            selected = keys[start:start + limit + 1]
+            has_more = len(selected) > limit
+            selected = selected[:limit]
+        else:
+            end = bisect.bisect_left(keys, decode_cursor(cursor)) if cursor else len(keys)
+            selected = keys[max(0, end - limit):end]
+            has_more = end > limit
+        rows = [summarize(self._feedback[feedback_id]) for _, feedback_id in reversed(selected)]
+        return _page(rows, limit, cursor, direction, has_more)
+
+    # --- Пользователи ------------------------------------------------------
+
+    async def add_user(self, user_id: int, username: str = None,
+                       first_name: str = None, last_name: str = None):
+        # INSERT OR REPLACE сбрасывает is_admin, как и в SQLite
+        self._users[user_id] = {
+            'user_id': user_id, 'username': username, 'first_name': first_name,
+            'last_name': last_name, 'is_admin': 0,
+        }
+
+    async def set_admin(self, user_id: int, is_admin: bool = True):
+        if user_id in self._users:
+            self._users[user_id]['is_admin'] = int(is_admin)
+
+    async def is_admin(self, user_id: int) -> bool:
+        user = self._users.get(user_id)
+        return user['is_admin'] if user else False
+
+    # --- Заявки ------------------------------------------------------------
+
+    async def add_feedback(self, user_id: int, username: str, first_name: str,
+                           last_name: str, category: str, feedback_type: str,
+                           message: str, is_anonymous: bool = False,
+                           subcategory: str = None,
+                           notifications: Callable[[int, Optional[int]], List[Dict]] = None,
+                           signature: bytes = None,
+                           duplicate_candidates: Sequence[int] = ()) -> int:
+        """Добавление заявки (см. Database.add_feedback)"""
+        duplicate_of = None
+        for candidate in duplicate_candidates:
+            row = self._feedback.get(candidate)
+            if row is not None and row['status'] != 'closed' and row['duplicate_of'] is None:
+                duplicate_of = candidate
+                break
+
+        now = _utc_now()
+        self._last_feedback_id += 1
+        feedback_id = self._last_feedback_id
+        self._insert({
+            'id': feedback_id, 'user_id': user_id, 'username': username,
+            'first_name': first_name, 'last_name': last_name, 'category': category,
+            'subcategory': subcategory, 'feedback_type': feedback_type, 'message': message,
+            'is_anonymous': int(is_anonymous), 'status': 'new', 'admin_response': None,
+            'admin_id': None, 'created_at': now, 'updated_at': now, 'duplicate_of': duplicate_of,
+        })
+
+        if signature is not None and duplicate_of is None:
+            self._signatures[feedback_id] = {
+                'feedback_id': feedback_id, 'category': category,
+                'signature': signature, 'created_at': now,
+            }
+
+        if notifications:
+            self._enqueue_outbox(notifications(feedback_id, duplicate_of), feedback_id)
+
+        return feedback_id
+
+    async def get_feedback_by_id(self, feedback_id: int) -> Optional[Dict]:
+        row = self._feedback.get(feedback_id)
+        return dict(row) if row else None
+
+    async def update_feedback_status(self, feedback_id: int, status: str,
+                                     admin_id: int = None, admin_response: str = None,
+                                     notifications: Callable[[int], List[Dict]] = None
+                                     ) -> Optional[Dict]:
+        """Обновление статуса заявки (с уведомлениями в outbox); возвращает заявку"""
+        row = self._feedback.get(feedback_id)
+        if row is not None:
+            self._unindex(row)
+            row.update(status=status, admin_id=admin_id, admin_response=admin_response,
+                       updated_at=_utc_now())
+            self._index(row)
+            if status == 'closed':
+                self._signatures.pop(feedback_id, None)
+            if notifications:
+                self._enqueue_outbox(notifications(feedback_id), feedback_id)
+        return dict(row) if row else None
+
+    async def get_feedback_list(self, status: str = None, category: str = None,
+                                limit: int = 50) -> List[FeedbackSummary]:
+        keys = self._indexes.get((status or None, category or None), [])
+        return [summarize(self._feedback[feedback_id]) for _, feedback_id in reversed(keys[-limit:])]
+
+    async def get_feedback_page(self, status: str = None, category: str = None,
+                                cursor: str = None, direction: str = 'next',
+                                limit: int = 5) -> Dict:
+        keys = self._indexes.get((status or None, category or None), [])
+        return self._keyset_page(keys, cursor=cursor, direction=direction, limit=limit)
+
+    async def get_feedback_by_user(self, user_id: int, cursor: str = None,
+                                   limit: int = 10, direction: str = 'next') -> Dict:
+        keys = self._by_user.get(user_id, [])
+        return self._keyset_page(keys, cursor=cursor, direction=direction, limit=limit)
+
+    async def count_feedback_by_user(self, user_id: int) -> int:
+        return len(self._by_user.get(user_id, []))
+
+    def _filtered(self, status, category, feedback_type, date_from, date_to):
+        keys = self._indexes.get((status or None, category or None), [])
+        start = bisect.bisect_left(keys, (date_from,)) if date_from else 0
+        end = bisect.bisect_left(keys, (date_to,)) if date_to else len(keys)
+        for _, feedback_id in keys[start:end]:
+            row = self._feedback[feedback_id]
+            if not feedback_type or row['feedback_type'] == feedback_type:
+                yield row
+
+    async def count_feedback(self, status: str = None, category: str = None,
+                             feedback_type: str = None, date_from: str = None,
+                             date_to: str = None, include_archive: bool = False) -> int:
+        """Количество заявок по фильтрам (архива у хранилища в памяти нет)"""
+        if not (feedback_type or date_from or date_to):
+            return len(self._indexes.get((status or None, category or None), []))
+        return sum(1 for _ in self._filtered(status, category, feedback_type, date_from, date_to))
+
+    async def iter_feedback(self, status: str = None, category: str = None,
+                            feedback_type: str = None, date_from: str = None,
+                            date_to: str = None, chunk_size: int = 1000,
+                            include_archive: bool = True):
+        """Заявки по фильтрам пачками по chunk_size строк в порядке id"""
+        rows = sorted(self._filtered(status, category, feedback_type, date_from, date_to),
+                      key=lambda row: row['id'])
+        for start in range(0, len(rows), chunk_size):
+            yield [dict(row) for row in rows[start:start + chunk_size]]
+            # Отдаем управление циклу между пачками, как при чтении из БД
+            await asyncio.sleep(0)
+
+    def _search(self, terms: List[str], status, category, feedback_type, date_from, date_to):
+        """Найденные заявки с оценкой match_score по порядку (score, id)"""
+        rows = []
+        for row in self._filtered(status, category, feedback_type, date_from, date_to):
+            score = match_score(row, terms)
+            if score is not None:
+                rows.append({**row, 'score': score})
+        rows.sort(key=lambda row: (row['score'], row['id']))
+        return rows
+
+    async def search_feedback(self, terms: List[str], status: str = None, category: str = None,
+                              feedback_type: str = None, date_from: str = None,
+                              date_to: str = None, cursor: str = None,
+                              direction: str = 'next', limit: int = 5) -> Dict:
+        """Поиск перебором заявок (FTS5 есть только у SQLite)"""
+        rows = self._search(terms, status, category, feedback_type, date_from, date_to) if terms else []
+        keys = [(row['score'], row['id']) for row in rows]
+        if cursor and direction == 'prev':
+            end = bisect.bisect_left(keys, decode_search_cursor(cursor))
+            selected = rows[max(0, end - limit):end]
+            has_more = end > limit
+        else:
+            start = bisect.bisect_right(keys, decode_search_cursor(cursor)) if cursor else 0
+            selected = rows[start:start + limit + 1]
+            has_more = len(selected) > limit
+            selected = selected[:limit]
+        return search_page(selected, limit, cursor, direction, has_more)
+
+    async def count_search(self, terms: List[str], status: str = None, category: str = None,
+                           feedback_type: str = None, date_from: str = None,
+                           date_to: str = None) -> int:
+        if not terms:
+            return 0
+        return len(self._search(terms, status, category, feedback_type, date_from, date_to))
+
+    async def get_categories(self) -> List[Dict]:
+        return sorted((dict(row) for row in self._categories if row['is_active']),
+                      key=lambda row: row['name'])
+
+    async def get_breakdown(self) -> Dict:
+        return build_breakdown(
+            (status, category, feedback_type, count)
+            for (status, category, feedback_type), count in self._counters.items() if count > 0
+        )
+
+    async def get_stats(self) -> Dict:
+        breakdown = await self.get_breakdown()
+        return {
+            'total': breakdown['total'],
+            'new': breakdown['by_status']['new'],
+            'in_progress': breakdown['by_status']['in_progress'],
+            'closed': breakdown['by_status']['closed']
+        }
+
+    async def rebuild_counters(self) -> Dict:
+        """Пересчет счетчиков по заявкам; расхождений в памяти быть не может"""
+        counters = defaultdict(int)
+        for row in self._feedback.values():
+            counters[(row['status'] or '', row['category'], row['feedback_type'])] += 1
+        fixed = sum(1 for key in set(counters) | set(self._counters)
+                    if counters.get(key, 0) != self._counters.get(key, 0))
+        self._counters = counters
+        return {'rows': len(counters), 'fixed': fixed}
+
+    # --- Сигнатуры дубликатов ----------------------------------------------
+
+    async def get_unsigned_feedback(self, since: str) -> List[Dict]:
+        return [
+            {'id': row['id'], 'category': row['category'], 'message': row['message']}
+            for row in self._feedback.values()
+            if row['status'] != 'closed' and row['duplicate_of'] is None
+            and row['created_at'] >= since and row['id'] not in self._signatures
+        ]
+
+    async def save_signatures(self, signatures: List[Tuple[int, str, bytes]]):
+        for feedback_id, category, signature in signatures:
+            row = self._feedback.get(feedback_id)
+            if row is not None and feedback_id not in self._signatures:
+                self._signatures[feedback_id] = {
+                    'feedback_id': feedback_id, 'category': category,
+                    'signature': signature, 'created_at': row['created_at'],
+                }
+
+    async def get_signatures(self, since: str = None) -> List[Dict]:
+        rows = [dict(row) for row in self._signatures.values()
+                if since is None or row['created_at'] >= since]
+        return sorted(rows, key=lambda row: (row['created_at'], row['feedback_id']))
+
+    # --- Outbox ------------------------------------------------------------
+
+    def _enqueue_outbox(self, messages: List[Dict], feedback_id: int = None):
+        for message in messages:
+            self._last_outbox_id += 1
+            self._outbox[self._last_outbox_id] = {
+                'id': self._last_outbox_id, 'chat_id': message['chat_id'],
+                'text': message['text'], 'parse_mode': message.get('parse_mode'),
+                'reply_markup': message.get('reply_markup'), 'feedback_id': feedback_id,
+                'reply_to_feedback_id': message.get('reply_to_feedback_id'),
+                'status': 'pending', 'attempts': 0, 'next_attempt_at': 0,
+                'last_error': None, 'message_id': None, 'created_at': _utc_now(), 'sent_at': None,
+            }
+        if messages:
+            self.outbox_event.set()
+
+    async def claim_outbox(self, limit: int = 50, lease: float = 60) -> List[Dict]:
+        now = time.time()
+        ready = sorted(
+            (row for row in self._outbox.values()
+             if row['status'] == 'pending' and row['next_attempt_at'] <= now),
+            key=lambda row: (row['next_attempt_at'], row['id'])
+        )[:limit]
+
+        claimed = []
+        for row in ready:
+            row['next_attempt_at'] = now + lease
+            claimed.append(dict(row, reply_to_message_id=self._thread_message(row)))
+        return sorted(claimed, key=lambda row: row['id'])
+
+    def _thread_message(self, row: Dict) -> Optional[int]:
+        if row['reply_to_feedback_id'] is None:
+            return None
+        for other in self._outbox.values():
+            if (other['feedback_id'] == row['reply_to_feedback_id'] and other['chat_id'] == row['chat_id']
+                    and other['status'] == 'sent' and other['reply_to_feedback_id'] is None):
+                return other['message_id']
+        return None
+
+    async def extend_outbox_lease(self, outbox_ids: List[int], lease: float = 60):
+        until = time.time() + lease
+        for outbox_id in outbox_ids:
+            row = self._outbox.get(outbox_id)
+            if row is not None and row['status'] == 'pending':
+                row['next_attempt_at'] = until
+
+    async def mark_outbox_sent(self, delivered: List[Tuple[int, Optional[int]]]):
+        for outbox_id, message_id in delivered:
+            row = self._outbox.get(outbox_id)
+            if row is not None:
+                row.update(status='sent', message_id=message_id, sent_at=_utc_now(),
+                           attempts=row['attempts'] + 1, last_error=None)
+
+    async def mark_outbox_failed(self, outbox_id: int, error: str, retry_at: float = None):
+        row = self._outbox.get(outbox_id)
+        if row is not None:
+            row.update(attempts=row['attempts'] + 1, last_error=error[:1000],
+                       status='dead' if retry_at is None else 'pending',
+                       next_attempt_at=retry_at if retry_at is not None else row['next_attempt_at'])
+
+    async def purge_outbox(self, older_than_days: int = 7) -> int:
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=older_than_days)).strftime('%Y-%m-%d %H:%M:%S')
+        purged = [outbox_id for outbox_id, row in self._outbox.items()
+                  if row['status'] == 'sent' and row['sent_at'] < cutoff]
+        for outbox_id in purged:
+            del self._outbox[outbox_id]
+        return len(purged)
+
+    async def get_outbox_stats(self) -> Dict:
+        stats = {'pending': 0, 'sent': 0, 'dead': 0}
+        for row in self._outbox.values():
+            stats[row['status']] = stats.get(row['status'], 0) + 1
+        return stats
+
+
+class ShardedStorage:
+    """Заявки в нескольких файлах SQLite.
+
+    Новая заявка попадает в шард по категории (crc32 названия) или по
+    году создания; номера заявок шарда k дают остаток k при делении на
+    число шардов, поэтому заявка по номеру читается из одного файла.
+    Пользователи и категории хранятся в первом шарде. Outbox каждого шарда
+    пишется в одной транзакции с заявкой, а наружу выдается с номерами
+    вида id * число шардов + k.
+    """
+
+    def __init__(self, paths: Sequence[str], shard_by: str = 'category', **db_options):
+        if shard_by not in ('category', 'year'):
+            raise ValueError(f"Неизвестный ключ шардирования: {shard_by}")
+        self.shard_by = shard_by
+        self.shards = [
+            Database(path, id_stride=len(paths), id_offset=index, **db_options)
+            for index, path in enumerate(paths)
+        ]
+        # Общие сигнал outbox и профилировщик для всех шардов
+        self.outbox_event = asyncio.Event()
+        for shard in self.shards:
+            shard.outbox_event = self.outbox_event
+            shard.pool.profiler = self.shards[0].pool.profiler
+
+    @property
+    def primary(self) -> Database:
+        return self.shards[0]
+
+    @property
+    def profiler(self) -> Optional[QueryProfiler]:
+        return self.primary.profiler
+
+    def get_query_stats(self, order_by: str = 'total_time', limit: int = None) -> List[Dict]:
+        return self.primary.get_query_stats(order_by, limit)
+
+    def get_pool_stats(self) -> Dict:
+        """Статистика пулов соединений, просуммированная по шардам"""
+        stats = {}
+        for shard in self.shards:
+            _sum_counts(stats, shard.get_pool_stats())
+        return stats
+
+    def get_cache_stats(self) -> Dict:
+        """Статистика кэшей заявок, просуммированная по шардам"""
+        stats = {}
+        for shard in self.shards:
+            _sum_counts(stats, shard.get_cache_stats())
+        return stats
+
+    def _shard_for_id(self, feedback_id: int) -> Database:
+        return self.shards[feedback_id % len(self.shards)]
+
+    def _shard_for_new(self, category: str) -> Database:
+        if self.shard_by == 'year':
+            key = datetime.now(timezone.utc).year
+        else:
+            key = zlib.crc32(category.encode('utf-8'))
+        return self.shards[key % len(self.shards)]
+
+    async def _gather(self, method: str, *args, **kwargs) -> list:
+        return await asyncio.gather(*(getattr(shard, method)(*args, **kwargs) for shard in self.shards))
+
+    async def init_db(self):
+        for shard in self.shards:
+            await shard.init_db()
+
+    async def close(self):
+        for shard in self.shards:
+            await shard.close()
+
+    # --- Пользователи и категории (первый шард) ----------------------------
+
+    async def add_user(self, user_id: int, username: str = None,
+                       first_name: str = None, last_name: str = None):
+        await self.primary.add_user(user_id, username, first_name, last_name)
+
+    async def set_admin(self, user_id: int, is_admin: bool = True):
+        await self.primary.set_admin(user_id, is_admin)
+
+    async def is_admin(self, user_id: int) -> bool:
+        return await self.primary.is_admin(user_id)
+
+    async def get_categories(self) -> List[Dict]:
+        return await self.primary.get_categories()
+
+    # --- Заявки ------------------------------------------------------------
+
+    async def add_feedback(self, user_id: int, username: str, first_name: str,
+                           last_name: str, category: str, feedback_type: str,
+                           message: str, is_anonymous: bool = False,
+                           subcategory: str = None,
+                           notifications: Callable[[int, Optional[int]], List[Dict]] = None,
+                           signature: bytes = None,
+                           duplicate_candidates: Sequence[int] = ()) -> int:
+        shard = self._shard_for_new(category)
+        # Дубликат связывается только с заявкой из того же шарда
+        candidates = [feedback_id for feedback_id in duplicate_candidates
+                      if self._shard_for_id(feedback_id) is shard]
+        return await shard.add_feedback(
+            user_id=user_id, username=username, first_name=first_name, last_name=last_name,
+            category=category, feedback_type=feedback_type, message=message,
+            is_anonymous=is_anonymous, subcategory=subcategory, notifications=notifications,
+            signature=signature, duplicate_candidates=candidates
+        )
+
+    async def get_feedback_by_id(self, feedback_id: int) -> Optional[Dict]:
+        return await self._shard_for_id(feedback_id).get_feedback_by_id(feedback_id)
+
+    async def update_feedback_status(self, feedback_id: int, status: str,
+                                     admin_id: int = None, admin_response: str = None,
+                                     notifications: Callable[[int], List[Dict]] = None
+                                     ) -> Optional[Dict]:
+        return await self._shard_for_id(feedback_id).update_feedback_status(
+            feedback_id, status, admin_id=admin_id, admin_response=admin_response,
+            notifications=notifications
+        )
+
+    async def get_feedback_list(self, status: str = None, category: str = None,
+                                limit: int = 50) -> List[FeedbackSummary]:
+        rows = [row for rows in await self._gather('get_feedback_list', status, category, limit)
+                for row in rows]
+        rows.sort(key=lambda row: (row.created_at, row.id), reverse=True)
+        return rows[:limit]
+
+    def _merge_pages(self, pages: List[Dict], limit: int, cursor: Optional[str],
+                     direction: str) -> Dict:
+        rows = sorted((row for page in pages for row in page['items']),
+                      key=lambda row: (row.created_at, row.id), reverse=True)
+        further = 'prev_cursor' if direction == 'prev' and cursor else 'next_cursor'
+        has_more = len(rows) > limit or any(page[further] for page in pages)
+        return _page(rows, limit, cursor, direction, has_more)
+
+    async def get_feedback_page(self, status: str = None, category: str = None,
+                                cursor: str = None, direction: str = 'next',
+                                limit: int = 5) -> Dict:
+        pages = await self._gather('get_feedback_page', status=status, category=category,
+                                   cursor=cursor, direction=direction, limit=limit)
+        return self._merge_pages(pages, limit, cursor, direction)
+
+    async def get_feedback_by_user(self, user_id: int, cursor: str = None,
+                                   limit: int = 10, direction: str = 'next') -> Dict:
+        pages = await self._gather('get_feedback_by_user', user_id, cursor=cursor,
+                                   limit=limit, direction=direction)
+        return self._merge_pages(pages, limit, cursor, direction)
+
+    async def count_feedback_by_user(self, user_id: int) -> int:
+        return sum(await self._gather('count_feedback_by_user', user_id))
+
+    async def count_feedback(self, status: str = None, category: str = None,
+                             feedback_type: str = None, date_from: str = None,
+                             date_to: str = None, include_archive: bool = False) -> int:
+        return sum(await self._gather(
+            'count_feedback', status=status, category=category, feedback_type=feedback_type,
+            date_from=date_from, date_to=date_to, include_archive=include_archive
+        ))
+
+    async def search_feedback(self, terms: List[str], status: str = None, category: str = None,
+                              feedback_type: str = None, date_from: str = None,
+                              date_to: str = None, cursor: str = None,
+                              direction: str = 'next', limit: int = 5) -> Dict:
+        """Поиск по всем шардам; bm25 считается по статистике своего шарда"""
+        pages = await self._gather(
+            'search_feedback', terms, status=status, category=category,
+            feedback_type=feedback_type, date_from=date_from, date_to=date_to,
+            cursor=cursor, direction=direction, limit=limit
+        )
+        rows = sorted((row for page in pages for row in page['items']),
+                      key=lambda row: (row['score'], row['id']))
+        further = 'prev_cursor' if direction == 'prev' and cursor else 'next_cursor'
+        has_more = len(rows) > limit or any(page[further] for page in pages)
+        return search_page(rows, limit, cursor, direction, has_more)
+
+    async def count_search(self, terms: List[str], status: str = None, category: str = None,
+                           feedback_type: str = None, date_from: str = None,
+                           date_to: str = None) -> int:
+        return sum(await self._gather(
+            'count_search', terms, status=status, category=category,
+            feedback_type=feedback_type, date_from=date_from, date_to=date_to
+        ))
+
+    async def iter_feedback(self, status: str = None, category: str = None,
+                            feedback_type: str = None, date_from: str = None,
+                            date_to: str = None, chunk_size: int = 1000,
+                            include_archive: bool = True):
+        """Заявки по фильтрам пачками: шард за шардом, внутри шарда по id"""
+        for shard in self.shards:
+            async for chunk in shard.iter_feedback(
+                status=status, category=category, feedback_type=feedback_type,
+                date_from=date_from, date_to=date_to, chunk_size=chunk_size,
+                include_archive=include_archive
+            ):
+                yield chunk
+
+    async def get_breakdown(self) -> Dict:
+        breakdown = {}
+        for shard_breakdown in await self._gather('get_breakdown'):
+            _sum_counts(breakdown, shard_breakdown)
+        return breakdown
+
+    async def get_stats(self) -> Dict:
+        stats = {}
+        for shard_stats in await self._gather('get_stats'):
+            _sum_counts(stats, shard_stats)
+        return stats
+
+    async def rebuild_counters(self) -> Dict:
+        result = {}
+        for shard_result in await self._gather('rebuild_counters'):
+            _sum_counts(result, shard_result)
+        return result
+
+    # --- Сигнатуры дубликатов ----------------------------------------------
+
+    async def get_unsigned_feedback(self, since: str) -> List[Dict]:
+        return [row for rows in await self._gather('get_unsigned_feedback', since) for row in rows]
+
+    async def save_signatures(self, signatures: List[Tuple[int, str, bytes]]):
+        by_shard = defaultdict(list)
+        for signature in signatures:
+            by_shard[signature[0] % len(self.shards)].append(signature)
+        await asyncio.gather(*(self.shards[index].save_signatures(rows)
+                               for index, rows in by_shard.items()))
+
+    async def get_signatures(self, since: str = None) -> List[Dict]:
+        rows = [row for rows in await self._gather('get_signatures', since=since) for row in rows]
+        return sorted(rows, key=lambda row: (row['created_at'], row['feedback_id']))
+
+    # --- Outbox ------------------------------------------------------------
+
+    def _outbox_shard(self, outbox_id: int) -> Tuple[Database, int]:
+        return self.shards[outbox_id % len(self.shards)], outbox_id // len(self.shards)
+
+    async def claim_outbox(self, limit: int = 50, lease: float = 60) -> List[Dict]:
+        claimed = []
+        for index, rows in enumerate(await self._gather('claim_outbox', limit, lease)):
+            claimed.extend(dict(row, id=row['id'] * len(self.shards) + index) for row in rows)
+        return sorted(claimed, key=lambda row: row['id'])
+
+    async def extend_outbox_lease(self, outbox_ids: List[int], lease: float = 60):
+        by_shard = defaultdict(list)
+        for outbox_id in outbox_ids:
+            shard, local_id = self._outbox_shard(outbox_id)
+            by_shard[shard].append(local_id)
+        await asyncio.gather(*(shard.extend_outbox_lease(ids, lease) for shard, ids in by_shard.items()))
+
+    async def mark_outbox_sent(self, delivered: List[Tuple[int, Optional[int]]]):
+        by_shard = defaultdict(list)
+        for outbox_id, message_id in delivered:
+            shard, local_id = self._outbox_shard(outbox_id)
+            by_shard[shard].append((local_id, message_id))
+        await asyncio.gather(*(shard.mark_outbox_sent(rows) for shard, rows in by_shard.items()))
+
+    async def mark_outbox_failed(self, outbox_id: int, error: str, retry_at: float = None):
+        shard, local_id = self._outbox_shard(outbox_id)
+        await shard.mark_outbox_failed(local_id, error, retry_at=retry_at)
+
+    async def purge_outbox(self, older_than_days: int = 7) -> int:
+        return sum(await self._gather('purge_outbox', older_than_days))
+
+    async def get_outbox_stats(self) -> Dict:
+        stats = {}
+        for shard_stats in await self._gather('get_outbox_stats'):
+            _sum_counts(stats, shard_stats)
+        return stats
+
+    # --- Обслуживание файлов -----------------------------------------------
+
+    async def archive_closed(self, older_than: str, limit: int = 500,
+                             compress: bool = True) -> int:
+        return sum(await self._gather('archive_closed', older_than, limit, compress))
+
+    async def incremental_vacuum(self, pages: int = 256) -> int:
+        return sum(await self._gather('incremental_vacuum', pages))
+
+    async def get_vacuum_mode(self) -> str:
+        modes = set(await self._gather('get_vacuum_mode'))
+        return modes.pop() if len(modes) == 1 else ", ".join(sorted(modes))
+
+    async def vacuum(self):
+        for shard in self.shards:
+            await shard.vacuum()
+
+    async def get_archive_stats(self) -> Dict:
+        stats = {}
+        for shard_stats in await self._gather('get_archive_stats'):
+            _sum_counts(stats, shard_stats)
+        return stats
+
+
+def shard_paths(database_path: str, shards: int) -> List[str]:
+    """Файлы шардов рядом с DATABASE_PATH: feedback.db -> feedback.shard0.db, ..."""
+    root, ext = os.path.splitext(database_path)
+    return [f"{root}.shard{index}{ext or '.db'}" for index in range(shards)]
+
+
+def create_storage(engine: str, database_path: str, shards: int = 4,
+                   shard_by: str = 'category', **db_options) -> FeedbackStorage:
+    """Хранилище по настройке STORAGE_ENGINE; db_options — параметры Database"""
+    if engine == 'memory':
+        return MemoryStorage()
+    if engine == 'sharded':
+        return ShardedStorage(shard_paths(database_path, shards), shard_by=shard_by, **db_options)
+    if engine == 'sqlite':
+        return Database(database_path, **db_options)
+    raise ValueError(f"Неизвестный движок хранилища: {engine} (доступны: {', '.join(STORAGE_ENGINES)})")
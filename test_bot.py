@@ -12,7 +12,7 @@ os.environ['TESTING'] = '1'
 os.environ.setdefault('BOT_TOKEN', 'test_token')
 os.environ.setdefault('ADMIN_IDS', '123456789')
 
-from database import Database
+from database import PREVIEW_LENGTH, Database
 from config import FEEDBACK_CATEGORIES, FEEDBACK_TYPES
 
 async def test_database():
@@ -27,6 +27,11 @@ async def test_database():
         await db.init_db()
         print("✅ База данных инициализирована")
         
+        # Миграции схемы
+        from migrations import SCHEMA_VERSION
+        assert db.schema_version == SCHEMA_VERSION, "Ошибка применения миграций"
+        print(f"✅ Схема БД версии {db.schema_version}")
+        
         # Добавление пользователя
         await db.add_user(
             user_id=123456789,
@@ -55,29 +60,105 @@ async def test_database():
         )
         print(f"✅ Заявка #{feedback_id} добавлена")
         
+        # Заявки пользователя с постраничным выводом
+        for i in range(4):
+            await db.add_feedback(
+                user_id=123456789,
+                username="test_user",
+                first_name="Тест",
+                last_name="Пользователь",
+                category="Логистика и склад",
+                feedback_type="suggestion",
+                message=f"Тестовое предложение номер {i}"
+            )
+        first_page = await db.get_feedback_by_user(123456789, limit=3)
+        assert len(first_page['items']) == 3 and first_page['next_cursor'], "Ошибка первой страницы"
+        second_page = await db.get_feedback_by_user(
+            123456789, cursor=first_page['next_cursor'], limit=3
+        )
+        assert len(second_page['items']) == 2 and not second_page['next_cursor'], "Ошибка второй страницы"
+        back_page = await db.get_feedback_by_user(
+            123456789, cursor=second_page['prev_cursor'], limit=3, direction='prev'
+        )
+        assert [f.id for f in back_page['items']] == [f.id for f in first_page['items']], \
+            "Ошибка возврата на предыдущую страницу"
+        print("✅ Постраничный вывод заявок пользователя работает")
+        
+        # Постраничный вывод в админ-панели
+        admin_page = await db.get_feedback_page(category="Логистика и склад", limit=3)
+        assert admin_page['next_cursor'] and not admin_page['prev_cursor'], "Ошибка страницы списка"
+        assert await db.count_feedback(category="Логистика и склад") == 4, "Ошибка подсчета заявок"
+        print("✅ Постраничный вывод в админ-панели работает")
+        
         # Получение заявки
         feedback = await db.get_feedback_by_id(feedback_id)
         assert feedback is not None, "Ошибка получения заявки"
         print("✅ Заявка получена")
         
-        # Обновление статуса
-        await db.update_feedback_status(
+        # Обновление статуса: заявка возвращается тем же запросом и попадает в кэш
+        updated = await db.update_feedback_status(
             feedback_id=feedback_id,
             status="in_progress",
-            admin_id=123456789
+            admin_id=123456789,
+            notifications=lambda fid: [{'chat_id': 123456789, 'text': f"Заявка #{fid} в работе"}]
         )
+        assert updated['status'] == "in_progress" and updated['admin_id'] == 123456789, \
+            "Ошибка возврата обновленной заявки"
+        hits = db.get_cache_stats()['hits']
+        cached = await db.get_feedback_by_id(feedback_id)
+        assert cached == updated and db.get_cache_stats()['hits'] == hits + 1, "Ошибка кэша заявок"
+        cached['status'] = "closed"
+        assert (await db.get_feedback_by_id(feedback_id))['status'] == "in_progress", \
+            "Изменение результата испортило кэш"
+        assert await db.update_feedback_status(
+            10 ** 6, "closed", notifications=lambda fid: [{'chat_id': 1, 'text': f"Заявка #{fid}"}]
+        ) is None, "Ошибка для несуществующей заявки"
         print("✅ Статус заявки обновлен")
         
+        # Уведомление записано в outbox в той же транзакции
+        pending = await db.claim_outbox()
+        assert len(pending) == 1 and pending[0]['feedback_id'] == feedback_id, "Ошибка записи в outbox"
+        await db.mark_outbox_sent([(pending[0]['id'], 1)])
+        outbox_stats = await db.get_outbox_stats()
+        assert outbox_stats['sent'] == 1 and outbox_stats['pending'] == 0, "Ошибка статусов outbox"
+        print("✅ Уведомления outbox записаны и отмечены доставленными")
+        
         # Получение статистики
         stats = await db.get_stats()
         assert stats['total'] > 0, "Ошибка получения статистики"
         print(f"✅ Статистика получена: {stats}")
         
+        # Сводная статистика по категориям и типам
+        breakdown = await db.get_breakdown()
+        assert breakdown['by_type'] == {'complaint': 1, 'suggestion': 4}, "Ошибка статистики по типам"
+        assert breakdown['by_category']["Логистика и склад"]['new'] == 4, "Ошибка статистики по категориям"
+        print("✅ Сводная статистика получена")
+        
+        # Пересчет счетчиков не должен находить расхождений
+        rebuild = await db.rebuild_counters()
+        assert rebuild['fixed'] == 0, "Счетчики расходятся с таблицей заявок"
+        print("✅ Счетчики статистики согласованы с таблицей заявок")
+        
         # Получение категорий
         categories = await db.get_categories()
         assert len(categories) > 0, "Ошибка получения категорий"
         print(f"✅ Категории получены: {len(categories)} шт.")
         
+        # Параллельные записи объединяются в групповые транзакции
+        before = db.get_pool_stats()['transactions']
+        await asyncio.gather(*(
+            db.add_user(user_id=1000 + i, first_name=f"Сотрудник {i}") for i in range(50)
+        ))
+        group_commits = db.get_pool_stats()['transactions'] - before
+        assert group_commits < 50, "Записи не объединяются в транзакции"
+        print(f"✅ 50 параллельных записей выполнены за {group_commits} транзакций")
+        
+        # Статистика пула соединений
+        pool_stats = db.get_pool_stats()
+        assert pool_stats['reader_acquires'] > 0, "Ошибка статистики пула"
+        print(f"✅ Пул соединений: {pool_stats['readers']} читателей, "
+              f"{pool_stats['transactions']} транзакций")
+        
         print("🎉 Все тесты базы данных прошли успешно!")
         
     except Exception as e:
@@ -85,12 +166,1011 @@ async def test_database():
         return False
     
     finally:
+        await db.close()
+        
         # Удаляем тестовую базу
-        if os.path.exists("test_feedback.db"):
-            os.remove("test_feedback.db")
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists("test_feedback.db" + suffix):
+                os.remove("test_feedback.db" + suffix)
     
     return True
 
+async def test_outbound():
+    """Тестирование планировщика исходящих сообщений"""
+    print("🔍 Тестирование лимитов исходящих сообщений...")
+    
+    from aiogram.exceptions import TelegramRetryAfter
+    from datetime import datetime
+    from aiogram.methods import EditMessageReplyMarkup, EditMessageText, SendMessage
+    from aiogram.types import Chat, Message
+    from keyboards import get_feedback_action_keyboard
+    from outbound import EditDeduplicator, RateGovernor
+    
+    try:
+        governor = RateGovernor(global_rate=1000, chat_rate=1000)
+        attempts = []
+        
+        async def make_request(bot, method):
+            attempts.append(method)
+            if len(attempts) == 1:
+                raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=0)
+            return True
+        
+        method = SendMessage(chat_id=123456789, text="test")
+        result = await governor(make_request, None, method)
+        assert result is True and len(attempts) == 2, "Сообщение не повторено после flood wait"
+        
+        stats = governor.stats()
+        assert stats['retries'] == 1 and stats['sent'] == 1, "Ошибка счетчиков планировщика"
+        print(f"✅ Повтор после flood wait: {stats}")
+        
+        dedup = EditDeduplicator()
+        sent = []
+        
+        async def send(bot, method):
+            sent.append(method)
+            return Message(message_id=7, date=datetime.now(), chat=Chat(id=123456789, type="private"))
+        
+        keyboard = get_feedback_action_keyboard(1)
+        await dedup(send, None, SendMessage(chat_id=123456789, text="Заявка #1", reply_markup=keyboard))
+        for method in (
+            EditMessageReplyMarkup(chat_id=123456789, message_id=7, reply_markup=keyboard),
+            EditMessageText(chat_id=123456789, message_id=7, text="Заявка #1", reply_markup=keyboard),
+        ):
+            assert await dedup(send, None, method) is True, "Повторное редактирование не пропущено"
+        assert len(sent) == 1, "Запрос без изменений отправлен"
+        
+        await dedup(send, None, EditMessageText(chat_id=123456789, message_id=7, text="Заявка #1"))
+        await dedup(send, None, EditMessageText(chat_id=123456789, message_id=7, text="Заявка #1"))
+        assert len(sent) == 2, "Удаление клавиатуры не отправлено или повторено"
+        assert dedup.stats()['skipped'] == 3, "Ошибка счетчика пропущенных редактирований"
+        print(f"✅ Пропуск редактирований без изменений: {dedup.stats()}")
+        
+        # Отправка пачки дольше аренды: аренда продлевается, повторной выборки нет
+        from outbox import OutboxWorker, outbox_message
+        from storage import MemoryStorage
+        
+        class SlowBot:
+            """Бот, которому лимит чата позволяет одно сообщение в 0.2 с"""
+            def __init__(self):
+                self.sent = []
+                self.lock = asyncio.Lock()
+            
+            async def send_message(self, chat_id, text, **kwargs):
+                async with self.lock:
+                    await asyncio.sleep(0.2)
+                    self.sent.append(text)
+                    return Message(message_id=len(self.sent), date=datetime.now(),
+                                   chat=Chat(id=chat_id, type="private"))
+        
+        storage = MemoryStorage()
+        await storage.init_db()
+        await storage.add_feedback(
+            user_id=1, username=None, first_name="Test", last_name=None,
+            category="Общие вопросы", feedback_type="complaint", message="Аренда",
+            notifications=lambda fid, dup: [outbox_message(1000, f"Админ {i}") for i in range(5)]
+        )
+        slow_bot = SlowBot()
+        worker = OutboxWorker(storage, slow_bot, lease=0.3)
+        sending = asyncio.create_task(worker.process_batch())
+        reclaimed = []
+        # Второй обработчик пытается выбрать записи, пока пачка отправляется
+        while not sending.done():
+            await asyncio.sleep(0.05)
+            if not sending.done():
+                reclaimed.extend(await storage.claim_outbox(lease=0.3))
+        assert await sending == 5 and len(slow_bot.sent) == 5, "Пачка отправлена не полностью"
+        assert not reclaimed, f"Записи выбраны повторно во время отправки: {len(reclaimed)}"
+        assert worker.stats()['lease_renewals'] > 0 and \
+            (await storage.get_outbox_stats())['sent'] == 5, "Аренда не продлевалась"
+        await storage.close()
+        print(f"✅ Аренда outbox продлевается во время отправки: {worker.stats()}")
+        
+        print("🎉 Тестирование лимитов завершено!")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Ошибка тестирования лимитов: {e}")
+        return False
+
+async def test_metrics():
+    """Тестирование метрик Prometheus"""
+    print("🔍 Тестирование метрик...")
+    
+    from metrics import Registry, MetricsMiddleware, stats_collector
+    
+    try:
+        registry = Registry()
+        latency = registry.histogram("test_duration_seconds", "Тест", ("handler",), buckets=(0.1, 1))
+        errors = registry.counter("test_errors_total", "Тест", ("router", "handler", "update_type"))
+        latency.observe(0.05, handler="a")
+        latency.observe(0.5, handler="a")
+        registry.add_collector(stats_collector("test_pool", "Пул", lambda: {'readers': 4, 'name': 'x'}))
+        
+        text = registry.render()
+        assert 'test_duration_seconds_bucket{handler="a",le="0.1"} 1' in text, "Ошибка корзин гистограммы"
+        assert 'test_duration_seconds_bucket{handler="a",le="+Inf"} 2' in text, "Ошибка корзины +Inf"
+        assert 'test_duration_seconds_count{handler="a"} 2' in text, "Ошибка счетчика гистограммы"
+        assert "test_pool_readers 4" in text and "test_pool_name" not in text, "Ошибка коллектора"
+        print("✅ Формат Prometheus")
+        
+        handler_latency = registry.histogram(
+            "test_handler_seconds", "Тест", ("router", "handler", "update_type")
+        )
+        middleware = MetricsMiddleware(handler_latency, errors)
+        
+        async def failing(event, data):
+            raise ValueError("test")
+        
+        try:
+            await middleware(failing, object(), {})
+        except ValueError:
+            pass
+        assert errors.value(router="", handler="", update_type="object") == 1, "Ошибка не учтена"
+        assert handler_latency.count(router="", handler="", update_type="object") == 1, "Задержка не учтена"
+        print("✅ Middleware задержек хендлеров")
+        
+        print("🎉 Тестирование метрик завершено!")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Ошибка тестирования метрик: {e}")
+        return False
+
+async def test_query_profiler():
+    """Тестирование профилировщика запросов"""
+    print("🔍 Тестирование профилировщика запросов...")
+    
+    from database import encode_cursor
+    from query_profiler import statement_shape
+    
+    db = Database("test_profile.db", slow_query_ms=0, cache_size=0)
+    try:
+        await db.init_db()
+        await db.add_user(123456789, "test_user", "Test", "User")
+        feedback_id = await db.add_feedback(
+            user_id=123456789, username="test_user", first_name="Test", last_name="User",
+            category="Общие вопросы", feedback_type="suggestion", message="Тест"
+        )
+        await db.get_feedback_by_id(feedback_id)
+        await db.get_feedback_by_id(feedback_id)
+        
+        assert statement_shape("SELECT  *\n FROM t WHERE a = 5 AND b = 'x'") == \
+            "SELECT * FROM t WHERE a = ? AND b = ?", "Ошибка нормализации запроса"
+        
+        stats = {row['shape']: row for row in db.get_query_stats()}
+        by_id = stats["SELECT * FROM feedback WHERE id = ?"]
+        assert by_id['calls'] == 2 and by_id['slow'] == 2, "Ошибка учета вызовов"
+        assert not by_id['scanned_tables'] and by_id['plan'], "Ошибка плана запроса"
+        print(f"✅ Статистика запроса: {by_id['calls']} вызова, план {by_id['plan']}")
+        
+        # Страницы списка без фильтров читаются по индексу, без сортировки
+        page = await db.get_feedback_page(limit=1)
+        await db.get_feedback_page(cursor=encode_cursor(page['items'][0].created_at, 10 ** 6), limit=1)
+        pages = [row for row in db.get_query_stats() if "ORDER BY created_at DESC" in row['shape']]
+        assert len(pages) == 2 and not any(row['scanned_tables'] or 'TEMP B-TREE' in str(row['plan'])
+                                           for row in pages), "Список без фильтров читается без индекса"
+        print("✅ Список без фильтров читается по индексу")
+        
+        # Выборка без условий — полный проход по таблице заявок
+        await db.pool.write(lambda conn: conn.execute("UPDATE feedback SET subcategory = NULL"))
+        scans = [row for row in db.get_query_stats() if row['scanned_tables']]
+        assert any('feedback' in row['scanned_tables'] for row in scans), "Полный проход не обнаружен"
+        print("✅ Обнаружение полного прохода по таблице")
+        
+        print("🎉 Тестирование профилировщика завершено!")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Ошибка тестирования профилировщика: {e}")
+        return False
+    finally:
+        await db.close()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists("test_profile.db" + suffix):
+                os.remove("test_profile.db" + suffix)
+
+async def test_loop_watchdog():
+    """Тестирование контроля задержки цикла"""
+    print("🔍 Тестирование контроля задержки цикла...")
+    
+    import time
+    from loop_watchdog import LoopWatchdog
+    from metrics import Counter, Histogram
+    
+    watchdog = LoopWatchdog(
+        interval=0.02, threshold=0.1,
+        lag_histogram=Histogram("test_lag_seconds", "Тест"),
+        stall_counter=Counter("test_stalls_total", "Тест")
+    )
+    
+    def blocking_handler():
+        time.sleep(0.3)
+    
+    try:
+        watchdog.start()
+        await asyncio.sleep(0.05)
+        blocking_handler()
+        await asyncio.sleep(0.05)
+        
+        stats = watchdog.stats()
+        assert stats['stalls'] == 1, f"Ожидалась одна блокировка: {stats}"
+        assert stats['max_lag'] >= 0.2, "Задержка цикла не измерена"
+        assert "blocking_handler" in watchdog.reports[-1]['stack'], "Стек блокирующего кода не снят"
+        print(f"✅ Блокировка обнаружена: задержка {stats['max_lag'] * 1000:.0f} мс")
+        
+        print("🎉 Тестирование контроля задержки завершено!")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Ошибка тестирования контроля задержки: {e}")
+        return False
+    finally:
+        await watchdog.stop()
+
+async def test_export():
+    """Тестирование выгрузки заявок"""
+    print("🔍 Тестирование выгрузки заявок...")
+    
+    import csv
+    import json
+    import tempfile
+    import zipfile
+    from xml.etree import ElementTree
+    from export import export_feedback, parse_export_args
+    
+    db = Database("test_export.db")
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        await db.init_db()
+        await db.add_user(123456789, "test_user", "Test", "User")
+        for i in range(25):
+            await db.add_feedback(
+                user_id=123456789, username="test_user", first_name="Test", last_name="User",
+                category="HR и кадры", feedback_type="complaint" if i % 2 else "suggestion",
+                message=f"Заявка <{i}> & \"кавычки\"\x01", is_anonymous=(i == 0)
+            )
+        
+        fmt, filters = parse_export_args("xlsx category=hr type=complaint from=2000-01-01")
+        assert fmt == "xlsx" and filters['category'] == "HR и кадры", "Ошибка разбора аргументов"
+        assert await db.count_feedback(**filters) == 12, "Ошибка подсчета по фильтрам"
+        
+        progress = []
+        
+        async def on_progress(done):
+            progress.append(done)
+        
+        for fmt in ("csv", "jsonl", "xlsx"):
+            path = os.path.join(tmp_dir, f"export.{fmt}")
+            rows = await export_feedback(db, path, fmt, {}, on_progress, chunk_size=10)
+            assert rows == 25, f"Выгружено {rows} строк в {fmt}"
+        assert progress[:3] == [10, 20, 25], "Ошибка прогресса выгрузки"
+        
+        with open(os.path.join(tmp_dir, "export.csv"), encoding="utf-8-sig") as f:
+            csv_rows = list(csv.reader(f))
+        assert len(csv_rows) == 26 and csv_rows[1][8] == "", "Ошибка CSV (анонимность)"
+        
+        with open(os.path.join(tmp_dir, "export.jsonl"), encoding="utf-8") as f:
+            records = [json.loads(line) for line in f]
+        assert records[1]['username'] == "test_user", "Ошибка JSONL"
+        
+        with zipfile.ZipFile(os.path.join(tmp_dir, "export.xlsx")) as book:
+            sheet = ElementTree.fromstring(book.read("xl/worksheets/sheet1.xml"))
+        namespace = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+        assert len(sheet.iter(f"{namespace}row").__next__()) == 15, "Ошибка заголовка XLSX"
+        assert len(list(sheet.iter(f"{namespace}row"))) == 26, "Ошибка строк XLSX"
+        print("✅ Выгрузка CSV, JSONL и XLSX")
+        
+        print("🎉 Тестирование выгрузки завершено!")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Ошибка тестирования выгрузки: {e}")
+        return False
+    finally:
+        await db.close()
+        import shutil
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists("test_export.db" + suffix):
+                os.remove("test_export.db" + suffix)
+
+async def test_archive():
+    """Тестирование архивирования закрытых заявок"""
+    print("🔍 Тестирование архива заявок...")
+    
+    from archive import Archiver
+    
+    db = Database("test_archive.db")
+    try:
+        await db.init_db()
+        assert await db.get_vacuum_mode() == 'incremental', "Новая база не в режиме incremental"
+        
+        await db.add_user(123456789, "test_user", "Test", "User")
+        long_text = "Не работает вентиляция в цехе. " * 200
+        ids = []
+        for i in range(30):
+            ids.append(await db.add_feedback(
+                user_id=123456789, username="test_user", first_name="Test", last_name="User",
+                category="Общие вопросы", feedback_type="complaint", message=long_text
+            ))
+        for feedback_id in ids[:20]:
+            await db.update_feedback_status(feedback_id, "closed", admin_response="Починили")
+        
+        stats_before = await db.get_stats()
+        
+        # Нечего архивировать: пустая пачка не ошибка
+        assert await db.archive_closed("2000-01-01 00:00:00") == 0, "Ошибка пустого архивирования"
+        
+        # Заявка в кэше перед переносом
+        await db.get_feedback_by_id(ids[0])
+        hits = db.get_cache_stats()['hits']
+        await db.get_feedback_by_id(ids[0])
+        assert db.get_cache_stats()['hits'] == hits + 1, "Заявка не попала в кэш"
+        
+        # Отрицательный срок — архивируются все закрытые заявки, даже только что закрытые;
+        # 20 заявок — ровно 4 пачки, последняя выборка пустая
+        archiver = Archiver(db, older_than_days=-1, batch_size=5, pause=0)
+        result = await archiver.run_once()
+        assert result['archived'] == 20, f"В архив перенесено {result['archived']}"
+        assert result['vacuumed_pages'] > 0, "Страницы не освобождены"
+        
+        archive_stats = await db.get_archive_stats()
+        assert archive_stats['hot'] == 10 and archive_stats['archived'] == 20, "Ошибка переноса"
+        assert await db.get_stats() == stats_before, "Статистика изменилась после архивирования"
+        assert (await db.rebuild_counters())['fixed'] == 0, "Счетчики разошлись с архивом"
+        print(f"✅ Архивировано: {result}")
+        
+        # Перенос сбрасывает кэш: заявка перечитывается из архива
+        misses = db.get_cache_stats()['misses']
+        archived = await db.get_feedback_by_id(ids[0])
+        assert db.get_cache_stats()['misses'] == misses + 1, "Кэш не сброшен при архивировании"
+        assert (await archiver.run_once())['archived'] == 0, "Ошибка прохода без закрытых заявок"
+        assert archived['message'] == long_text and archived['admin_response'] == "Починили", \
+            "Ошибка чтения сжатой заявки из архива"
+        
+        exported = [row['id'] async for chunk in db.iter_feedback(chunk_size=8) for row in chunk]
+        assert exported == ids, "Выгрузка не видит архивные заявки"
+        assert await db.count_feedback(status="closed", include_archive=True) == 20, "Ошибка подсчета с архивом"
+        print("✅ Архивные заявки доступны по номеру и в выгрузке")
+        
+        # Архивные заявки остаются в истории пользователя и в списке закрытых
+        history, cursor = [], None
+        while True:
+            page = await db.get_feedback_by_user(123456789, cursor=cursor, limit=7)
+            history.extend(row.id for row in page['items'])
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+        back = await db.get_feedback_by_user(123456789, cursor=page['prev_cursor'],
+                                             limit=7, direction='prev')
+        assert sorted(history) == ids and await db.count_feedback_by_user(123456789) == 30, \
+            "Архивные заявки пропали из истории пользователя"
+        assert [row.id for row in back['items']] == history[-9:-2], "Ошибка возврата по истории"
+        closed = (await db.get_feedback_page(status="closed", limit=50))['items']
+        assert sorted(row.id for row in closed) == ids[:20] and \
+            all(row.preview == long_text[:100] + '...' and row.has_response for row in closed), \
+            "Ошибка списка закрытых заявок с архивом"
+        assert await db.count_feedback(status="closed", include_archive=True) == \
+            (await db.get_stats())['closed'], "Список закрытых расходится со статистикой"
+        print("✅ Архивные заявки в истории пользователя и списке закрытых")
+        
+        # Архивная заявка не меняется, и уведомление о ней не отправляется
+        assert await db.update_feedback_status(
+            ids[0], "in_progress", notifications=lambda fid: [{'chat_id': 1, 'text': "Ответ"}]
+        ) is None and (await db.get_outbox_stats())['pending'] == 0, \
+            "Уведомление о неизмененной архивной заявке"
+        
+        print("🎉 Тестирование архива завершено!")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Ошибка тестирования архива: {e}")
+        return False
+    finally:
+        await db.close()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists("test_archive.db" + suffix):
+                os.remove("test_archive.db" + suffix)
+
+async def test_throttling():
+    """Тестирование ограничения частоты запросов"""
+    print("🔍 Тестирование ограничения частоты...")
+    
+    from types import SimpleNamespace
+    from aiogram.types import CallbackQuery, User
+    from metrics import Counter
+    from throttling import ThrottlingMiddleware
+    
+    try:
+        answers = []
+        
+        class FakeCallback(CallbackQuery):
+            async def answer(self, text=None, **kwargs):
+                answers.append(text)
+        
+        async def handler(event, data):
+            return "ok"
+        
+        def make_data(user_id, flag=None):
+            flags = {"throttling": flag} if flag else {}
+            return {
+                'event_from_user': User(id=user_id, is_bot=False, first_name="Тест"),
+                'handler': SimpleNamespace(flags=flags),
+                'event_update': SimpleNamespace(event_type="callback_query"),
+            }
+        
+        throttled = Counter("test_throttled_total", "Тест", ("throttle_class", "update_type"))
+        middleware = ThrottlingMiddleware(
+            {"default": (0.001, 3), "list": (0.001, 1)}, admin_ids=[1000],
+            max_users=2, throttled=throttled
+        )
+        event = FakeCallback(
+            id="1", from_user=User(id=1, is_bot=False, first_name="Тест"), chat_instance="x"
+        )
+        
+        results = [await middleware(handler, event, make_data(1)) for _ in range(5)]
+        assert results == ["ok"] * 3 + [None] * 2, "Лимит по умолчанию не соблюден"
+        assert answers == [answers[0]] * 2 and answers[0], "Callback не получил ответ"
+        assert throttled.value(throttle_class="default", update_type="callback_query") == 2
+        print("✅ Ведро токенов на пользователя")
+        
+        assert await middleware(handler, event, make_data(1, "list")) == "ok"
+        assert await middleware(handler, event, make_data(1, "list")) is None, "Класс хендлера не учтен"
+        assert await middleware(handler, event, make_data(2)) == "ok", "Лимит общий для пользователей"
+        assert middleware.stats()['tracked'] == 2, "LRU не вытесняет старые записи"
+        print("✅ Классы хендлеров и вытеснение LRU")
+        
+        results = [await middleware(handler, event, make_data(1000)) for _ in range(10)]
+        assert results == ["ok"] * 10, "Администратор ограничен"
+        print("✅ Администраторы без ограничений")
+        
+        print("🎉 Тестирование ограничения частоты завершено!")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Ошибка тестирования ограничения частоты: {e}")
+        return False
+
+async def test_dedup():
+    """Тестирование поиска дубликатов заявок"""
+    print("🔍 Тестирование поиска дубликатов...")
+    
+    import time
+    from dedup import DuplicateDetector
+    from outbox import outbox_message
+    
+    db = Database("test_dedup.db")
+    try:
+        await db.init_db()
+        detector = DuplicateDetector(db, threshold=0.5)
+        await detector.load()
+        
+        category = "Цех термопластавтоматов (ТПА)"
+        texts = [
+            "Сломался термопластавтомат номер 5, линия стоит с утра, нужен наладчик",
+            "сломался термопластавтомат №5 - линия стоит с утра! нужен наладчик срочно",
+            "В столовой закончились обеды к часу дня, вторую неделю подряд",
+        ]
+        
+        def notifications(feedback_id, duplicate_of):
+            return [outbox_message(1000, f"Заявка #{feedback_id}", reply_to_feedback_id=duplicate_of)]
+        
+        async def submit(text, category=category):
+            signature, candidates = detector.check(category, text)
+            feedback_id = await db.add_feedback(
+                user_id=1, username=None, first_name="Test", last_name=None,
+                category=category, feedback_type="complaint", message=text,
+                notifications=notifications, signature=signature, duplicate_candidates=candidates
+            )
+            await detector.refresh()
+            return feedback_id
+        
+        original = await submit(texts[0])
+        (sent,) = await db.claim_outbox()
+        await db.mark_outbox_sent([(sent['id'], 555)])
+        
+        duplicate = await submit(texts[1])
+        other = await submit(texts[2])
+        other_category = await submit(texts[0], category="Общие вопросы")
+        
+        assert (await db.get_feedback_by_id(duplicate))['duplicate_of'] == original, "Дубликат не связан"
+        assert (await db.get_feedback_by_id(other))['duplicate_of'] is None, "Ложное совпадение"
+        assert (await db.get_feedback_by_id(other_category))['duplicate_of'] is None, "Совпадение в другой категории"
+        assert detector.stats()['indexed'] == 3, "Дубликат попал в индекс"
+        print("✅ Похожая заявка связана с исходной")
+        
+        pending = {row['feedback_id']: row for row in await db.claim_outbox()}
+        assert pending[duplicate]['reply_to_message_id'] == 555, "Уведомление о дубликате не в ветке"
+        assert pending[other]['reply_to_message_id'] is None, "Лишний ответ на уведомление"
+        print("✅ Уведомления о дубликатах собираются в ветку")
+        
+        started = time.perf_counter()
+        for _ in range(100):
+            detector.check(category, texts[1])
+        elapsed = (time.perf_counter() - started) / 100
+        print(f"✅ Проверка заявки: {elapsed * 1000:.3f} мс")
+        
+        # Закрытая заявка больше не принимает дубликаты
+        await db.update_feedback_status(original, "closed")
+        assert await db.get_signatures() and all(
+            row['feedback_id'] != original for row in await db.get_signatures()
+        ), "Сигнатура закрытой заявки не удалена"
+        late = await submit(texts[1])
+        assert (await db.get_feedback_by_id(late))['duplicate_of'] is None, "Дубликат закрытой заявки"
+        
+        # Новый индекс загружается из таблицы сигнатур
+        reloaded = DuplicateDetector(db, threshold=0.5)
+        await reloaded.load()
+        assert original not in reloaded._entries and late in reloaded._entries, "Ошибка загрузки индекса"
+        print("✅ Закрытые заявки исключаются из поиска")
+        
+        # Заявка, закрытая другим процессом, удаляется из индекса сверкой с таблицей
+        assert original in detector._entries, "Заявка удалена из индекса раньше сверки"
+        assert await detector.resync(settle=0) == 1 and original not in detector._entries, \
+            "Закрытая заявка осталась в индексе после сверки"
+        
+        # Заявки старше окна удаляются целиком, даже если ни с чем не совпадали
+        detector.add(10 ** 6, "Общие вопросы", detector.signature(texts[2]), time.time() - detector.window - 1)
+        reloaded.add(10 ** 6, "Общие вопросы", detector.signature(texts[2]), time.time() - detector.window - 1)
+        assert reloaded.prune() == 1 and 10 ** 6 not in reloaded._entries, "Устаревшая заявка не удалена"
+        assert reloaded.prune(now=time.time() + detector.window + 1) == reloaded.stats()['expired'] - 1 and \
+            reloaded.stats()['indexed'] == 0 and reloaded.stats()['buckets'] == 0, "Индекс не очищен по окну"
+        print(f"✅ Индекс ограничен открытыми заявками за окно: {detector.stats()}")
+        
+        print("🎉 Тестирование поиска дубликатов завершено!")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Ошибка тестирования поиска дубликатов: {e}")
+        return False
+    finally:
+        await db.close()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists("test_dedup.db" + suffix):
+                os.remove("test_dedup.db" + suffix)
+
+async def test_webhook():
+    """Тестирование приема апдейтов вебхуком"""
+    print("🔍 Тестирование вебхука...")
+    
+    from datetime import datetime
+    from aiohttp.test_utils import TestClient, TestServer
+    from aiogram import Bot, Dispatcher, F
+    from metrics import Counter, Histogram
+    from webhook import SECRET_HEADER, UpdateQueue, WebhookServer, feed_dispatcher
+    
+    try:
+        dp = Dispatcher()
+        handled = []
+        gate = asyncio.Event()
+        
+        @dp.message(F.text)
+        async def slow_handler(message):
+            await gate.wait()
+            handled.append(message.text)
+        
+        requests = Counter("test_webhook_requests_total", "Тест", ("result",))
+        bot = Bot("123456:test")
+        queue = UpdateQueue(feed_dispatcher(dp, bot), partitions=1, queue_size=2,
+                            latency=Histogram("test_update_queue_seconds", "Тест", ("stage",)))
+        webhook = WebhookServer(queue, bot, secret_token="secret", requests=requests)
+        client = TestClient(TestServer(webhook.app()))
+        await client.start_server()
+        
+        def update(update_id, text):
+            return {
+                'update_id': update_id,
+                'message': {
+                    'message_id': update_id, 'date': int(datetime.now().timestamp()),
+                    'chat': {'id': 1, 'type': 'private'},
+                    'from': {'id': 1, 'is_bot': False, 'first_name': "Тест"},
+                    'text': text,
+                },
+            }
+        
+        async def post(body, secret="secret"):
+            response = await client.post(webhook.path, json=body, headers={SECRET_HEADER: secret})
+            return response.status, response.headers.get('Retry-After')
+        
+        try:
+            assert (await post(update(1, "1"), secret="wrong"))[0] == 401, "Секрет не проверяется"
+            assert (await post({'foo': 1}))[0] == 400, "Некорректный апдейт принят"
+            
+            # Первый апдейт занимает обработчик, два ждут в очереди, четвертый не помещается
+            assert (await post(update(1, "1")))[0] == 200
+            await asyncio.sleep(0.05)
+            statuses = [await post(update(i, str(i))) for i in (2, 3, 4)]
+            assert [status for status, _ in statuses] == [200, 200, 503], f"Ответы: {statuses}"
+            assert statuses[-1][1] == "1", "Нет Retry-After при переполнении"
+            print("✅ Проверка секрета и ответ 503 при заполненной очереди")
+        finally:
+            gate.set()
+            # Закрытие сервера дожидается обработки принятых апдейтов
+            await client.close()
+        
+        assert handled == ["1", "2", "3"], f"Нарушен порядок обработки: {handled}"
+        stats = webhook.stats()
+        assert stats['processed'] == 3 and stats['overloaded'] == 1 and stats['queued'] == 0
+        assert requests.value(result="accepted") == 3 and requests.value(result="unauthorized") == 1
+        print(f"✅ Апдейты обработаны по порядку: {stats}")
+        
+        print("🎉 Тестирование вебхука завершено!")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Ошибка тестирования вебхука: {e}")
+        return False
+
+async def test_supervisor():
+    """Тестирование многопроцессного режима"""
+    print("🔍 Тестирование рабочих процессов...")
+    
+    import tempfile
+    import shutil
+    import time
+    from unittest import mock
+    from benchmark import RecordingSession, callback_update, message_update
+    from outbound import SharedChatBuckets, SharedTokenBucket
+    from workers import CONTEXT, Supervisor
+    
+    temp_dir = tempfile.mkdtemp()
+    # Настройки читаются рабочими процессами при запуске
+    env = {
+        'BOT_TOKEN': "123456:test", 'DATABASE_PATH': os.path.join(temp_dir, "feedback.db"),
+        'STORAGE_ENGINE': "sqlite",
+        'METRICS_PORT': "0", 'OUTBOUND_CHAT_RATE': "1000", 'DEDUP_THRESHOLD': "0",
+    }
+    try:
+        with mock.patch.dict(os.environ, env):
+            bucket = SharedTokenBucket(1, 2, CONTEXT)
+            now = time.monotonic()
+            assert bucket.try_take(now) and bucket.try_take(now) and not bucket.try_take(now), \
+                "Общее ведро не ограничивает отправку"
+            print("✅ Общее ведро в разделяемой памяти")
+            
+            # Ведра чатов: ячейка по id, интервал пополнения — по типу чата
+            chats = SharedChatBuckets(1, 0.5, capacity=1, slots=16, context=CONTEXT)
+            assert chats.bucket(5).try_take(now) and not chats.bucket(5).try_take(now), \
+                "Ведро чата не общее для обращений"
+            assert chats.bucket(6).try_take(now), "Ведра разных чатов связаны"
+            assert chats.bucket(-100).reserve(now) == 0 and chats.bucket(-100).reserve(now) == 2, \
+                "Лимит группы не применен"
+            assert chats.bucket("@channel").try_take(now), "Ведро канала недоступно"
+            print("✅ Ведра чатов в разделяемой памяти")
+            
+            # Миграции выполняет супервизор до запуска процессов
+            db = Database(env['DATABASE_PATH'])
+            await db.init_db()
+            # Ведра чатов почти не пополняются: расход процессов виден супервизору
+            chat_buckets = SharedChatBuckets(0.001, 0.001, capacity=1000, context=CONTEXT)
+            supervisor = Supervisor(2, SharedTokenBucket(1000, 1000, CONTEXT), chat_buckets,
+                                    outbox_event=db.outbox_event,
+                                    session_factory=RecordingSession)
+            await supervisor.start()
+            assert supervisor.stats()['workers'] == 2, "Процессы не запущены"
+            
+            users = range(3_000_000, 3_000_010)
+            try:
+                for user_id in users:
+                    for update in (
+                        message_update(user_id, "/start"),
+                        message_update(user_id, "📝 Оставить обратную связь"),
+                        callback_update(user_id, "type_suggestion"),
+                        callback_update(user_id, "cat_assembly"),
+                        message_update(user_id, f"Предложение пользователя {user_id}"),
+                        callback_update(user_id, "confirm_send"),
+                    ):
+                        await supervisor.queue.put(update)
+            finally:
+                # Остановка дожидается обработки переданных апдейтов
+                await supervisor.stop()
+            
+            stats = supervisor.stats()
+            assert stats['forwarded'] == 60 and stats['failed'] == 0, f"Статистика: {stats}"
+            assert stats['workers'] == 0 and stats['restarts'] == 0, f"Статистика: {stats}"
+            # Шаги FSM каждого пользователя дошли до одного процесса по порядку
+            count = await db.count_feedback()
+            assert count == len(users), f"Создано заявок: {count}"
+            # Отправки процессов учтены в общих ведрах чатов
+            assert not any(chat_buckets.bucket(user_id).is_full for user_id in users), \
+                "Ведра чатов процессов не общие с супервизором"
+            assert chat_buckets.bucket(users[0] - 1).is_full, "Затронуто ведро чужого чата"
+            print(f"✅ Апдейты распределены по процессам: {stats}")
+            await db.close()
+        
+        print("🎉 Тестирование рабочих процессов завершено!")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Ошибка тестирования рабочих процессов: {e}")
+        return False
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+async def test_fsm_storage():
+    """Тестирование хранилища состояний FSM"""
+    print("🔍 Тестирование хранилища FSM...")
+    
+    import tempfile
+    import shutil
+    import time
+    import aiosqlite
+    from aiogram.fsm.storage.base import StorageKey
+    from fsm_storage import SQLiteFSMStorage
+    from handlers import FeedbackStates
+    
+    temp_dir = tempfile.mkdtemp()
+    path = os.path.join(temp_dir, "fsm.db")
+    
+    async def rows():
+        async with aiosqlite.connect(path) as conn:
+            async with conn.execute("SELECT key, state FROM fsm_state ORDER BY key") as cursor:
+                return await cursor.fetchall()
+    
+    def key(user_id):
+        return StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+    
+    try:
+        fsm = SQLiteFSMStorage(path, max_size=2, flush_interval=60)
+        await fsm.open()
+        await fsm.set_state(key(1), FeedbackStates.waiting_for_message)
+        await fsm.update_data(key(1), {"category": "HR и кадры"})
+        assert await fsm.get_state(key(1)) == FeedbackStates.waiting_for_message.state
+        assert await rows() == [], "Состояние записано в базу без отложенной записи"
+        await fsm.flush()
+        assert len(await rows()) == 1, "Состояние не сброшено в базу"
+        print("✅ Отложенная запись состояния")
+        
+        # Вытесненный из кэша ключ читается из базы, пустое состояние удаляет строку
+        await fsm.set_state(key(2), FeedbackStates.waiting_for_type)
+        await fsm.set_state(key(3), FeedbackStates.waiting_for_type)
+        await fsm.flush()
+        assert fsm.stats()['size'] == 2 and fsm.stats()['evicted'] >= 1
+        assert await fsm.get_data(key(1)) == {'category': "HR и кадры"}, "Данные не прочитаны из базы"
+        await fsm.set_state(key(3), None)
+        await fsm.close()
+        assert [user for user, _ in await rows()] == ["1:1:1::default", "1:2:2::default"], \
+            "Состояние не удалено при закрытии"
+        print(f"✅ LRU с чтением из базы: {fsm.stats()}")
+        
+        # Черновик переживает перезапуск, брошенные сценарии забываются
+        fsm = SQLiteFSMStorage(path, ttl=60, flush_interval=60)
+        await fsm.open()
+        assert await fsm.get_state(key(1)) == FeedbackStates.waiting_for_message.state, \
+            "Состояние потеряно при перезапуске"
+        async with aiosqlite.connect(path) as conn:
+            await conn.execute("UPDATE fsm_state SET updated_at = ? WHERE key = '1:2:2::default'",
+                               (time.time() - 120,))
+            await conn.commit()
+        assert await fsm.get_state(key(2)) is None, "Устаревшее состояние прочитано"
+        fsm._cache["1:1:1::default"] = fsm._cache["1:1:1::default"]._replace(updated_at=time.time() - 120)
+        assert await fsm.get_state(key(1)) is None, "Устаревшее состояние в кэше"
+        assert await fsm.sweep() == 1 and len(await rows()) == 1, "Устаревшие строки не удалены"
+        await fsm.close()
+        print(f"✅ Состояния переживают перезапуск и устаревают: {fsm.stats()}")
+        
+        print("🎉 Тестирование хранилища FSM завершено!")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Ошибка тестирования хранилища FSM: {e}")
+        return False
+    finally:
+        await fsm.close()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+async def test_search():
+    """Тестирование полнотекстового поиска"""
+    print("🔍 Тестирование поиска...")
+    
+    import tempfile
+    import shutil
+    from aiogram import Bot, Dispatcher
+    from benchmark import ADMIN_ID, RecordingSession, callback_update, message_update
+    from search import search_terms, snippet
+    from storage import MemoryStorage
+    import admin_handlers
+    
+    temp_dir = tempfile.mkdtemp()
+    db = Database(os.path.join(temp_dir, "search.db"))
+    memory = MemoryStorage()
+    try:
+        await db.init_db()
+        await memory.init_db()
+        
+        assert search_terms("Конвейера ЕЩЁ конвейер") == ["конвейер", "еще"], search_terms("Конвейера ЕЩЁ конвейер")
+        text = snippet("Шумит <старый> конвейер", ["конвейер"])
+        assert text == "Шумит &lt;старый&gt; <b>конвейер</b>", text
+        print("✅ Основы слов и фрагменты с выделением")
+        
+        messages = [
+            "Конвейер на линии сборки останавливается каждый час",
+            "Шумный конвейер мешает работать",
+            "Нет питьевой воды в цехе",
+            "Конвейеры в цехе литья стоят, ещё и шум",
+        ] + [f"Конвейерная лента номер {i} требует смазки" for i in range(8)]
+        for storage in (db, memory):
+            for index, message in enumerate(messages):
+                await storage.add_feedback(
+                    user_id=100 + index, username="user", first_name="Тест", last_name="",
+                    category=FEEDBACK_CATEGORIES['assembly'], feedback_type="complaint",
+                    message=message
+                )
+            # Текст ответа попадает в индекс при закрытии заявки
+            await storage.update_feedback_status(3, "closed", admin_id=1,
+                                                 admin_response="Кулер поставили")
+        
+        for storage in (db, memory):
+            name = type(storage).__name__
+            assert await storage.count_search(search_terms("конвейера")) == 11, name
+            assert await storage.count_search(search_terms("кулер")) == 1, name
+            assert await storage.count_search(search_terms("еще шум")) == 1, name
+            assert await storage.count_search(search_terms("конвейер"), status="closed") == 0, name
+            
+            # Все страницы вперед и обратно без пропусков и повторов
+            pages, cursor = [], None
+            while True:
+                page = await storage.search_feedback(search_terms("конвейер"), cursor=cursor, limit=4)
+                pages.append([row['id'] for row in page['items']])
+                cursor = page['next_cursor']
+                if cursor is None:
+                    break
+            found = [feedback_id for ids in pages for feedback_id in ids]
+            assert sorted(found) == [1, 2, 4, *range(5, 13)], f"{name}: {pages}"
+            back = await storage.search_feedback(search_terms("конвейер"), cursor=page['prev_cursor'],
+                                                 direction='prev', limit=4)
+            assert [row['id'] for row in back['items']] == pages[-2], f"{name}: {back}"
+        
+        # Лучшее совпадение — короткий текст с искомым словом, а не длинный
+        page = await db.search_feedback(search_terms("конвейер"), limit=1)
+        assert page['items'][0]['id'] == 2, page['items']
+        print("✅ Поиск с фильтрами, bm25 и курсорами в SQLite и в памяти")
+        
+        # Сценарий администратора: запрос и листание страниц
+        session = RecordingSession()
+        bot = Bot("123456:test", session=session)
+        dp = Dispatcher()
+        dp.include_router(admin_handlers.router)
+        
+        @dp.message.middleware()
+        @dp.callback_query.middleware()
+        async def db_middleware(handler, event, data):
+            data['db'] = db
+            return await handler(event, data)
+        
+        await dp.feed_update(bot, callback_update(ADMIN_ID, "admin_search"))
+        await dp.feed_update(bot, message_update(ADMIN_ID, "конвейер category=assembly"))
+        next_page = session.last_markup[ADMIN_ID].inline_keyboard[0][-1].callback_data
+        assert next_page.startswith("asearch:2:n:"), next_page
+        await dp.feed_update(bot, callback_update(ADMIN_ID, next_page))
+        assert session.calls['EditMessageText'] == 2, session.calls
+        print(f"✅ Поиск из админ-панели: {dict(session.calls)}")
+        
+        print("🎉 Тестирование поиска завершено!")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Ошибка тестирования поиска: {e}")
+        return False
+    finally:
+        await db.close()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+async def test_storage():
+    """Тестирование движков хранилища"""
+    print("🔍 Тестирование движков хранилища...")
+    
+    import tempfile
+    import shutil
+    import time
+    from storage import FeedbackStorage, MaintenanceStorage, MemoryStorage, ShardedStorage
+    
+    tmp_dir = tempfile.mkdtemp()
+    engines = {
+        'sqlite': Database(os.path.join(tmp_dir, "single.db")),
+        'memory': MemoryStorage(),
+        'sharded': ShardedStorage(
+            [os.path.join(tmp_dir, f"shard{i}.db") for i in range(3)], shard_by='category'
+        ),
+    }
+    categories = list(FEEDBACK_CATEGORIES.values())
+    
+    async def workload(db):
+        await db.init_db()
+        await db.add_user(1, "worker", "Test", None)
+        await db.set_admin(1)
+        ids = []
+        for i in range(24):
+            ids.append(await db.add_feedback(
+                user_id=1 + i % 2, username=None, first_name="Test", last_name=None,
+                category=categories[i % len(categories)], feedback_type="complaint",
+                # Длинные тексты обрезаются в списках до PREVIEW_LENGTH
+                message=f"Заявка {i} " + "подробности " * (i % 4) * 4
+            ))
+        for feedback_id in ids[:10]:
+            await db.update_feedback_status(feedback_id, "closed", admin_id=1,
+                                            admin_response="Готово" if feedback_id in ids[:3] else None)
+        # Несуществующая заявка: уведомление не записывается
+        await db.update_feedback_status(10 ** 6, "closed", notifications=lambda fid: [
+            {'chat_id': 1, 'text': f"Заявка #{fid} закрыта"}
+        ])
+        
+        # Обход всех страниц пользователя вперед и обратно
+        pages, cursor = [], None
+        while True:
+            page = await db.get_feedback_by_user(1, cursor=cursor, limit=5)
+            # Строки списка без id и времени создания, которые у движков различаются
+            pages.append([row._replace(id=None, created_at=None) for row in page['items']])
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+        back = await db.get_feedback_by_user(1, cursor=page['prev_cursor'], limit=5, direction='prev')
+        
+        return {
+            'admin': bool(await db.is_admin(1)),
+            'stats': await db.get_stats(),
+            'by_category': (await db.get_breakdown())['by_category'],
+            'closed_in_category': await db.count_feedback(status="closed", category=categories[0]),
+            'user_pages': [len(page) for page in pages],
+            'user_rows': sorted(row for page in pages for row in page),
+            'back_page': len(back['items']),
+            'outbox': await db.get_outbox_stats(),
+            'categories': [row['name'] for row in await db.get_categories()],
+            'feedback': (await db.get_feedback_by_id(ids[3]))['message'],
+            'exported': sum([len(chunk) async for chunk in db.iter_feedback(chunk_size=7)]),
+        }
+    
+    try:
+        results = {}
+        for name, db in engines.items():
+            assert isinstance(db, FeedbackStorage), f"{name} не реализует FeedbackStorage"
+            # Обслуживание файлов — только у движков SQLite
+            assert isinstance(db, MaintenanceStorage) == (name != 'memory'), \
+                f"{name}: ошибка проверки MaintenanceStorage"
+            assert db.get_query_stats() == [] or db.profiler is not None, \
+                f"{name}: статистика запросов без профилировщика"
+            results[name] = await workload(db)
+        assert results['memory'] == results['sqlite'], "MemoryStorage расходится с SQLite"
+        assert results['sharded'] == results['sqlite'], "ShardedStorage расходится с SQLite"
+        assert results['sqlite']['user_pages'] == [5, 5, 2], "Ошибка страниц по курсору"
+        user_rows = results['sqlite']['user_rows']
+        assert all(len(row.preview) <= PREVIEW_LENGTH + 3 for row in user_rows) and \
+            sum(row.preview.endswith('...') for row in user_rows) == 6, "Ошибка начала текста в списке"
+        assert sum(bool(row.has_response) for row in user_rows) == 2, "Ошибка признака ответа"
+        assert await engines['sharded'].archive_closed("2000-01-01 00:00:00") == 0, \
+            "Ошибка архивирования шардов без закрытых заявок"
+        shard_sizes = [(await shard.get_stats())['total'] for shard in engines['sharded'].shards]
+        assert sum(shard_sizes) == 24 and max(shard_sizes) < 24, f"Заявки не распределены: {shard_sizes}"
+        print(f"✅ Одинаковые результаты движков, заявок по шардам: {shard_sizes}")
+        
+        timings = {}
+        for name in ('sqlite', 'memory'):
+            db = engines[name]
+            started = time.perf_counter()
+            for i in range(200):
+                feedback_id = await db.add_feedback(
+                    user_id=3, username=None, first_name="Test", last_name=None,
+                    category=categories[0], feedback_type="suggestion", message="Скорость"
+                )
+                await db.get_feedback_by_id(feedback_id)
+                await db.get_feedback_by_user(3, limit=5)
+            timings[name] = time.perf_counter() - started
+        speedup = timings['sqlite'] / timings['memory']
+        assert speedup >= 10, f"MemoryStorage быстрее SQLite лишь в {speedup:.1f} раза"
+        print(f"✅ MemoryStorage быстрее SQLite в {speedup:.0f} раз")
+        
+        print("🎉 Тестирование движков хранилища завершено!")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Ошибка тестирования движков хранилища: {e}")
+        return False
+    finally:
+        for db in engines.values():
+            await db.close()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
 def test_config():
     """Тестирование конфигурации"""
     print("🔍 Тестирование конфигурации...")
@@ -143,6 +1223,51 @@ def test_imports():
         import database
         print("✅ database.py импортирован")
         
+        import outbound
+        print("✅ outbound.py импортирован")
+        
+        import outbox
+        print("✅ outbox.py импортирован")
+        
+        import metrics
+        print("✅ metrics.py импортирован")
+        
+        import query_profiler
+        print("✅ query_profiler.py импортирован")
+        
+        import loop_watchdog
+        print("✅ loop_watchdog.py импортирован")
+        
+        import export
+        print("✅ export.py импортирован")
+        
+        import archive
+        print("✅ archive.py импортирован")
+        
+        import throttling
+        print("✅ throttling.py импортирован")
+        
+        import dedup
+        print("✅ dedup.py импортирован")
+        
+        import storage
+        print("✅ storage.py импортирован")
+        
+        import cache
+        print("✅ cache.py импортирован")
+        
+        import webhook
+        print("✅ webhook.py импортирован")
+        
+        import workers
+        print("✅ workers.py импортирован")
+        
+        import fsm_storage
+        print("✅ fsm_storage.py импортирован")
+        
+        import search
+        print("✅ search.py импортирован")
+        
         import config
         print("✅ config.py импортирован")
         
@@ -160,7 +1285,20 @@ async def main():
     tests = [
         ("Импорты", test_imports),
         ("Конфигурация", test_config),
-        ("База данных", test_database)
+        ("База данных", test_database),
+        ("Исходящие сообщения", test_outbound),
+        ("Метрики", test_metrics),
+        ("Профилирование запросов", test_query_profiler),
+        ("Задержка цикла", test_loop_watchdog),
+        ("Выгрузка", test_export),
+        ("Архив", test_archive),
+        ("Ограничение частоты", test_throttling),
+        ("Дубликаты заявок", test_dedup),
+        ("Движки хранилища", test_storage),
+        ("Вебхук", test_webhook),
+        ("Рабочие процессы", test_supervisor),
+        ("Хранилище FSM", test_fsm_storage),
+        ("Поиск", test_search)
     ]
     
     passed = 0
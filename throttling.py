@@ -0,0 +1,95 @@
+"""
+Ограничение частоты запросов пользователей.
+
+ThrottlingMiddleware держит в памяти ведро токенов на каждую пару
+(пользователь, класс хендлера) и вытесняет давно неактивных
+пользователей (LRU). Класс хендлера задается флагом при регистрации:
+
+    @router.message(F.text == "📊 Мои заявки", flags={"throttling": "list"})
+
+Хендлеры без флага относятся к классу "default". Лишние нажатия не
+доходят до хендлера: на callback отвечаем коротким уведомлением (иначе
+у пользователя крутятся часики на кнопке), на сообщение — один раз
+предупреждаем и дальше молча отбрасываем, пока ведро не наполнится.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Tuple
+
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import CallbackQuery, Message
+
+from metrics import THROTTLED, Counter
+from outbound import TokenBucket
+
+THROTTLED_TEXT = "⏳ Слишком много запросов, подождите немного."
+
+
+class _UserLimit:
+    __slots__ = ('bucket', 'warned')
+
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        self.warned = False
+
+
+class ThrottlingMiddleware:
+    """Middleware диспетчера: ведра токенов на пользователя и класс хендлера"""
+
+    def __init__(self, limits: Dict[str, Tuple[float, float]], admin_ids: Iterable[int] = (),
+                 admin_multiplier: float = 0, max_users: int = 10000,
+                 throttled: Counter = THROTTLED):
+        # limits: класс -> (токенов в секунду, емкость ведра); 'default' обязателен
+        self.limits = limits
+        self.admin_ids = set(admin_ids)
+        # 0 — администраторы не ограничиваются, иначе их лимиты умножаются
+        self.admin_multiplier = admin_multiplier
+        self.max_users = max_users
+        self.throttled = throttled
+        self._users: "OrderedDict[Tuple[int, str], _UserLimit]" = OrderedDict()
+
+    def _limit(self, user_id: int, throttle_class: str) -> _UserLimit:
+        key = (user_id, throttle_class)
+        limit = self._users.get(key)
+        if limit is not None:
+            self._users.move_to_end(key)
+            return limit
+
+        rate, burst = self.limits.get(throttle_class) or self.limits['default']
+        if user_id in self.admin_ids:
+            rate, burst = rate * self.admin_multiplier, burst * self.admin_multiplier
+        limit = self._users[key] = _UserLimit(TokenBucket(rate, burst))
+
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+        return limit
+
+    async def __call__(self, handler, event, data):
+        user = data.get('event_from_user')
+        if user is None or (user.id in self.admin_ids and not self.admin_multiplier):
+            return await handler(event, data)
+
+        throttle_class = get_flag(data, "throttling", default="default")
+        limit = self._limit(user.id, throttle_class)
+
+        if limit.bucket.try_take(time.monotonic()):
+            limit.warned = False
+            return await handler(event, data)
+
+        update = data.get('event_update')
+        self.throttled.inc(
+            throttle_class=throttle_class,
+            update_type=update.event_type if update is not None else type(event).__name__
+        )
+
+        if isinstance(event, CallbackQuery):
+            await event.answer(THROTTLED_TEXT)
+        elif isinstance(event, Message) and not limit.warned:
+            limit.warned = True
+            await event.answer(THROTTLED_TEXT)
+        return None
+
+    def stats(self) -> Dict:
+        """Число отслеживаемых пар (пользователь, класс)"""
+        return {'tracked': len(self._users)}
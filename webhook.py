@@ -0,0 +1,207 @@
+"""
+Прием апдейтов через вебхук (альтернатива long polling).
+
+WebhookServer — aiohttp-приложение с одним POST-маршрутом. Запрос
+проверяется по заголовку X-Telegram-Bot-Api-Secret-Token, апдейт кладется
+в UpdateQueue и сразу подтверждается ответом 200.
+
+UpdateQueue раскладывает апдейты по очередям-разделам по хэшу чата, и
+каждую очередь по порядку разбирает своя задача: апдейты одного чата
+обрабатываются последовательно (шаги FSM не обгоняют друг друга), а
+одновременно — не больше числа разделов. Если очередь заполнена, сервер
+отвечает 503 с Retry-After: Telegram повторит доставку позже, а мы не
+копим в памяти неограниченный хвост. Та же очередь распределяет апдейты
+по рабочим процессам в workers.py.
+"""
+
+import asyncio
+import hmac
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from pydantic import ValidationError
+
+from metrics import UPDATE_QUEUE_LATENCY, WEBHOOK_REQUESTS, Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def update_key(update: Update) -> int:
+    """Ключ раздела апдейта: id чата, иначе id пользователя, иначе номер апдейта"""
+    try:
+        event = update.event
+    except Exception:
+        return update.update_id
+    chat = getattr(event, 'chat', None)
+    if chat is None and getattr(event, 'message', None) is not None:
+        # callback_query: чат сообщения с кнопкой
+        chat = getattr(event.message, 'chat', None)
+    if chat is not None:
+        return chat.id
+    user = getattr(event, 'from_user', None)
+    return user.id if user is not None else update.update_id
+
+
+def feed_dispatcher(dp: Dispatcher, bot: Bot) -> Callable[[int, Update], Awaitable]:
+    """Обработчик UpdateQueue, передающий апдейты диспетчеру"""
+    async def process(partition: int, update: Update):
+        await dp.feed_update(bot, update)
+    return process
+
+
+class UpdateQueue:
+    """Ограниченные очереди апдейтов по разделам с обработчиком на каждую"""
+
+    def __init__(self, process: Callable[[int, Update], Awaitable], partitions: int = 16,
+                 queue_size: int = 1000, latency: Histogram = UPDATE_QUEUE_LATENCY):
+        self.process = process
+        self.partitions = max(1, partitions)
+        # Емкость делится между разделами
+        self.queue_size = max(self.partitions, queue_size)
+        self.latency = latency
+        self._queues: List[asyncio.Queue] = []
+        self._tasks: List[asyncio.Task] = []
+        self._stats = {'processed': 0, 'failed': 0}
+
+    def start(self):
+        if self._tasks:
+            return
+        per_queue = self.queue_size // self.partitions
+        self._queues = [asyncio.Queue(maxsize=per_queue) for _ in range(self.partitions)]
+        self._tasks = [asyncio.create_task(self._worker(index), name=f"update-queue-{index}")
+                       for index in range(self.partitions)]
+
+    async def stop(self, timeout: float = 10):
+        """Дообработка принятых апдейтов (не дольше timeout) и остановка обработчиков"""
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(queue.join() for queue in self._queues)), timeout
+            )
+        except asyncio.TimeoutError:
+            logger.warning("Очередь апдейтов остановлена, необработанных: %s", self.pending())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def partition(self, update: Update) -> int:
+        return update_key(update) % self.partitions
+
+    def submit(self, update: Update, received: float = None) -> bool:
+        """Апдейт в очередь без ожидания; False, если раздел заполнен"""
+        try:
+            self._queues[self.partition(update)].put_nowait(
+                (update, received or time.perf_counter())
+            )
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    async def put(self, update: Update, received: float = None):
+        """Апдейт в очередь с ожиданием свободного места"""
+        await self._queues[self.partition(update)].put((update, received or time.perf_counter()))
+
+    def pending(self) -> int:
+        return sum(queue.qsize() for queue in self._queues)
+
+    async def _worker(self, index: int):
+        queue = self._queues[index]
+        while True:
+            update, received = await queue.get()
+            self.latency.observe(time.perf_counter() - received, stage="queue")
+            try:
+                await self.process(index, update)
+                self._stats['processed'] += 1
+            except Exception:
+                self._stats['failed'] += 1
+                logger.exception("Ошибка обработки апдейта %s", update.update_id)
+            finally:
+                self.latency.observe(time.perf_counter() - received, stage="total")
+                queue.task_done()
+
+    def stats(self) -> Dict:
+        """Обработанные апдейты и длина очередей"""
+        return {'queued': self.pending(), 'partitions': len(self._tasks), **self._stats}
+
+
+class WebhookServer:
+    """HTTP-прием апдейтов в UpdateQueue"""
+
+    def __init__(self, queue: UpdateQueue, bot: Bot, path: str = "/webhook",
+                 secret_token: str = None, retry_after: int = 1,
+                 requests: Counter = WEBHOOK_REQUESTS):
+        self.queue = queue
+        self.bot = bot
+        self.path = path
+        self.secret_token = secret_token
+        self.retry_after = retry_after
+        self.requests = requests
+        self._runner: Optional[web.AppRunner] = None
+        self._stats = {'accepted': 0, 'unauthorized': 0, 'invalid': 0, 'overloaded': 0}
+
+    def app(self) -> web.Application:
+        """aiohttp-приложение с маршрутом вебхука (для запуска и тестов)"""
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        app.on_startup.append(self._on_startup)
+        app.on_cleanup.append(self._on_cleanup)
+        return app
+
+    async def _on_startup(self, app: web.Application):
+        self.queue.start()
+
+    async def _on_cleanup(self, app: web.Application):
+        await self.queue.stop()
+
+    async def start(self, host: str = "0.0.0.0", port: int = 8080):
+        """Запуск HTTP-сервера; остановка — stop()"""
+        self._runner = web.AppRunner(self.app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        logger.info("Вебхук принимает апдейты на http://%s:%s%s", host, port, self.path)
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def _reject(self, result: str, status: int, **kwargs) -> web.Response:
+        self._stats[result] += 1
+        self.requests.inc(result=result)
+        return web.Response(status=status, **kwargs)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        received = time.perf_counter()
+        if self.secret_token is not None and not hmac.compare_digest(
+            request.headers.get(SECRET_HEADER, ""), self.secret_token
+        ):
+            return self._reject('unauthorized', 401)
+
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except (ValueError, ValidationError):
+            return self._reject('invalid', 400)
+
+        if not self.queue.running or not self.queue.submit(update, received):
+            return self._reject('overloaded', 503, headers={'Retry-After': str(self.retry_after)})
+
+        self._stats['accepted'] += 1
+        self.requests.inc(result='accepted')
+        return web.Response()
+
+    def stats(self) -> Dict:
+        """Принятые и отклоненные запросы, состояние очереди"""
+        return {**self.queue.stats(), **self._stats}
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Тестовый клиент вебхука: отправка записанных апдейтов и замер задержек.
+
+Апдейты читаются из JSONL (по одному объекту Update в строке, как их
+присылает Telegram) или генерируются: сценарий отправки заявки для
+заданного числа пользователей. Апдейты одного пользователя отправляются
+последовательно, разных — параллельно; на ответ 503 клиент, как и
+Telegram, повторяет запрос после Retry-After.
+
+Без --url бот поднимается в этом же процессе (WebhookServer, настоящие
+роутеры, MemoryStorage и RecordingSession вместо Telegram), и кроме
+времени ответа сервера измеряется полная задержка: от отправки апдейта
+до окончания его обработки диспетчером. С --processes N бот запускается
+как при BOT_WORKERS=N (супервизор и N процессов на временной базе SQLite);
+время работы тогда считается до обработки всех апдейтов процессами.
+
+    python webhook_client.py --users 200 --concurrency 50
+    python webhook_client.py --users 500 --concurrency 100 --processes 4
+    python webhook_client.py --users 50 --save updates.jsonl
+    python webhook_client.py updates.jsonl --url http://localhost:8080/webhook --secret ...
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List
+
+import aiohttp
+from aiohttp.test_utils import TestServer
+
+# benchmark выставляет переменные окружения тестового запуска до импорта config
+from benchmark import (
+    ADMIN_ID, LatencyRecorder, RecordingSession, callback_update, message_update,
+    print_table, random_message
+)
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from config import FEEDBACK_CATEGORIES, FEEDBACK_TYPES
+from database import Database
+from outbound import SharedChatBuckets, SharedTokenBucket
+from storage import MemoryStorage
+from webhook import SECRET_HEADER, UpdateQueue, WebhookServer, feed_dispatcher, update_key
+from workers import CONTEXT, Supervisor
+import handlers
+import admin_handlers
+
+LOCAL_SECRET = "webhook-client"
+
+
+def generate_updates(users: int, first_user: int = 2_000_000) -> List[Dict]:
+    """Апдейты сценария отправки заявки для users пользователей"""
+    updates = []
+    for user_id in range(first_user, first_user + users):
+        for update in (
+            message_update(user_id, "/start"),
+            message_update(user_id, "📝 Оставить обратную связь"),
+            callback_update(user_id, f"type_{random.choice(list(FEEDBACK_TYPES))}"),
+            callback_update(user_id, f"cat_{random.choice(list(FEEDBACK_CATEGORIES))}"),
+            message_update(user_id, random_message()),
+            callback_update(user_id, "confirm_send"),
+        ):
+            updates.append(update.model_dump(mode="json", exclude_none=True, by_alias=True))
+    return updates
+
+
+def load_updates(path: str) -> List[Dict]:
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def save_updates(path: str, updates: List[Dict]):
+    with open(path, "w", encoding='utf-8') as f:
+        for update in updates:
+            f.write(json.dumps(update, ensure_ascii=False) + "\n")
+
+
+def by_sender(updates: List[Dict]) -> List[List[Dict]]:
+    """Апдейты, сгруппированные по отправителю с сохранением порядка"""
+    groups = defaultdict(list)
+    for update in updates:
+        groups[update_key(Update.model_validate(update))].append(update)
+    return list(groups.values())
+
+
+async def post_updates(url: str, secret: str, updates: List[Dict], concurrency: int,
+                       sent: Dict[int, float] = None):
+    """Отправка апдейтов; возвращает задержки ответа, коды ответов и время работы"""
+    acks = LatencyRecorder()
+    statuses = Counter()
+    semaphore = asyncio.Semaphore(concurrency)
+    headers = {SECRET_HEADER: secret} if secret else {}
+
+    async with aiohttp.ClientSession(headers=headers) as session:
+        async def send(update: Dict):
+            while True:
+                started = time.perf_counter()
+                if sent is not None:
+                    # Полная задержка считается от первой попытки
+                    sent.setdefault(update['update_id'], started)
+                async with session.post(url, json=update) as response:
+                    acks.add("ack", time.perf_counter() - started)
+                    statuses[response.status] += 1
+                    if response.status != 503:
+                        return
+                    retry_after = float(response.headers.get('Retry-After', 1))
+                await asyncio.sleep(retry_after)
+
+        async def sender(group: List[Dict]):
+            async with semaphore:
+                for update in group:
+                    await send(update)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(sender(group) for group in by_sender(updates)))
+        elapsed = time.perf_counter() - started
+
+    return acks, statuses, elapsed
+
+
+async def run_local(updates: List[Dict], args):
+    """Бот с вебхуком в этом процессе: задержка ответа и полная задержка обработки"""
+    bot = Bot(token="123456:webhook-client", session=RecordingSession())
+    dp = Dispatcher()
+    db = MemoryStorage()
+    await db.init_db()
+    dp.include_router(handlers.router)
+    dp.include_router(admin_handlers.router)
+
+    @dp.message.middleware()
+    @dp.callback_query.middleware()
+    async def db_middleware(handler, event, data):
+        data['db'] = db
+        return await handler(event, data)
+
+    sent: Dict[int, float] = {}
+    processed = LatencyRecorder()
+
+    @dp.update.outer_middleware()
+    async def done_middleware(handler, event, data):
+        try:
+            return await handler(event, data)
+        finally:
+            if event.update_id in sent:
+                processed.add("end_to_end", time.perf_counter() - sent[event.update_id])
+
+    queue = UpdateQueue(feed_dispatcher(dp, bot), partitions=args.workers,
+                        queue_size=args.queue_size)
+    webhook = WebhookServer(queue, bot, secret_token=LOCAL_SECRET)
+    server = TestServer(webhook.app())
+    await server.start_server()
+    try:
+        # Админ регистрируется один раз, как после /start
+        await dp.feed_update(bot, message_update(ADMIN_ID, "/start"))
+        result = await post_updates(str(server.make_url(webhook.path)), LOCAL_SECRET,
+                                    updates, args.concurrency, sent)
+    finally:
+        # Закрытие сервера дожидается обработки принятых апдейтов
+        await server.close()
+        await db.close()
+    return result, processed, webhook.stats()
+
+
+async def run_processes(updates: List[Dict], args):
+    """Супервизор с args.processes рабочими процессами и временной базой SQLite"""
+    tempdir = tempfile.mkdtemp(prefix="webhook-client-")
+    # Настройки читаются рабочими процессами при запуске; как и в однопроцессном
+    # замере, лимиты Telegram не ограничивают обработку
+    os.environ.update(
+        DATABASE_PATH=os.path.join(tempdir, "feedback.db"), STORAGE_ENGINE="sqlite",
+        METRICS_PORT="0", OUTBOUND_GLOBAL_RATE="100000", OUTBOUND_CHAT_RATE="100000"
+    )
+    db = Database(os.environ['DATABASE_PATH'])
+    await db.init_db()
+
+    supervisor = Supervisor(
+        args.processes, SharedTokenBucket(100000, 100000, CONTEXT),
+        SharedChatBuckets(100000, 100000, context=CONTEXT),
+        queue_size=args.queue_size, outbox_event=db.outbox_event,
+        session_factory=RecordingSession
+    )
+    bot = Bot(token="123456:webhook-client", session=RecordingSession())
+    webhook = WebhookServer(supervisor.queue, bot, secret_token=LOCAL_SECRET)
+    await supervisor.start()
+    server = TestServer(webhook.app())
+    await server.start_server()
+    started = time.perf_counter()
+    try:
+        await supervisor.queue.put(message_update(ADMIN_ID, "/start"))
+        acks, statuses, _ = await post_updates(str(server.make_url(webhook.path)), LOCAL_SECRET,
+                                               updates, args.concurrency)
+    finally:
+        await server.close()
+        # Остановка дожидается обработки всех переданных апдейтов
+        await supervisor.stop()
+        elapsed = time.perf_counter() - started
+        await db.close()
+        shutil.rmtree(tempdir, ignore_errors=True)
+    return (acks, statuses, elapsed), None, {**webhook.stats(), **supervisor.stats()}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Тестовый клиент вебхука бота")
+    parser.add_argument("updates", nargs="?", help="JSONL с записанными апдейтами")
+    parser.add_argument("--users", type=int, default=100,
+                        help="Сгенерировать сценарий отправки заявки для N пользователей")
+    parser.add_argument("--save", help="Сохранить апдейты в JSONL и выйти")
+    parser.add_argument("--url", help="Адрес работающего вебхука (без него бот запускается локально)")
+    parser.add_argument("--secret", default="", help="Секрет вебхука (WEBHOOK_SECRET)")
+    parser.add_argument("--concurrency", type=int, default=20, help="Одновременных отправителей")
+    parser.add_argument("--workers", type=int, default=16, help="Обработчиков локального вебхука")
+    parser.add_argument("--queue-size", type=int, default=1000, help="Очередь локального вебхука")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="Рабочих процессов локального бота (BOT_WORKERS)")
+    args = parser.parse_args()
+
+    random.seed(42)
+    updates = load_updates(args.updates) if args.updates else generate_updates(args.users)
+    if args.save:
+        save_updates(args.save, updates)
+        print(f"💾 {len(updates)} апдейтов сохранены в {args.save}")
+        return
+
+    processed = stats = None
+    if args.url:
+        acks, statuses, elapsed = await post_updates(args.url, args.secret, updates, args.concurrency)
+    elif args.processes > 1:
+        (acks, statuses, elapsed), processed, stats = await run_processes(updates, args)
+    else:
+        (acks, statuses, elapsed), processed, stats = await run_local(updates, args)
+
+    print(f"\n🚀 {len(updates)} апдейтов за {elapsed:.2f} с ({len(updates) / elapsed:.1f}/с)")
+    print(f"  Ответы сервера: {dict(sorted(statuses.items()))}")
+    summary = acks.summary()
+    if processed is not None:
+        summary.update(processed.summary())
+    print_table("Задержки", summary)
+    if stats is not None:
+        print(f"\n  Вебхук: {stats}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
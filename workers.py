@@ -0,0 +1,288 @@
+"""
+Многопроцессный режим: супервизор и рабочие процессы.
+
+Супервизор (BOT_WORKERS > 1) один принимает апдейты — вебхуком или
+одним поллером getUpdates — и раскладывает их по рабочим процессам по
+хэшу чата (UpdateQueue с разделом на процесс). Поэтому сценарий
+каждого пользователя, включая состояние FSM, целиком обрабатывается одним
+процессом и в исходном порядке, а хендлеры, построение статистики и
+выгрузки разных чатов выполняются на разных ядрах.
+
+Связь с процессами — Unix-сокет: супервизор пишет апдейты построчно в
+JSON, процесс отвечает сигналом о новых уведомлениях в outbox. Общее между
+процессами:
+
+- лимиты исходящих сообщений Telegram — SharedTokenBucket и
+  SharedChatBuckets в разделяемой памяти: в чат пишет не только его
+  процесс, но и OutboxWorker супервизора;
+- база данных — у каждого процесса свой пул и своя групповая запись,
+  запись разных процессов упорядочивает блокировка файла SQLite;
+- outbox и архивирование выполняет только супервизор.
+
+Упавший процесс перезапускается; апдейты его раздела ждут в очереди
+супервизора, а при ее заполнении вебхук отвечает 503.
+"""
+
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.methods import GetUpdates
+from aiogram.types import Update
+
+from outbound import SharedChatBuckets, SharedTokenBucket
+from webhook import UpdateQueue
+
+logger = logging.getLogger(__name__)
+
+# Рабочие процессы запускаются "с нуля": без копии цикла и соединений супервизора
+CONTEXT = multiprocessing.get_context("spawn")
+
+
+def _message(**fields) -> bytes:
+    return json.dumps(fields).encode() + b"\n"
+
+
+class Supervisor:
+    """Запуск рабочих процессов и маршрутизация апдейтов по хэшу чата"""
+
+    def __init__(self, workers: int, global_bucket: SharedTokenBucket = None,
+                 chat_buckets: SharedChatBuckets = None, queue_size: int = 1000,
+                 outbox_event: asyncio.Event = None,
+                 session_factory: Callable = None, start_timeout: float = 60):
+        self.workers = workers
+        self.global_bucket = global_bucket
+        self.chat_buckets = chat_buckets
+        # Сигнал OutboxWorker супервизора о новых уведомлениях процессов
+        self.outbox_event = outbox_event
+        # Фабрика сессии бота для процессов (подмена Telegram в тестах)
+        self.session_factory = session_factory
+        self.start_timeout = start_timeout
+        self.queue = UpdateQueue(self._forward, partitions=workers, queue_size=queue_size)
+        self._processes: List[Optional[multiprocessing.Process]] = [None] * workers
+        self._writers: List[Optional[asyncio.StreamWriter]] = [None] * workers
+        self._connected = [asyncio.Event() for _ in range(workers)]
+        self._tempdir: Optional[tempfile.TemporaryDirectory] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._monitor: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._stats = {'restarts': 0, 'forwarded': [0] * workers}
+
+    @property
+    def address(self) -> str:
+        return os.path.join(self._tempdir.name, "supervisor.sock")
+
+    async def start(self):
+        """Запуск процессов; возвращается, когда все подключились"""
+        self._tempdir = tempfile.TemporaryDirectory(prefix="feedback-bot-")
+        self._server = await asyncio.start_unix_server(self._on_connect, path=self.address)
+        for index in range(self.workers):
+            self._spawn(index)
+        deadline = time.monotonic() + self.start_timeout
+        while not all(event.is_set() for event in self._connected):
+            failed = [index for index, process in enumerate(self._processes)
+                      if not process.is_alive()]
+            if failed or time.monotonic() > deadline:
+                await self.stop()
+                raise RuntimeError(f"Рабочие процессы не запустились: {failed or 'таймаут'}")
+            await asyncio.sleep(0.1)
+        self.queue.start()
+        self._monitor = asyncio.create_task(self._watch(), name="supervisor-monitor")
+        logger.info("Запущено рабочих процессов: %s", self.workers)
+
+    def _spawn(self, index: int):
+        process = CONTEXT.Process(
+            target=worker_process,
+            args=(index, self.address, self.global_bucket, self.session_factory,
+                  self.chat_buckets),
+            name=f"bot-worker-{index}"
+        )
+        process.start()
+        self._processes[index] = process
+
+    async def _watch(self):
+        """Перезапуск завершившихся процессов"""
+        while True:
+            await asyncio.sleep(1)
+            for index, process in enumerate(self._processes):
+                if process is not None and not process.is_alive() and not self._stopping:
+                    logger.error("Рабочий процесс %s завершился (код %s), перезапуск",
+                                 index, process.exitcode)
+                    self._connected[index].clear()
+                    self._writers[index] = None
+                    self._stats['restarts'] += 1
+                    self._spawn(index)
+
+    async def _on_connect(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        hello = json.loads(await reader.readline())
+        index = hello['worker']
+        self._writers[index] = writer
+        self._connected[index].set()
+        try:
+            while line := await reader.readline():
+                if json.loads(line).get('type') == 'outbox' and self.outbox_event is not None:
+                    self.outbox_event.set()
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            if self._writers[index] is writer:
+                self._writers[index] = None
+                self._connected[index].clear()
+
+    async def _forward(self, index: int, update: Update):
+        """Передача апдейта процессу раздела; ждет, пока процесс доступен"""
+        data = update.model_dump_json(exclude_none=True).encode() + b"\n"
+        while True:
+            await self._connected[index].wait()
+            writer = self._writers[index]
+            try:
+                writer.write(data)
+                await writer.drain()
+            except (ConnectionError, AttributeError):
+                # Процесс упал: ждем перезапуска
+                self._connected[index].clear()
+                await asyncio.sleep(0.1)
+                continue
+            self._stats['forwarded'][index] += 1
+            return
+
+    async def stop(self, timeout: float = 30):
+        """Передача принятых апдейтов, завершение процессов и очистка"""
+        self._stopping = True
+        await self.queue.stop()
+        if self._monitor is not None:
+            self._monitor.cancel()
+            await asyncio.gather(self._monitor, return_exceptions=True)
+
+        # Конец потока апдейтов — сигнал процессу дообработать очередь и завершиться;
+        # сокет остается открытым для его последних сообщений
+        for writer in self._writers:
+            if writer is not None and writer.can_write_eof():
+                writer.write_eof()
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + timeout
+        for index, process in enumerate(self._processes):
+            if process is None:
+                continue
+            await loop.run_in_executor(None, process.join, max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning("Рабочий процесс %s не завершился, остановка", index)
+                process.terminate()
+                await loop.run_in_executor(None, process.join)
+
+        for writer in self._writers:
+            if writer is not None:
+                writer.close()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if self._tempdir is not None:
+            self._tempdir.cleanup()
+
+    def stats(self) -> Dict:
+        """Живые процессы, перезапуски и переданные апдейты"""
+        return {
+            'workers': sum(1 for process in self._processes if process and process.is_alive()),
+            'restarts': self._stats['restarts'],
+            'forwarded': sum(self._stats['forwarded']),
+            **self.queue.stats(),
+        }
+
+
+async def poll_updates(bot: Bot, queue: UpdateQueue, allowed_updates: List[str],
+                       timeout: int = 30):
+    """Один поллер getUpdates; при заполненной очереди ждет, не запрашивая новые"""
+    offset = None
+    backoff = 1
+    while True:
+        try:
+            updates = await bot(GetUpdates(offset=offset, timeout=timeout,
+                                           allowed_updates=allowed_updates))
+        except Exception as e:
+            logger.error("Ошибка getUpdates: %s, повтор через %s с", e, backoff)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+            continue
+        backoff = 1
+        for update in updates:
+            await queue.put(update)
+            offset = update.update_id + 1
+
+
+async def run_worker(index: int, address: str, global_bucket: SharedTokenBucket = None,
+                     session_factory: Callable = None, chat_buckets: SharedChatBuckets = None):
+    """Рабочий процесс: диспетчер с хендлерами, апдейты — из сокета супервизора"""
+    # Сборка бота и диспетчера — общая с однопроцессным режимом
+    from main import (
+        create_bot, create_dispatcher, create_storage_from_config, shutdown, start_watchdog
+    )
+    from config import METRICS_PORT, WORKER_CONCURRENCY, WEBHOOK_QUEUE_SIZE
+    from metrics import start_metrics_server
+    from webhook import feed_dispatcher
+
+    watchdog = start_watchdog()
+    bot = create_bot(global_bucket, session=session_factory() if session_factory else None,
+                     chat_buckets=chat_buckets)
+    db = create_storage_from_config()
+    await db.init_db()
+    dp = await create_dispatcher(db)
+    queue = UpdateQueue(feed_dispatcher(dp, bot), partitions=WORKER_CONCURRENCY,
+                        queue_size=WEBHOOK_QUEUE_SIZE)
+    queue.start()
+
+    # Метрики каждого процесса — на своем порту
+    metrics_runner = None
+    if METRICS_PORT:
+        metrics_runner = await start_metrics_server(port=METRICS_PORT + 1 + index)
+
+    reader, writer = await asyncio.open_unix_connection(address)
+    writer.write(_message(type='hello', worker=index))
+    await writer.drain()
+
+    async def notify_outbox():
+        while True:
+            await db.outbox_event.wait()
+            db.outbox_event.clear()
+            writer.write(_message(type='outbox'))
+            await writer.drain()
+
+    notifier = asyncio.create_task(notify_outbox())
+    logger.info("Рабочий процесс %s запущен (pid %s)", index, os.getpid())
+    try:
+        while line := await reader.readline():
+            await queue.put(Update.model_validate_json(line, context={"bot": bot}))
+    except ConnectionError:
+        pass
+    finally:
+        await queue.stop()
+        notifier.cancel()
+        await asyncio.gather(notifier, return_exceptions=True)
+        # Уведомления последних апдейтов: супервизор читает сокет до нашего закрытия
+        if db.outbox_event.is_set():
+            try:
+                writer.write(_message(type='outbox'))
+                await writer.drain()
+            except ConnectionError:
+                pass
+        writer.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await shutdown(bot, db, watchdog, dp)
+        logger.info("Рабочий процесс %s остановлен", index)
+
+
+def worker_process(index: int, address: str, global_bucket: SharedTokenBucket = None,
+                   session_factory: Callable = None, chat_buckets: SharedChatBuckets = None):
+    """Точка входа рабочего процесса"""
+    # Остановкой управляет супервизор (закрытием сокета), а Ctrl+C в терминале
+    # получает вся группа процессов
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    asyncio.run(run_worker(index, address, global_bucket, session_factory, chat_buckets))